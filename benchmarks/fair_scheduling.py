@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+from collections import defaultdict
+from collections import deque
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
+from math import ceil
+from random import Random
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from opwen_email_server.utils.lanes import lane_for
+
+
+class Task(NamedTuple):
+    arrived_at: float
+    domain: str
+    service_seconds: float
+
+
+Picker = Callable[[List[Deque[Task]]], Deque[Task]]
+
+
+def generate_tasks(rng: Random, bulk_domains: int, bulk_emails: int, small_domains: int, small_emails: int,
+                   horizon_seconds: float, service_seconds: float) -> List[Task]:
+    def service_time() -> float:
+        return rng.uniform(0.5, 1.5) * service_seconds
+
+    tasks = []
+    for i in range(bulk_domains):
+        domain = f'bulk{i}.lokole.ca'
+        tasks.extend(Task(0.0, domain, service_time()) for _ in range(bulk_emails))
+
+    for i in range(small_domains):
+        domain = f'village{i}.lokole.ca'
+        tasks.extend(Task(rng.uniform(0, horizon_seconds), domain, service_time()) for _ in range(small_emails))
+
+    return sorted(tasks, key=lambda task: task.arrived_at)
+
+
+def fifo_picker() -> Picker:
+    def pick(lanes: List[Deque[Task]]) -> Deque[Task]:
+        return lanes[0]
+
+    return pick
+
+
+def round_robin_picker() -> Picker:
+    cursor = [0]
+
+    def pick(lanes: List[Deque[Task]]) -> Deque[Task]:
+        for offset in range(len(lanes)):
+            lane = (cursor[0] + offset) % len(lanes)
+            if lanes[lane]:
+                cursor[0] = lane + 1
+                return lanes[lane]
+        raise IndexError('all lanes are empty')
+
+    return pick
+
+
+def simulate(tasks: List[Task],
+             num_lanes: int,
+             num_workers: int,
+             pick: Picker,
+             max_concurrency: int = 0,
+             defer_seconds: float = 1.0,
+             defer_cost_seconds: float = 0.01) -> Dict[str, List[float]]:
+    lanes = [deque() for _ in range(num_lanes)]  # type: List[Deque[Task]]
+    workers = [0.0] * num_workers
+    heapify(workers)
+    latencies = defaultdict(list)  # type: Dict[str, List[float]]
+    in_flight = defaultdict(int)  # type: Dict[str, int]
+    releases = []  # type: List[Tuple[float, str]]
+
+    arrivals = [(task.arrived_at, i, task) for i, task in enumerate(tasks)]
+    heapify(arrivals)
+    num_arrivals = len(arrivals)
+    num_queued = 0
+    while arrivals or num_queued:
+        now = heappop(workers)
+        if not num_queued:
+            now = max(now, arrivals[0][0])
+
+        while releases and releases[0][0] <= now:
+            in_flight[heappop(releases)[1]] -= 1
+
+        while arrivals and arrivals[0][0] <= now:
+            task = heappop(arrivals)[2]
+            lanes[lane_for(task.domain, num_lanes)].append(task)
+            num_queued += 1
+
+        task = pick(lanes).popleft()
+        num_queued -= 1
+
+        if max_concurrency and in_flight[task.domain] >= max_concurrency:
+            heappush(arrivals, (now + defer_seconds, num_arrivals, task))
+            num_arrivals += 1
+            heappush(workers, now + defer_cost_seconds)
+            continue
+
+        finished_at = now + task.service_seconds
+        in_flight[task.domain] += 1
+        heappush(releases, (finished_at, task.domain))
+        latencies[task.domain].append(finished_at - task.arrived_at)
+        heappush(workers, finished_at)
+
+    return latencies
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(ceil(q * len(ordered)) - 1, 0)]
+
+
+def main():
+    parser = ArgumentParser(description='Simulate per-domain queue latency with domain lanes and concurrency tokens.')
+    parser.add_argument('--lanes', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--max-concurrency', type=int, default=2)
+    parser.add_argument('--defer-seconds', type=float, default=1.0)
+    parser.add_argument('--defer-cost-seconds', type=float, default=0.01)
+    parser.add_argument('--bulk-domains', type=int, default=1)
+    parser.add_argument('--bulk-emails', type=int, default=2000)
+    parser.add_argument('--small-domains', type=int, default=20)
+    parser.add_argument('--small-emails', type=int, default=5)
+    parser.add_argument('--horizon-seconds', type=float, default=60)
+    parser.add_argument('--service-seconds', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tasks = generate_tasks(Random(args.seed), args.bulk_domains, args.bulk_emails, args.small_domains,
+                           args.small_emails, args.horizon_seconds, args.service_seconds)
+
+    fifo = simulate(tasks, 1, args.workers, fifo_picker())
+    lanes = simulate(tasks, args.lanes, args.workers, round_robin_picker())
+    tokens = simulate(tasks, args.lanes, args.workers, round_robin_picker(), args.max_concurrency, args.defer_seconds,
+                      args.defer_cost_seconds)
+
+    print(f'{len(tasks)} tasks, {args.workers} workers, {args.lanes} lanes, '
+          f'{args.max_concurrency} tokens per domain')
+    print(f'{"domain":<24}{"lane":>6}{"tasks":>8}{"fifo p99 s":>14}{"lanes p99 s":>14}{"tokens p99 s":>14}')
+    for domain in sorted(fifo, key=lambda domain: percentile(fifo[domain], 0.99), reverse=True):
+        print(f'{domain:<24}{lane_for(domain, args.lanes):>6}{len(fifo[domain]):>8}'
+              f'{percentile(fifo[domain], 0.99):>14.2f}{percentile(lanes[domain], 0.99):>14.2f}'
+              f'{percentile(tokens[domain], 0.99):>14.2f}')
+
+    for name, latencies in (('fifo', fifo), ('lanes', lanes), ('tokens', tokens)):
+        small = [latency for domain, values in latencies.items() if domain.startswith('village') for latency in values]
+        if small:
+            print(f'{name} small-domain p50 {percentile(small, 0.5):.2f}s p99 {percentile(small, 0.99):.2f}s')
+
+
+if __name__ == '__main__':
+    main()
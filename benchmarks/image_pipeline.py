@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+from io import BytesIO
+from pathlib import Path
+from time import process_time
+from typing import Callable
+from typing import Iterable
+from typing import Tuple
+
+from PIL import Image
+
+from opwen_email_server.utils.email_parser import parse_mime_email
+from opwen_email_server.utils.image import ImageShrinker
+
+DEFAULT_CORPUS = Path(__file__).parent.parent / 'tests' / 'files' / 'opwen_email_server' / 'utils' / 'test_email_parser'
+
+
+def legacy_change_image_size(content: bytes, max_size: Tuple[int, int]) -> bytes:
+    image = Image.open(BytesIO(content))
+    width, height = image.size
+    if width <= max_size[0] and height <= max_size[1]:
+        return content
+
+    image.thumbnail(max_size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, image.format)
+    return buffer.getvalue()
+
+
+def iter_corpus(corpus: Path) -> Iterable[Tuple[str, bytes]]:
+    for path in sorted(corpus.rglob('*')):
+        if not path.is_file():
+            continue
+
+        if path.suffix == '.mime':
+            email = parse_mime_email(path.read_text())
+            for attachment in email['attachments']:
+                yield f"{path.name}:{attachment['filename']}", attachment['content']
+            continue
+
+        content = path.read_bytes()
+        try:
+            Image.open(BytesIO(content)).verify()
+        except Exception:
+            continue
+
+        yield path.name, content
+
+
+def measure(shrink: Callable[[bytes], bytes], images: Iterable[Tuple[str, bytes]], repeat: int) -> Tuple[float, int]:
+    cpu_seconds = 0.0
+    num_bytes = 0
+    num_images = 0
+
+    for _, content in images:
+        start = process_time()
+        for _ in range(repeat):
+            shrunk = shrink(content)
+        cpu_seconds += (process_time() - start) / repeat
+        num_bytes += len(shrunk)
+        num_images += 1
+
+    return cpu_seconds * 1000 / max(num_images, 1), num_bytes
+
+
+def main():
+    parser = ArgumentParser(description='Compare the legacy and current email image pipelines.')
+    parser.add_argument('corpus', nargs='?', type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument('--max-width', type=int, default=200)
+    parser.add_argument('--max-height', type=int, default=200)
+    parser.add_argument('--max-bytes', type=int, default=20 * 1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    images = list(iter_corpus(args.corpus))
+    max_size = (args.max_width, args.max_height)
+    input_bytes = sum(len(content) for _, content in images)
+
+    pipelines = (
+        ('legacy', lambda content: legacy_change_image_size(content, max_size)),
+        ('draft', ImageShrinker(*max_size)),
+        ('draft+webp', ImageShrinker(*max_size, output_format='webp')),
+        ('draft+webp+budget', ImageShrinker(*max_size, output_format='webp', max_bytes=args.max_bytes)),
+    )
+
+    print(f'{len(images)} images, {input_bytes} input bytes')
+    print(f'{"pipeline":<20}{"cpu ms/image":>15}{"output bytes":>15}')
+    for name, pipeline in pipelines:
+        shrink = pipeline if name == 'legacy' else (lambda content, pipeline=pipeline: pipeline(content)[0])
+        cpu_ms, num_bytes = measure(shrink, images, args.repeat)
+        print(f'{name:<20}{cpu_ms:>15.2f}{num_bytes:>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,53 @@
 #!/usr/bin/env bash
 
-if [[ "${CELERY_QUEUE_NAMES}" = "all" ]]; then
-  CELERY_QUEUE_NAMES="$(python -m opwen_email_server.integration.cli print-queues --separator=,)"
-fi
-
-exec celery \
-  --app="opwen_email_server.integration.celery" \
-  worker \
-  --without-gossip \
-  --without-heartbeat \
-  --without-mingle \
-  --concurrency="${QUEUE_WORKERS}" \
-  --loglevel="${LOKOLE_LOG_LEVEL}" \
-  --queues="${CELERY_QUEUE_NAMES}"
+print_queues() {
+  python -m opwen_email_server.integration.cli print-queues --separator=, --pool="$1"
+}
+
+run_worker() {
+  exec celery \
+    --app="opwen_email_server.integration.celery" \
+    worker \
+    --without-gossip \
+    --without-heartbeat \
+    --without-mingle \
+    --hostname="$1@%h" \
+    --pool="${CELERY_POOL:-prefork}" \
+    --concurrency="$2" \
+    --prefetch-multiplier="$3" \
+    --loglevel="${LOKOLE_LOG_LEVEL}" \
+    --queues="$4"
+}
+
+case "${CELERY_QUEUE_NAMES}" in
+  all)
+    # large emails and service mailers get their own bounded workers so that
+    # they can't starve the common small emails
+    pids=()
+    run_worker small "${QUEUE_WORKERS}" "${QUEUE_PREFETCH:-4}" "$(print_queues small)" &
+    pids+=("$!")
+    run_worker large "${LARGE_QUEUE_WORKERS:-1}" "${LARGE_QUEUE_PREFETCH:-1}" "$(print_queues large)" &
+    pids+=("$!")
+    run_worker service "${SERVICE_QUEUE_WORKERS:-2}" "${SERVICE_QUEUE_PREFETCH:-1}" "$(print_queues service)" &
+    pids+=("$!")
+
+    trap 'kill -TERM "${pids[@]}" 2>/dev/null' TERM INT
+    wait -n
+    status="$?"
+    kill -TERM "${pids[@]}" 2>/dev/null
+    wait
+    exit "${status}"
+    ;;
+  small)
+    run_worker small "${QUEUE_WORKERS}" "${QUEUE_PREFETCH:-4}" "$(print_queues small)"
+    ;;
+  large)
+    run_worker large "${LARGE_QUEUE_WORKERS:-1}" "${LARGE_QUEUE_PREFETCH:-1}" "$(print_queues large)"
+    ;;
+  service)
+    run_worker service "${SERVICE_QUEUE_WORKERS:-2}" "${SERVICE_QUEUE_PREFETCH:-1}" "$(print_queues service)"
+    ;;
+  *)
+    run_worker celery "${QUEUE_WORKERS}" "${QUEUE_PREFETCH:-4}" "${CELERY_QUEUE_NAMES}"
+    ;;
+esac
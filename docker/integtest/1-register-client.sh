@@ -26,6 +26,22 @@ wait_for_client() {
   exit 1
 }
 
+wait_for_client_deletion() {
+  local client="$1"
+  local i
+
+  for i in $(seq 1 "${max_retries}"); do
+    if authenticated_request "http://nginx:8888/api/email/register/developer${client}.lokole.ca/deletion" | grep -q '"state": *"done"'; then
+      log "Client ${client} is deleted"
+      return
+    fi
+    log "Waiting for client ${client} deletion (${i}/${max_retries})"
+    sleep "${polling_interval_seconds}"
+  done
+
+  exit 1
+}
+
 # workflow 3: register a new client called "developer"
 # normally this endpoint would be called during a new lokole device setup
 authenticated_request \
@@ -82,3 +98,5 @@ fi
 authenticated_request \
   "http://nginx:8888/api/email/register/developer3.lokole.ca" \
   -X DELETE
+
+wait_for_client_deletion 3
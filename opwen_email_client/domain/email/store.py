@@ -29,7 +29,7 @@ class EmailStore(metaclass=ABCMeta):
         raise NotImplementedError  # pragma: no cover
 
     @abstractmethod
-    def inbox(self, email_address: str, page: int) -> Iterable[dict]:
+    def inbox(self, email_address: str, page: int, cursor: Optional[str] = None) -> Iterable[dict]:
         raise NotImplementedError  # pragma: no cover
 
     @abstractmethod
@@ -37,9 +37,12 @@ class EmailStore(metaclass=ABCMeta):
         raise NotImplementedError  # pragma: no cover
 
     @abstractmethod
-    def sent(self, email_address: str, page: int) -> Iterable[dict]:
+    def sent(self, email_address: str, page: int, cursor: Optional[str] = None) -> Iterable[dict]:
         raise NotImplementedError  # pragma: no cover
 
+    def cursor_for(self, email: dict) -> Optional[str]:
+        return None
+
     @abstractmethod
     def search(self, email_address: str, page: int, query: Optional[str]) -> Iterable[dict]:
         raise NotImplementedError  # pragma: no cover
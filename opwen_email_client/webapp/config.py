@@ -19,6 +19,8 @@ root_domain = env('OPWEN_ROOT_DOMAIN', 'lokole.ca')
 class ImageDimensions(object):
     MAX_WIDTH_IMAGES = env.int('LOKOLE_MAX_WIDTH_EMAIL_IMAGES', 200)
     MAX_HEIGHT_IMAGES = env.int('LOKOLE_MAX_HEIGHT_EMAIL_IMAGES', 200)
+    OUTPUT_FORMAT = env('LOKOLE_EMAIL_IMAGES_FORMAT', '') or None
+    MAX_BYTES = env.int('LOKOLE_EMAIL_IMAGES_MAX_BYTES', 0) or None
 
 
 # noinspection PyPep8Naming
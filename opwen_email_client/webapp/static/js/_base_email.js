@@ -21,6 +21,23 @@
       })
     })();
 
+    (function loadEmailBodyOnOpen () {
+      $('.panel-collapse').on('show.bs.collapse', function () {
+        var $body = $(this).find('.email-body[data-body_url]')
+        var bodyUrl = $body.data('body_url')
+        if (bodyUrl) {
+          $body.removeAttr('data-body_url').removeData('body_url')
+          $.ajax({
+            url: bodyUrl,
+            success: function (html) {
+              $body.html(html)
+              $body.find('img').lazyload()
+            }
+          })
+        }
+      })
+    })();
+
     (function printEmailOnPrintButtonClick () {
       $('.print-trigger').click(function () {
         var $printRoot = $(this).closest('.print-root')
@@ -29,6 +29,7 @@ from opwen_email_client.webapp.config import i8n
 from opwen_email_client.webapp.forms.email import NewEmailForm
 from opwen_email_client.webapp.forms.register import RegisterForm
 from opwen_email_client.webapp.forms.settings import SettingsForm
+from opwen_email_client.webapp.jinja import render_body
 from opwen_email_client.webapp.security import login_required
 from opwen_email_client.webapp.session import Session
 from opwen_email_client.webapp.session import track_history
@@ -62,7 +63,9 @@ def about() -> Response:
 def news(page: int) -> Response:
     email_store = app.ioc.email_store
 
-    return _emails_view(email_store.inbox(AppConfig.NEWS_INBOX, page), page, 'news.html')
+    cursor = request.args.get('cursor')
+
+    return _emails_view(email_store.inbox(AppConfig.NEWS_INBOX, page, cursor), page, 'news.html')
 
 
 @app.route(AppConfig.APP_ROOT + '/email')
@@ -74,7 +77,9 @@ def email_inbox(page: int) -> Response:
     email_store = app.ioc.email_store
     user = current_user
 
-    return _emails_view(email_store.inbox(user.email, page), page, type='inbox')
+    cursor = request.args.get('cursor')
+
+    return _emails_view(email_store.inbox(user.email, page, cursor), page, type='inbox')
 
 
 @app.route(AppConfig.APP_ROOT + '/email/outbox', defaults={'page': 1})
@@ -96,7 +101,9 @@ def email_sent(page: int) -> Response:
     email_store = app.ioc.email_store
     user = current_user
 
-    return _emails_view(email_store.sent(user.email, page), page, type='sent')
+    cursor = request.args.get('cursor')
+
+    return _emails_view(email_store.sent(user.email, page, cursor), page, type='sent')
 
 
 @app.route(AppConfig.APP_ROOT + '/email/search', defaults={'page': 1})
@@ -134,6 +141,18 @@ def email_read(email_uid: str) -> Response:
     return Response('OK', status=200, mimetype='text/plain')
 
 
+@app.route(AppConfig.APP_ROOT + '/email/body/<email_uid>')
+@login_required
+def email_body(email_uid: str) -> Response:
+    email_store = app.ioc.email_store
+
+    email = email_store.get(email_uid)
+    if email is None:
+        return abort(404)
+
+    return Response(render_body(email), status=200, mimetype='text/html')
+
+
 @app.route(AppConfig.APP_ROOT + '/email/delete/<email_uid>')
 @login_required
 def email_delete(email_uid: str) -> Response:
@@ -456,6 +475,14 @@ def _emails_view(emails: Iterable[dict], page: int, template: str = 'email.html'
 
     emails = list(emails)
 
+    has_nextpage = len(emails) == AppConfig.EMAILS_PER_PAGE
+    prevpage_args = request.args.to_dict()
+    prevpage_args.pop('cursor', None)
+    nextpage_args = dict(prevpage_args)
+    next_cursor = app.ioc.email_store.cursor_for(emails[-1]) if has_nextpage else None
+    if next_cursor:
+        nextpage_args['cursor'] = next_cursor
+
     for email in emails:
         sent_at = email.get('sent_at')
         if sent_at:
@@ -467,7 +494,9 @@ def _emails_view(emails: Iterable[dict], page: int, template: str = 'email.html'
                  emails=emails,
                  page=page,
                  has_prevpage=page > 1,
-                 has_nextpage=len(emails) == AppConfig.EMAILS_PER_PAGE,
+                 has_nextpage=has_nextpage,
+                 prevpage_args=prevpage_args,
+                 nextpage_args=nextpage_args,
                  **kwargs)
 
 
@@ -1,35 +1,61 @@
 from abc import ABC
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from hashlib import sha256
-from typing import Any
+from itertools import count
 from typing import Callable
 from typing import Dict
 from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
 from typing import Tuple
 from typing import Union
 
 from libcloud.storage.types import ObjectDoesNotExistError
 
 from opwen_email_server.constants import events
+from opwen_email_server.constants import jobs
 from opwen_email_server.constants import mailbox
+from opwen_email_server.constants import metrics
 from opwen_email_server.constants import sync
+from opwen_email_server.mailers.runner import Mailer
+from opwen_email_server.mailers.runner import MailerRunner
 from opwen_email_server.services.auth import Auth
+from opwen_email_server.services.counters import DomainCounters
+from opwen_email_server.services.index import MailboxIndex
+from opwen_email_server.services.index import SearchIndex
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.services.index_store import MarkerStore
+from opwen_email_server.services.manifests import ContentManifests
+from opwen_email_server.services.progress import Checkpoint
+from opwen_email_server.services.progress import CheckpointStore
+from opwen_email_server.services.progress import ProgressStore
 from opwen_email_server.services.sendgrid import SendSendgridEmail
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.cache import TTLCache
 from opwen_email_server.utils.email_parser import MimeEmailParser
 from opwen_email_server.utils.email_parser import descending_timestamp
 from opwen_email_server.utils.email_parser import ensure_has_sent_at
 from opwen_email_server.utils.email_parser import get_domain
 from opwen_email_server.utils.email_parser import get_domains
+from opwen_email_server.utils.email_parser import get_email_size
 from opwen_email_server.utils.email_parser import get_recipients
+from opwen_email_server.utils.email_parser import get_search_terms
+from opwen_email_server.utils.email_parser import remove_spooled_attachments
+from opwen_email_server.utils.email_parser import summarize_email
 from opwen_email_server.utils.log import LogMixin
 from opwen_email_server.utils.serialization import from_base64
 from opwen_email_server.utils.serialization import from_jsonl_bytes
 from opwen_email_server.utils.serialization import to_base64
 from opwen_email_server.utils.serialization import to_jsonl_bytes
 from opwen_email_server.utils.string import is_lowercase
-from opwen_email_server.utils.unique import new_email_id
+from opwen_email_server.utils.unique import new_content_hash
 
 Response = Union[dict, Tuple[str, int]]
 
@@ -73,13 +99,15 @@ class StoreInboundEmails(_Action):
     def __init__(self,
                  raw_email_storage: AzureTextStorage,
                  email_storage: AzureObjectStorage,
-                 pending_storage: AzureTextStorage,
-                 next_task: Callable[[str], None],
+                 pending_storage: MarkerStore,
+                 domain_counters: DomainCounters,
+                 next_task: Callable[[str, str], None],
                  email_parser: Callable[[str], dict] = None):
 
         self._raw_email_storage = raw_email_storage
         self._email_storage = email_storage
         self._pending_storage = pending_storage
+        self._domain_counters = domain_counters
         self._next_task = next_task
         self._email_parser = email_parser or MimeEmailParser()
 
@@ -91,42 +119,48 @@ class StoreInboundEmails(_Action):
             return 'skipped', 202
 
         email = self._email_parser(mime_email)
-        email_id = self._store_inbound_email(email)
+        try:
+            email_id, client_domain = self._store_inbound_email(email)
+        finally:
+            remove_spooled_attachments(email)
 
         self._raw_email_storage.delete(resource_id)
-        self._next_task(email_id)
+        self._next_task(email_id, client_domain)
 
         self.log_event(events.EMAIL_STORED_FOR_CLIENT, {'domain': get_domain(email.get('from') or '')})  # noqa: E501  # yapf: disable
         return 'OK', 200
 
-    def _store_inbound_email(self, email: dict) -> str:
+    def _store_inbound_email(self, email: dict) -> Tuple[str, str]:
         ensure_has_sent_at(email)
-        email_id = new_email_id(email)
-        email['_uid'] = email_id
-
-        self._email_storage.store_object(email_id, email)
+        email_id = self._email_storage.store_object_with_id(email).resource_id
 
+        client_domain = ''
         for domain in get_domains(email):
             if domain.endswith(mailbox.MAILBOX_DOMAIN):
-                self._pending_storage.store_text(f'{domain}/{email_id}', 'pending')
+                self._pending_storage.mark(f'{domain}/{email_id}')
+                self._domain_counters.increment(domain, metrics.PENDING_EMAILS)
+                client_domain = client_domain or domain
 
-        return email_id
+        return email_id, client_domain
 
 
 class _IndexEmailForMailbox(_Action):
-    def __init__(self, email_storage: AzureObjectStorage, mailbox_storage: AzureTextStorage):
+    def __init__(self, email_storage: AzureObjectStorage, mailbox_index: MailboxIndex, search_index: SearchIndex):
         self._email_storage = email_storage
-        self._mailbox_storage = mailbox_storage
+        self._mailbox_index = mailbox_index
+        self._search_index = search_index
 
     def _action(self, resource_id):  # type: ignore
         email = self._email_storage.fetch_object(resource_id)
+        summary = summarize_email(email)
+        terms = get_search_terms(email)
 
         for email_address in self._get_pivot(email):
             domain = get_domain(email_address)
             desc_prefix = descending_timestamp(email['sent_at'])
             if domain.endswith(mailbox.MAILBOX_DOMAIN):
-                index = f"{domain}/{email_address}/{self._folder}/{desc_prefix}/{resource_id}"
-                self._mailbox_storage.store_text(index, 'indexed')
+                self._mailbox_index.add(email_address, self._folder, desc_prefix, resource_id, summary)
+                self._search_index.add(email_address, desc_prefix, resource_id, summary, terms)
 
         self.log_event(events.MAILBOX_EMAIL_INDEXED, {'folder': self._folder})  # noqa: E501  # yapf: disable
         return 'OK', 200
@@ -156,52 +190,198 @@ class IndexSentEmailForMailbox(_IndexEmailForMailbox):
             yield sender
 
 
+class BackfillMailboxIndex(_Action):
+    def __init__(self, email_storage: AzureObjectStorage, mailbox_storage: AzureTextStorage,
+                 mailbox_index: MailboxIndex, search_index: SearchIndex):
+        self._email_storage = email_storage
+        self._mailbox_storage = mailbox_storage
+        self._mailbox_index = mailbox_index
+        self._search_index = search_index
+
+    def _action(self, domain):  # type: ignore
+        legacy_entries = defaultdict(list)  # type: Dict[Tuple[str, str], List[Tuple[str, str]]]
+        for resource_id in self._mailbox_storage.iter(f'{domain}/'):
+            entry = self._parse_legacy_entry(resource_id)
+            if entry is not None:
+                email_address, folder, desc_ts, email_id = entry
+                legacy_entries[(email_address, folder)].append((desc_ts, email_id))
+
+        num_entries = 0
+        for (email_address, folder), entries in legacy_entries.items():
+            mailbox_entries = []
+            search_entries = []
+            for desc_ts, email_id in entries:
+                try:
+                    email = self._email_storage.fetch_object(email_id)
+                except ObjectDoesNotExistError:
+                    self.log_warning('Skipping missing email %s for %s', email_id, email_address)
+                    continue
+
+                summary = summarize_email(email)
+                mailbox_entries.append((desc_ts, email_id, summary))
+                search_entries.append((desc_ts, email_id, summary, get_search_terms(email)))
+
+            if mailbox_entries:
+                self._mailbox_index.add_many(email_address, folder, mailbox_entries)
+                self._mailbox_index.compact(email_address, folder)
+                self._search_index.add_many(email_address, search_entries)
+                self._search_index.compact(email_address)
+
+            self._mailbox_storage.delete_many(
+                [f'{domain}/{email_address}/{folder}/{desc_ts}/{email_id}' for desc_ts, email_id in entries])
+            num_entries += len(mailbox_entries)
+
+        self.log_debug('backfilled %d entries in %d mailboxes for %s', num_entries, len(legacy_entries), domain)
+        return 'OK', 200
+
+    @classmethod
+    def _parse_legacy_entry(cls, resource_id: str) -> Optional[Tuple[str, str, str, str]]:
+        parts = resource_id.split('/')
+        if len(parts) != 4:
+            return None
+
+        email_address, folder, desc_ts, email_id = parts
+        if folder not in (mailbox.RECEIVED_FOLDER, mailbox.SENT_FOLDER):
+            return None
+        if not desc_ts.isdigit() or '.' in email_id:
+            return None
+
+        return email_address, folder, desc_ts, email_id
+
+
 class StoreWrittenClientEmails(_Action):
-    def __init__(self, client_storage: AzureObjectsStorage, email_storage: AzureObjectStorage,
-                 user_storage: AzureObjectStorage, next_task: Callable[[str], None]):
+    def __init__(self,
+                 client_storage: AzureObjectsStorage,
+                 email_storage: AzureObjectStorage,
+                 user_storage: IndexStore,
+                 user_manifests: ContentManifests,
+                 domain_counters: DomainCounters,
+                 next_task: Callable[[str, str, int], None],
+                 checkpoints: CheckpointStore,
+                 max_workers: int = 8,
+                 checkpoint_interval: int = 50):
 
         self._client_storage = client_storage
         self._email_storage = email_storage
         self._user_storage = user_storage
+        self._user_manifests = user_manifests
+        self._domain_counters = domain_counters
         self._next_task = next_task
+        self._checkpoints = checkpoints
+        self._max_workers = max(max_workers, 1)
+        self._checkpoint_interval = max(checkpoint_interval, 1)
 
     def _action(self, resource_id):  # type: ignore
-        self._store_emails(resource_id)
+        job_id = _written_store_job(resource_id)
+        checkpoint = self._checkpoints.get(job_id)
+
+        try:
+            self._store_emails(resource_id, job_id, checkpoint)
+        finally:
+            self._checkpoints.store(job_id, checkpoint)
+
         self._store_users(resource_id)
         self._client_storage.delete(resource_id)
+        self._checkpoints.delete(job_id)
 
         return 'OK', 200
 
-    def _store_emails(self, resource_id):
-        emails = self._client_storage.fetch_objects(resource_id, (sync.EMAILS_FILE, from_jsonl_bytes))
+    def _store_emails(self, resource_id: str, job_id: str, checkpoint: Checkpoint):
+        emails = self._client_storage.fetch_objects(resource_id, (sync.EMAILS_FILE, self._line_decoder(checkpoint)))
 
         domain = ''
         num_stored = 0
-        for email in emails:
-            email_id = email['_uid']
-            email = self._decode_attachments(email)
-            self._email_storage.store_object(email_id, email)
+        num_checkpointed = 0
+        in_flight: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for line, email in emails:
+                if email is None:
+                    checkpoint.complete(line)
+                    continue
+
+                if checkpoint.is_done(line, email['_uid']):
+                    checkpoint.complete(line, email['_uid'])
+                    continue
+
+                in_flight.add(executor.submit(self._store_email, line, email))
+
+                if len(in_flight) >= 2 * self._max_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    domain = self._complete(done, checkpoint) or domain
+                    num_stored += len(done)
 
-            self._next_task(email_id)
+                if num_stored - num_checkpointed >= self._checkpoint_interval:
+                    self._checkpoints.store(job_id, checkpoint)
+                    num_checkpointed = num_stored
 
-            num_stored += 1
-            domain = get_domain(email.get('from', ''))
+            done, _ = wait(in_flight)
+            domain = self._complete(done, checkpoint) or domain
+            num_stored += len(done)
 
         self.log_event(events.EMAIL_STORED_FROM_CLIENT, {'domain': domain, 'num_emails': num_stored})  # noqa: E501  # yapf: disable
 
+    def _store_email(self, line: int, email: dict) -> Tuple[int, str, str, int]:
+        email_id = email['_uid']
+        email = self._decode_attachments(email)
+        self._email_storage.store_object(email_id, email)
+        return line, email_id, get_domain(email.get('from', '')), get_email_size(email)
+
+    def _complete(self, done: Iterable[Future], checkpoint: Checkpoint) -> str:
+        domain = ''
+        for future in done:
+            line, email_id, domain, num_bytes = future.result()
+            self._next_task(email_id, domain, num_bytes)
+            checkpoint.complete(line, email_id)
+        return domain
+
+    @classmethod
+    def _line_decoder(cls, checkpoint: Checkpoint) -> Callable[[bytes], Optional[Tuple[int, Optional[dict]]]]:
+        lines = count()
+
+        def decode(encoded: bytes) -> Optional[Tuple[int, Optional[dict]]]:
+            line = next(lines)
+            if checkpoint.is_done(line):
+                return None
+            return line, from_jsonl_bytes(encoded)
+
+        return decode
+
     def _store_users(self, resource_id):
         users = self._client_storage.fetch_objects(resource_id, (sync.USERS_FILE, from_jsonl_bytes))
 
-        domain = ''
-        num_stored = 0
+        users_by_domain = defaultdict(list)  # type: Dict[str, List[dict]]
+        for user in users:
+            users_by_domain[get_domain(user['email'])].append(user)
+
+        for domain, domain_users in users_by_domain.items():
+            self._store_domain_users(domain, domain_users)
+
+    def _store_domain_users(self, domain: str, users: List[dict]):
+        hashes = self._user_manifests.get(domain, sync.USERS_MANIFEST)
+        updated_hashes = dict(hashes)
+
+        num_created = 0
+        batch = []
         for user in users:
             email = user['email']
-            domain = get_domain(email)
-            self._user_storage.store_object(f'{domain}/{email}', user)
+            content_hash = new_content_hash(user)
+            if hashes.get(email.lower()) == content_hash:
+                continue
+
+            user_id = f'{domain}/{email}'
+            if email.lower() not in hashes and not self._user_storage.exists(user_id):
+                num_created += 1
+            batch.append((user_id, user))
+            updated_hashes[email.lower()] = content_hash
 
-            num_stored += 1
+        if batch:
+            self._user_storage.store_many(batch)
+            self._user_manifests.store(domain, sync.USERS_MANIFEST, updated_hashes)
 
-        self.log_event(events.USER_STORED_FROM_CLIENT, {'domain': domain, 'num_users': num_stored})  # noqa: E501  # yapf: disable
+        if num_created:
+            self._domain_counters.increment(domain, metrics.USERS, num_created)
+
+        self.log_event(events.USER_STORED_FROM_CLIENT, {'domain': domain, 'num_users': len(batch)})  # noqa: E501  # yapf: disable
 
     @classmethod
     def _decode_attachments(cls, email: dict) -> dict:
@@ -215,7 +395,7 @@ class StoreWrittenClientEmails(_Action):
 
 
 class ReceiveInboundEmail(_Action):
-    def __init__(self, auth: Auth, raw_email_storage: AzureTextStorage, next_task: Callable[[str], None]):
+    def __init__(self, auth: Auth, raw_email_storage: AzureTextStorage, next_task: Callable[[str, int], None]):
         self._auth = auth
         self._raw_email_storage = raw_email_storage
         self._next_task = next_task
@@ -233,7 +413,7 @@ class ReceiveInboundEmail(_Action):
 
         self._raw_email_storage.store_text(email_id, email)
 
-        self._next_task(email_id)
+        self._next_task(email_id, len(email))
 
         self.log_event(events.EMAIL_RECEIVED_FOR_CLIENT, {'domain': domain})  # noqa: E501  # yapf: disable
         return 'received', 200
@@ -247,14 +427,15 @@ class ProcessServiceEmail(_Action):
     def __init__(self,
                  raw_email_storage: AzureTextStorage,
                  email_storage: AzureObjectStorage,
-                 next_task: Callable[[str], None],
-                 registry: Dict[str, Any],
-                 email_parser: Callable[[dict], dict] = None):
+                 next_task: Callable[[str, str, int], None],
+                 registry: Dict[str, Mailer],
+                 email_parser: Callable[[dict], dict] = None,
+                 max_workers: int = 4):
 
         self._raw_email_storage = raw_email_storage
         self._email_storage = email_storage
         self._next_task = next_task
-        self._registry = registry
+        self._run_mailers = MailerRunner(registry, max_workers)
         self._email_parser = email_parser or MimeEmailParser()
 
     def _action(self, resource_id):  # type: ignore
@@ -265,36 +446,38 @@ class ProcessServiceEmail(_Action):
             return 'skipped', 202
 
         email = self._email_parser(mime_email)
-
-        for address in email.get('to', []):
-            try:
-                mailer_service = self._registry[address]
-            except KeyError:
-                self.log_warning('Skipping unknown mailer service: %s', address)
-                continue
-
-            formatted_email = mailer_service(email)
-
-            formatted_email_id = new_email_id(formatted_email)
-            formatted_email['_uid'] = formatted_email_id
-
-            self._email_storage.store_object(formatted_email_id, formatted_email)
-
-            self._next_task(formatted_email_id)
+        try:
+            self._format_service_email(email)
+        finally:
+            remove_spooled_attachments(email)
 
         self._raw_email_storage.delete(resource_id)
         self.log_event(events.EMAILS_FORMATTED_FOR_CLIENT)  # noqa: E501  # yapf: disable
         return 'OK', 200
 
+    def _format_service_email(self, email: dict):
+        formatted_emails = self._run_mailers(email)
+
+        try:
+            for formatted_email in formatted_emails:
+                formatted_email_id = self._email_storage.store_object_with_id(formatted_email).resource_id
+
+                self._next_task(formatted_email_id, get_domain(email.get('from') or ''),
+                                get_email_size(formatted_email))
+        finally:
+            for formatted_email in formatted_emails:
+                remove_spooled_attachments(formatted_email)
+
 
 class DownloadClientEmails(_Action):
     def __init__(self, auth: Auth, client_storage: AzureObjectsStorage, email_storage: AzureObjectStorage,
-                 pending_storage: AzureTextStorage):
+                 pending_storage: MarkerStore, domain_counters: DomainCounters):
 
         self._auth = auth
         self._client_storage = client_storage
         self._email_storage = email_storage
         self._pending_storage = pending_storage
+        self._domain_counters = domain_counters
 
     def _action(self, client_id, compression):  # type: ignore
         domain = self._auth.domain_for(client_id)
@@ -341,12 +524,14 @@ class DownloadClientEmails(_Action):
         return email
 
     def _mark_emails_as_delivered(self, domain: str, email_ids: Iterable[str]) -> None:
-        for email_id in email_ids:
-            self._pending_storage.delete(f'{domain}/{email_id}')
+        pending_ids = [f'{domain}/{email_id}' for email_id in email_ids]
+        num_delivered = self._pending_storage.delete_many(pending_ids)
+
+        self._domain_counters.increment(domain, metrics.PENDING_EMAILS, -num_delivered)
 
 
 class UploadClientEmails(_Action):
-    def __init__(self, auth: Auth, next_task: Callable[[str], None]):
+    def __init__(self, auth: Auth, next_task: Callable[[str, str], None]):
         self._auth = auth
         self._next_task = next_task
 
@@ -358,7 +543,7 @@ class UploadClientEmails(_Action):
 
         resource_id = upload_info['resource_id']
 
-        self._next_task(resource_id)
+        self._next_task(resource_id, domain)
 
         self.log_event(events.EMAILS_RECEIVED_FROM_CLIENT, {'domain': domain})  # noqa: E501  # yapf: disable
         return 'uploaded', 200
@@ -444,15 +629,10 @@ class GetClient(_Action):
 
 
 class DeleteClient(_Action):
-    def __init__(self, auth: Auth, delete_mailbox: Callable[[str, str], None], delete_mx_records: Callable[[str], None],
-                 mailbox_storage: AzureTextStorage, pending_storage: AzureTextStorage,
-                 user_storage: AzureObjectStorage):
+    def __init__(self, auth: Auth, progress: ProgressStore, task: Callable[[str], None]):
         self._auth = auth
-        self._delete_mailbox = delete_mailbox
-        self._delete_mx_records = delete_mx_records
-        self._mailbox_storage = mailbox_storage
-        self._pending_storage = pending_storage
-        self._user_storage = user_storage
+        self._progress = progress
+        self._task = task
 
     def _action(self, domain, user, **auth_args):  # type: ignore
         if not is_lowercase(domain):
@@ -465,49 +645,223 @@ class DeleteClient(_Action):
         if not self._auth.is_owner(domain, user):
             return 'client does not belong to the user', 403
 
-        self._delete_mailbox(client_id, domain)
-        self._delete_mx_records(domain)
-        self._delete_index(self._pending_storage, domain)
-        self._delete_index(self._mailbox_storage, domain)
-        self._delete_index(self._user_storage, domain)
-        self._auth.delete(client_id, domain)
+        job_id = _delete_client_job(domain)
+        if self._progress.is_active(job_id):
+            return 'deletion already in progress', 202
 
-        self.log_event(events.CLIENT_DELETED, {'domain': domain})  # noqa: E501  # yapf: disable
-        return 'OK', 200
+        self._progress.start(job_id, user['name'])
+        self._task(domain)
 
-    @classmethod
-    def _delete_index(cls, storage: Union[AzureTextStorage, AzureObjectStorage], domain: str) -> None:
-        for prefix in storage.iter(f'{domain}/'):
-            storage.delete(f'{domain}/{prefix}')
+        self.log_event(events.CLIENT_DELETE_REQUESTED, {'domain': domain})  # noqa: E501  # yapf: disable
+        return 'accepted', 202
 
 
-class CalculateNumberOfUsersMetric(_Action):
-    def __init__(self, auth: Auth, user_storage: AzureObjectStorage):
+class GetClientDeletion(_Action):
+    def __init__(self, auth: Auth, progress: ProgressStore):
         self._auth = auth
-        self._user_storage = user_storage
+        self._progress = progress
 
     def _action(self, domain, user, **auth_args):  # type: ignore
-        if not self._auth.is_owner(domain, user):
-            return 'client does not belong to the user', 403
+        if not is_lowercase(domain):
+            return 'domain must be lowercase', 400
 
-        users = sum(1 for _ in self._user_storage.iter(f'{domain}/'))
+        job = self._progress.get(_delete_client_job(domain))
+        if job is None:
+            return 'client deletion does not exist', 404
+
+        if job['owner'] != user['name'] and not self._auth.is_owner(domain, user):
+            return 'client does not belong to the user', 403
 
         return {
-            'users': users,
+            'domain':
+            domain,
+            'state':
+            job['state'],
+            'steps': [{
+                'name': name,
+                'state': step['state'],
+                'deleted': step['deleted'],
+            } for name, step in sorted(job['steps'].items())],
         }
 
 
-class CalculatePendingEmailsMetric(_Action):
-    def __init__(self, auth: Auth, pending_storage: AzureTextStorage):
+class PurgeClient(_Action):
+    def __init__(self,
+                 auth: Auth,
+                 delete_mailbox: Callable[[str, str], None],
+                 delete_mx_records: Callable[[str], None],
+                 mailbox_storage: AzureTextStorage,
+                 mailbox_index: MailboxIndex,
+                 pending_storage: MarkerStore,
+                 user_storage: IndexStore,
+                 user_manifests: ContentManifests,
+                 domain_counters: DomainCounters,
+                 progress: ProgressStore,
+                 max_workers: int = 4):
         self._auth = auth
+        self._delete_mailbox = delete_mailbox
+        self._delete_mx_records = delete_mx_records
+        self._mailbox_storage = mailbox_storage
+        self._mailbox_index = mailbox_index
         self._pending_storage = pending_storage
+        self._user_storage = user_storage
+        self._user_manifests = user_manifests
+        self._domain_counters = domain_counters
+        self._progress = progress
+        self._max_workers = max_workers
+
+    def _action(self, domain):  # type: ignore
+        job_id = _delete_client_job(domain)
+
+        client_id = self._auth.client_id_for(domain)
+        if client_id is None:
+            self._progress.set_state(job_id, jobs.FAILED)
+            return 'client does not exist', 404
+
+        steps = {
+            'mailbox': lambda: self._delete_mailbox(client_id, domain),
+            'mx_records': lambda: self._delete_mx_records(domain),
+            'pending_emails': lambda: self._pending_storage.delete_prefix(f'{domain}/'),
+            'mailbox_emails': lambda: self._delete_mailbox_emails(domain),
+            'users': lambda: self._user_storage.delete_prefix(f'{domain}/'),
+            'manifests': lambda: self._user_manifests.delete_domain(domain),
+            'metrics': lambda: self._domain_counters.delete_domain(domain),
+        }  # type: Dict[str, Callable[[], Optional[int]]]
+
+        self._progress.set_state(job_id, jobs.RUNNING)
+        for name in steps:
+            self._progress.set_step(job_id, name, jobs.QUEUED)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                list(executor.map(lambda name: self._run_step(job_id, name, steps[name]), steps))
+        except Exception:
+            self._progress.set_state(job_id, jobs.FAILED)
+            raise
+
+        self._auth.delete(client_id, domain)
+        self._progress.set_state(job_id, jobs.DONE)
+
+        self.log_event(events.CLIENT_DELETED, {'domain': domain})  # noqa: E501  # yapf: disable
+        return 'OK', 200
+
+    def _delete_mailbox_emails(self, domain: str) -> int:
+        # the blob index shares the mailbox container so only clean up what other index stores still hold
+        num_deleted = self._mailbox_storage.delete_prefix(f'{domain}/')
+        num_deleted += self._mailbox_index.delete_domain(domain)
+        return num_deleted
+
+    def _run_step(self, job_id: str, name: str, step: Callable[[], Optional[int]]) -> None:
+        self._progress.set_step(job_id, name, jobs.RUNNING)
+
+        try:
+            num_deleted = step() or 0
+        except Exception:
+            self._progress.set_step(job_id, name, jobs.FAILED)
+            raise
+
+        self._progress.set_step(job_id, name, jobs.DONE, num_deleted)
+
+
+def _delete_client_job(domain: str) -> str:
+    return f'{jobs.DELETE_CLIENT}/{domain}'
+
+
+def _written_store_job(resource_id: str) -> str:
+    return f'{jobs.WRITTEN_STORE}/{resource_id}'
+
+
+class _CalculateDomainMetric(_Action):
+    def __init__(self, auth: Auth, storage: IndexStore, domain_counters: DomainCounters, reconcile: Callable[[str],
+                                                                                                             None]):
+        self._auth = auth
+        self._storage = storage
+        self._domain_counters = domain_counters
+        self._reconcile = reconcile
 
     def _action(self, domain, user, **auth_args):  # type: ignore
         if not self._auth.is_owner(domain, user):
             return 'client does not belong to the user', 403
 
-        pending_emails = sum(1 for _ in self._pending_storage.iter(f'{domain}/'))
+        return {
+            self.metric: self.value_for(domain),
+        }
+
+    def value_for(self, domain: str) -> int:
+        counter = self._domain_counters.get(domain, self.metric)
+        if counter is None:
+            return self._domain_counters.reconcile(domain, self.metric, self._storage.count(f'{domain}/'))
+
+        if self._domain_counters.is_stale(counter):
+            self._reconcile(domain)
+
+        return counter.value
+
+    @property
+    def metric(self) -> str:
+        raise NotImplementedError  # pragma: no cover
+
+
+class CalculateNumberOfUsersMetric(_CalculateDomainMetric):
+    metric = metrics.USERS
+
+
+class CalculatePendingEmailsMetric(_CalculateDomainMetric):
+    metric = metrics.PENDING_EMAILS
+
+
+class CalculateClientsMetrics(_Action):
+    def __init__(self,
+                 auth: Auth,
+                 domain_metrics: Iterable[_CalculateDomainMetric],
+                 cache: TTLCache,
+                 max_workers: int = 8):
+        self._auth = auth
+        self._domain_metrics = list(domain_metrics)
+        self._cache = cache
+        self._max_workers = max_workers
 
+    def _action(self, user, **auth_args):  # type: ignore
+        cache_key = (user.get('name'), tuple(sorted(user.get('scopes', []))))
+
+        clients = self._cache.get(cache_key)
+        if clients is None:
+            clients = self._calculate(user)
+            self._cache.put(cache_key, clients)
+
+        self.log_event(events.CLIENTS_METRICS_FETCHED, {'num_clients': len(clients)})  # noqa: E501  # yapf: disable
         return {
-            'pending_emails': pending_emails,
+            'clients': clients,
         }
+
+    def _calculate(self, user: dict) -> List[dict]:
+        domains = sorted(self._auth.domains())
+        if not domains:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(len(domains), self._max_workers)) as executor:
+            clients = list(executor.map(lambda domain: self._calculate_client(domain, user), domains))
+
+        return [client for client in clients if client is not None]
+
+    def _calculate_client(self, domain: str, user: dict) -> Optional[dict]:
+        if not self._auth.is_owner(domain, user):
+            return None
+
+        client = {'domain': domain}  # type: Dict[str, object]
+        for domain_metric in self._domain_metrics:
+            client[domain_metric.metric] = domain_metric.value_for(domain)
+        return client
+
+
+class ReconcileDomainMetrics(_Action):
+    def __init__(self, pending_storage: MarkerStore, user_storage: IndexStore, domain_counters: DomainCounters):
+        self._pending_storage = pending_storage
+        self._user_storage = user_storage
+        self._domain_counters = domain_counters
+
+    def _action(self, domain):  # type: ignore
+        self._domain_counters.reconcile(domain, metrics.PENDING_EMAILS, self._pending_storage.count(f'{domain}/'))
+        self._domain_counters.reconcile(domain, metrics.USERS, self._user_storage.count(f'{domain}/'))
+
+        return 'OK', 200
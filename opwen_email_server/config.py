@@ -8,6 +8,10 @@ RANDOM_SEED = env.int('LOKOLE_RANDOM_SEED', None)
 
 STORAGE_PROVIDER = env('LOKOLE_STORAGE_PROVIDER', 'AZURE_BLOBS')
 
+INDEX_STORE_PROVIDER = env('LOKOLE_INDEX_STORE_PROVIDER', 'STORAGE')
+INDEX_STORE_PATH = env('LOKOLE_INDEX_STORE_PATH', 'lokole-index.sqlite3')
+INDEX_STORE_HOST = env('LOKOLE_INDEX_STORE_HOST', '') or None
+
 BLOBS_ACCOUNT = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_NAME', '')
 BLOBS_KEY = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_KEY', '')
 BLOBS_HOST = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_HOST', '') or None
@@ -32,6 +36,10 @@ CONTAINER_USERS = f'users{resource_suffix}'
 CONTAINER_SENDGRID_MIME = f'sendgridinboundemails{resource_suffix}'
 CONTAINER_PENDING = f'pendingemails{resource_suffix}'
 CONTAINER_AUTH = f'clientsauth{resource_suffix}'
+CONTAINER_METRICS = f'metrics{resource_suffix}'
+CONTAINER_JOBS = f'jobs{resource_suffix}'
+CONTAINER_MANIFESTS = f'manifests{resource_suffix}'
+CONTAINER_TOKENS = f'tokens{resource_suffix}'
 
 REGISTER_CLIENT_QUEUE = f'register{resource_suffix}'
 INBOUND_STORE_QUEUE = f'inbound{resource_suffix}'
@@ -40,6 +48,25 @@ PROCESS_SERVICE_QUEUE = f'service{resource_suffix}'
 SEND_QUEUE = f'send{resource_suffix}'
 MAILBOX_RECEIVED_QUEUE = f'mailboxreceived{resource_suffix}'
 MAILBOX_SENT_QUEUE = f'mailboxsent{resource_suffix}'
+RECONCILE_METRICS_QUEUE = f'metrics{resource_suffix}'
+DELETE_CLIENT_QUEUE = f'delete{resource_suffix}'
+INBOUND_STORE_LARGE_QUEUE = f'inboundlarge{resource_suffix}'
+SEND_LARGE_QUEUE = f'sendlarge{resource_suffix}'
+PROCESS_SERVICE_LARGE_QUEUE = f'servicelarge{resource_suffix}'
+
+QUEUE_LANES = max(env.int('LOKOLE_QUEUE_LANES', 4), 1)
+WRITTEN_STORE_LANES = tuple(f'written{lane or ""}{resource_suffix}' for lane in range(QUEUE_LANES))
+SEND_LANES = tuple(f'send{lane or ""}{resource_suffix}' for lane in range(QUEUE_LANES))
+MAILBOX_RECEIVED_LANES = tuple(f'mailboxreceived{lane or ""}{resource_suffix}' for lane in range(QUEUE_LANES))
+MAILBOX_SENT_LANES = tuple(f'mailboxsent{lane or ""}{resource_suffix}' for lane in range(QUEUE_LANES))
+
+DOMAIN_MAX_CONCURRENCY = env.int('LOKOLE_DOMAIN_MAX_CONCURRENCY', 2)
+DOMAIN_TOKEN_LEASE_SECONDS = env.float('LOKOLE_DOMAIN_TOKEN_LEASE_SECONDS', 600)
+DOMAIN_TOKEN_DEFER_SECONDS = env.float('LOKOLE_DOMAIN_TOKEN_DEFER_SECONDS', 1)
+DOMAIN_TOKEN_DEFER_MAX_SECONDS = env.float('LOKOLE_DOMAIN_TOKEN_DEFER_MAX_SECONDS', 120)
+DOMAIN_TOKEN_MAX_DEFERS = env.int('LOKOLE_DOMAIN_TOKEN_MAX_DEFERS', 10)
+
+LARGE_EMAIL_BYTES = env.int('LOKOLE_LARGE_EMAIL_BYTES', 512 * 1024)
 
 SENDGRID_MAX_RETRIES = env.int('LOKOLE_SENDGRID_MAX_RETRIES', 20)
 SENDGRID_RETRY_INTERVAL_SECONDS = env.float('LOKOLE_SENDGRID_RETRY_INTERVAL_SECONDS', 5)
@@ -59,8 +86,56 @@ REGISTRATION_PASSWORD = env('LOKOLE_REGISTRATION_PASSWORD', '')
 REGISTRATION_GITHUB_ORGANIZATION = env('LOKOLE_REGISTRATION_GITHUB_ORGANIZATION', 'ascoderu')
 REGISTRATION_SUDO_TEAM = env('LOKOLE_REGISTRATION_SUDO_TEAM', 'lokole-sudo')
 
+AUTH_CACHE_TTL_SECONDS = env.float('LOKOLE_AUTH_CACHE_TTL_SECONDS', 300)
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = env.float('LOKOLE_AUTH_CACHE_NEGATIVE_TTL_SECONDS', 30)
+AUTH_CACHE_MAX_ITEMS = env.int('LOKOLE_AUTH_CACHE_MAX_ITEMS', 10000)
+AUTH_CACHE_CHECK_SECONDS = env.float('LOKOLE_AUTH_CACHE_CHECK_SECONDS', 5)
+GITHUB_AUTH_CACHE_TTL_SECONDS = env.float('LOKOLE_GITHUB_AUTH_CACHE_TTL_SECONDS', 300)
+GITHUB_AUTH_CACHE_MAX_ITEMS = env.int('LOKOLE_GITHUB_AUTH_CACHE_MAX_ITEMS', 1024)
+
 MAX_WIDTH_IMAGES = env.int('LOKOLE_MAX_WIDTH_EMAIL_IMAGES', 200)
 MAX_HEIGHT_IMAGES = env.int('LOKOLE_MAX_HEIGHT_EMAIL_IMAGES', 200)
+IMAGES_OUTPUT_FORMAT = env('LOKOLE_EMAIL_IMAGES_FORMAT', '') or None
+IMAGES_MAX_BYTES = env.int('LOKOLE_EMAIL_IMAGES_MAX_BYTES', 0) or None
+
+INLINE_IMAGES_MAX_WORKERS = env.int('LOKOLE_INLINE_IMAGES_MAX_WORKERS', 8)
+INLINE_IMAGES_TIMEOUT_SECONDS = env.float('LOKOLE_INLINE_IMAGES_TIMEOUT_SECONDS', 10)
+INLINE_IMAGES_CACHE_MAX_BYTES = env.int('LOKOLE_INLINE_IMAGES_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+INLINE_IMAGES_CACHE_MAX_ITEM_BYTES = env.int('LOKOLE_INLINE_IMAGES_CACHE_MAX_ITEM_BYTES', 1024 * 1024)
+
+MIME_PARSER_PROCESSES = env.int('LOKOLE_MIME_PARSER_PROCESSES', 0)
+MIME_PARSER_TIMEOUT_SECONDS = env.float('LOKOLE_MIME_PARSER_TIMEOUT_SECONDS', 120)
+MIME_PARSER_MAX_MEMORY_MB = env.int('LOKOLE_MIME_PARSER_MAX_MEMORY_MB', 0)
+MIME_PARSER_MAX_TASKS_PER_PROCESS = env.int('LOKOLE_MIME_PARSER_MAX_TASKS_PER_PROCESS', 100)
+MIME_SPOOL_THRESHOLD_BYTES = env.int('LOKOLE_MIME_SPOOL_THRESHOLD_BYTES', 1024 * 1024) or None
+
+MAILBOX_INDEX_MAX_DELTAS = env.int('LOKOLE_MAILBOX_INDEX_MAX_DELTAS', 64)
+MAILBOX_INDEX_SEGMENT_SIZE = env.int('LOKOLE_MAILBOX_INDEX_SEGMENT_SIZE', 500)
+
+SEARCH_INDEX_MAX_DELTAS = env.int('LOKOLE_SEARCH_INDEX_MAX_DELTAS', 64)
+SEARCH_INDEX_BUCKETS = env.int('LOKOLE_SEARCH_INDEX_BUCKETS', 32)
+
+METRICS_RECONCILE_INTERVAL_SECONDS = env.float('LOKOLE_METRICS_RECONCILE_INTERVAL_SECONDS', 3600)
+METRICS_CACHE_TTL_SECONDS = env.float('LOKOLE_METRICS_CACHE_TTL_SECONDS', 30)
+METRICS_MAX_WORKERS = env.int('LOKOLE_METRICS_MAX_WORKERS', 8)
+
+WRITTEN_STORE_MAX_WORKERS = env.int('LOKOLE_WRITTEN_STORE_MAX_WORKERS', 8)
+WRITTEN_STORE_CHECKPOINT_INTERVAL = env.int('LOKOLE_WRITTEN_STORE_CHECKPOINT_INTERVAL', 50)
+WRITTEN_STORE_MAX_RETRIES = env.int('LOKOLE_WRITTEN_STORE_MAX_RETRIES', 5)
+
+WIKIPEDIA_LANGUAGES_TTL_SECONDS = env.float('LOKOLE_WIKIPEDIA_LANGUAGES_TTL_SECONDS', 24 * 3600)
+WIKIPEDIA_PAGES_TTL_SECONDS = env.float('LOKOLE_WIKIPEDIA_PAGES_TTL_SECONDS', 24 * 3600)
+WIKIPEDIA_PAGES_CACHE_MAX_ITEMS = env.int('LOKOLE_WIKIPEDIA_PAGES_CACHE_MAX_ITEMS', 10000)
+WIKIPEDIA_PDF_CACHE_DIR = env('LOKOLE_WIKIPEDIA_PDF_CACHE_DIR', '') or None
+WIKIPEDIA_PDF_CACHE_MAX_BYTES = env.int('LOKOLE_WIKIPEDIA_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+WIKIPEDIA_PDF_CACHE_MAX_ITEM_BYTES = env.int('LOKOLE_WIKIPEDIA_PDF_CACHE_MAX_ITEM_BYTES', 32 * 1024 * 1024)
+WIKIPEDIA_PDF_CONNECT_TIMEOUT_SECONDS = env.float('LOKOLE_WIKIPEDIA_PDF_CONNECT_TIMEOUT_SECONDS', 10)
+WIKIPEDIA_PDF_READ_TIMEOUT_SECONDS = env.float('LOKOLE_WIKIPEDIA_PDF_READ_TIMEOUT_SECONDS', 60)
+
+SERVICE_MAILERS_MAX_WORKERS = env.int('LOKOLE_SERVICE_MAILERS_MAX_WORKERS', 4)
+
+DELETE_CLIENT_MAX_WORKERS = env.int('LOKOLE_DELETE_CLIENT_MAX_WORKERS', 4)
+DELETE_CLIENT_STALE_AFTER_SECONDS = env.float('LOKOLE_DELETE_CLIENT_STALE_AFTER_SECONDS', 3600)
 
 if env('LOKOLE_QUEUE_BROKER_SCHEME', ''):
     QUEUE_BROKER = '{scheme}://{username}:{password}@{host}'.format(
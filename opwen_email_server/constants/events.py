@@ -1,8 +1,10 @@
 from typing_extensions import Final  # noqa: F401
 
 CLIENT_DELETED = 'client_deleted'  # type: Final
+CLIENT_DELETE_REQUESTED = 'client_delete_requested'  # type: Final
 CLIENT_FETCHED = 'client_fetched'  # type: Final
 CLIENTS_FETCHED = 'clients_fetched'  # type: Final
+CLIENTS_METRICS_FETCHED = 'clients_metrics_fetched'  # type: Final
 CLIENT_CREATED = 'client_created'  # type: Final
 NEW_CLIENT_REGISTERED = 'new_client_registered'  # type: Final
 UNREGISTERED_CLIENT = 'unregistered_client'  # type: Final
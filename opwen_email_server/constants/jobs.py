@@ -0,0 +1,9 @@
+from typing_extensions import Final  # noqa: F401
+
+QUEUED = 'queued'  # type: Final
+RUNNING = 'running'  # type: Final
+DONE = 'done'  # type: Final
+FAILED = 'failed'  # type: Final
+
+DELETE_CLIENT = 'delete_client'  # type: Final
+WRITTEN_STORE = 'written_store'  # type: Final
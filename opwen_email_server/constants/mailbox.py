@@ -4,3 +4,5 @@ MAILBOX_DOMAIN = 'lokole.ca'  # type: Final
 RECEIVED_FOLDER = 'received'  # type: Final
 SENT_FOLDER = 'sent'  # type: Final
 FUTURE_TIMESTAMP = 2100000000  # type: Final
+SUMMARY_FIELDS = ('from', 'to', 'cc', 'subject', 'sent_at')  # type: Final
+SNIPPET_LENGTH = 160  # type: Final
@@ -0,0 +1,4 @@
+from typing_extensions import Final  # noqa: F401
+
+PENDING_EMAILS = 'pending_emails'  # type: Final
+USERS = 'users'  # type: Final
@@ -2,3 +2,4 @@ from typing_extensions import Final  # noqa: F401
 
 EMAILS_FILE = 'emails.jsonl'  # type: Final
 USERS_FILE = 'zzusers.jsonl'  # type: Final
+USERS_MANIFEST = 'users'  # type: Final
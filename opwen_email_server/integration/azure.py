@@ -1,14 +1,62 @@
+from typing import Type
+from typing import TypeVar
+from typing import Union
+
 from opwen_email_server import config
 from opwen_email_server.services.auth import Auth
 from opwen_email_server.services.auth import AzureAuth
 from opwen_email_server.services.auth import NoAuth
+from opwen_email_server.services.counters import DomainCounters
+from opwen_email_server.services.index import MailboxIndex
+from opwen_email_server.services.index import SearchIndex
+from opwen_email_server.services.index_store import AzureTableIndexStore
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.services.index_store import MarkerStore
+from opwen_email_server.services.index_store import SqliteIndexStore
+from opwen_email_server.services.manifests import ContentManifests
+from opwen_email_server.services.progress import CheckpointStore
+from opwen_email_server.services.progress import ProgressStore
 from opwen_email_server.services.storage import AzureFileStorage
+from opwen_email_server.services.storage import AzureMarkerStorage
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.services.tokens import DomainTokens
 from opwen_email_server.utils.collections import singleton
 from opwen_email_server.utils.unique import NewGuid
 
+_TABLE_CONTAINERS = frozenset([
+    config.CONTAINER_AUTH,
+    config.CONTAINER_JOBS,
+    config.CONTAINER_MANIFESTS,
+    config.CONTAINER_METRICS,
+    config.CONTAINER_PENDING,
+    config.CONTAINER_TOKENS,
+    config.CONTAINER_USERS,
+])
+
+_BlobStore = TypeVar('_BlobStore', AzureMarkerStorage, AzureObjectStorage)
+
+
+def _get_index_store(storage_type: Type[_BlobStore], container: str,
+                     **kwargs) -> Union[_BlobStore, SqliteIndexStore, AzureTableIndexStore]:
+    if config.INDEX_STORE_PROVIDER == 'SQLITE':
+        return SqliteIndexStore(
+            path=config.INDEX_STORE_PATH,
+            table=container,
+            case_sensitive=kwargs.get('case_sensitive', True),
+        )
+    if config.INDEX_STORE_PROVIDER == 'TABLES' and container in _TABLE_CONTAINERS:
+        return AzureTableIndexStore(
+            account=kwargs['account'],
+            key=kwargs['key'],
+            table=container,
+            host=config.INDEX_STORE_HOST,
+            secure=kwargs.get('secure', True),
+            case_sensitive=kwargs.get('case_sensitive', True),
+        )
+    return storage_type(container=container, **kwargs)
+
 
 def get_no_auth() -> NoAuth:
     return NoAuth()
@@ -22,15 +70,20 @@ def get_guid_source() -> NewGuid:
 @singleton
 def get_auth() -> Auth:
     return AzureAuth(
-        storage=AzureObjectStorage(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_AUTH,
             account=config.TABLES_ACCOUNT,
             key=config.TABLES_KEY,
             host=config.TABLES_HOST,
             secure=config.TABLES_SECURE,
-            container=config.CONTAINER_AUTH,
             provider=config.STORAGE_PROVIDER,
         ),
         sudo_scope=config.REGISTRATION_SUDO_TEAM,
+        cache_ttl_seconds=config.AUTH_CACHE_TTL_SECONDS,
+        cache_negative_ttl_seconds=config.AUTH_CACHE_NEGATIVE_TTL_SECONDS,
+        cache_max_items=config.AUTH_CACHE_MAX_ITEMS,
+        cache_check_seconds=config.AUTH_CACHE_CHECK_SECONDS,
     )
 
 
@@ -74,18 +127,97 @@ def get_email_storage() -> AzureObjectStorage:
 
 
 @singleton
-def get_user_storage() -> AzureObjectStorage:
-    return AzureObjectStorage(
+def get_user_storage() -> IndexStore:
+    return _get_index_store(
+        AzureObjectStorage,
+        config.CONTAINER_USERS,
         account=config.TABLES_ACCOUNT,
         key=config.TABLES_KEY,
         host=config.TABLES_HOST,
         secure=config.TABLES_SECURE,
-        container=config.CONTAINER_USERS,
         provider=config.STORAGE_PROVIDER,
         case_sensitive=False,
     )
 
 
+@singleton
+def get_content_manifests() -> ContentManifests:
+    return ContentManifests(storage=_get_index_store(
+        AzureObjectStorage,
+        config.CONTAINER_MANIFESTS,
+        account=config.TABLES_ACCOUNT,
+        key=config.TABLES_KEY,
+        host=config.TABLES_HOST,
+        secure=config.TABLES_SECURE,
+        provider=config.STORAGE_PROVIDER,
+        case_sensitive=False,
+    ))
+
+
+@singleton
+def get_domain_counters() -> DomainCounters:
+    return DomainCounters(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_METRICS,
+            account=config.TABLES_ACCOUNT,
+            key=config.TABLES_KEY,
+            host=config.TABLES_HOST,
+            secure=config.TABLES_SECURE,
+            provider=config.STORAGE_PROVIDER,
+            case_sensitive=False,
+        ),
+        reconcile_interval_seconds=config.METRICS_RECONCILE_INTERVAL_SECONDS,
+    )
+
+
+@singleton
+def get_progress_store() -> ProgressStore:
+    return ProgressStore(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_JOBS,
+            account=config.TABLES_ACCOUNT,
+            key=config.TABLES_KEY,
+            host=config.TABLES_HOST,
+            secure=config.TABLES_SECURE,
+            provider=config.STORAGE_PROVIDER,
+        ),
+        stale_after_seconds=config.DELETE_CLIENT_STALE_AFTER_SECONDS,
+    )
+
+
+@singleton
+def get_checkpoint_store() -> CheckpointStore:
+    return CheckpointStore(storage=_get_index_store(
+        AzureObjectStorage,
+        config.CONTAINER_JOBS,
+        account=config.TABLES_ACCOUNT,
+        key=config.TABLES_KEY,
+        host=config.TABLES_HOST,
+        secure=config.TABLES_SECURE,
+        provider=config.STORAGE_PROVIDER,
+    ))
+
+
+@singleton
+def get_domain_tokens() -> DomainTokens:
+    return DomainTokens(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_TOKENS,
+            account=config.TABLES_ACCOUNT,
+            key=config.TABLES_KEY,
+            host=config.TABLES_HOST,
+            secure=config.TABLES_SECURE,
+            provider=config.STORAGE_PROVIDER,
+            case_sensitive=False,
+        ),
+        max_tokens=config.DOMAIN_MAX_CONCURRENCY,
+        lease_seconds=config.DOMAIN_TOKEN_LEASE_SECONDS,
+    )
+
+
 @singleton
 def get_mailbox_storage() -> AzureTextStorage:
     return AzureTextStorage(
@@ -100,12 +232,49 @@ def get_mailbox_storage() -> AzureTextStorage:
 
 
 @singleton
-def get_pending_storage() -> AzureTextStorage:
-    return AzureTextStorage(
+def get_mailbox_index() -> MailboxIndex:
+    return MailboxIndex(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_MAILBOX,
+            account=config.BLOBS_ACCOUNT,
+            key=config.BLOBS_KEY,
+            host=config.BLOBS_HOST,
+            secure=config.BLOBS_SECURE,
+            provider=config.STORAGE_PROVIDER,
+            case_sensitive=False,
+        ),
+        max_deltas=config.MAILBOX_INDEX_MAX_DELTAS,
+        segment_size=config.MAILBOX_INDEX_SEGMENT_SIZE,
+    )
+
+
+@singleton
+def get_search_index() -> SearchIndex:
+    return SearchIndex(
+        storage=_get_index_store(
+            AzureObjectStorage,
+            config.CONTAINER_MAILBOX,
+            account=config.BLOBS_ACCOUNT,
+            key=config.BLOBS_KEY,
+            host=config.BLOBS_HOST,
+            secure=config.BLOBS_SECURE,
+            provider=config.STORAGE_PROVIDER,
+            case_sensitive=False,
+        ),
+        max_deltas=config.SEARCH_INDEX_MAX_DELTAS,
+        num_buckets=config.SEARCH_INDEX_BUCKETS,
+    )
+
+
+@singleton
+def get_pending_storage() -> MarkerStore:
+    return _get_index_store(
+        AzureMarkerStorage,
+        config.CONTAINER_PENDING,
         account=config.TABLES_ACCOUNT,
         key=config.TABLES_KEY,
         host=config.TABLES_HOST,
         secure=config.TABLES_SECURE,
-        container=config.CONTAINER_PENDING,
         provider=config.STORAGE_PROVIDER,
     )
@@ -1,25 +1,43 @@
+from random import uniform
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
 from celery import Celery
 
 from opwen_email_server import config
+from opwen_email_server.actions import BackfillMailboxIndex
 from opwen_email_server.actions import IndexReceivedEmailForMailbox
 from opwen_email_server.actions import IndexSentEmailForMailbox
 from opwen_email_server.actions import ProcessServiceEmail
+from opwen_email_server.actions import PurgeClient
+from opwen_email_server.actions import ReconcileDomainMetrics
 from opwen_email_server.actions import RegisterClient
 from opwen_email_server.actions import SendOutboundEmails
 from opwen_email_server.actions import StoreInboundEmails
 from opwen_email_server.actions import StoreWrittenClientEmails
 from opwen_email_server.integration.azure import get_auth
+from opwen_email_server.integration.azure import get_checkpoint_store
 from opwen_email_server.integration.azure import get_client_storage
+from opwen_email_server.integration.azure import get_content_manifests
+from opwen_email_server.integration.azure import get_domain_counters
+from opwen_email_server.integration.azure import get_domain_tokens
 from opwen_email_server.integration.azure import get_email_storage
 from opwen_email_server.integration.azure import get_guid_source
+from opwen_email_server.integration.azure import get_mailbox_index
 from opwen_email_server.integration.azure import get_mailbox_storage
 from opwen_email_server.integration.azure import get_pending_storage
+from opwen_email_server.integration.azure import get_progress_store
 from opwen_email_server.integration.azure import get_raw_email_storage
+from opwen_email_server.integration.azure import get_search_index
 from opwen_email_server.integration.azure import get_user_storage
 from opwen_email_server.mailers import REGISTRY
+from opwen_email_server.services.dns import DeleteMxRecords
 from opwen_email_server.services.dns import SetupMxRecords
+from opwen_email_server.services.sendgrid import DeleteSendgridMailbox
 from opwen_email_server.services.sendgrid import SendSendgridEmail
 from opwen_email_server.services.sendgrid import SetupSendgridMailbox
+from opwen_email_server.utils.lanes import lane_queue
 
 celery = Celery(broker=config.QUEUE_BROKER)
 
@@ -46,23 +64,61 @@ def register_client(domain: str, owner: str) -> None:
 
 
 @celery.task(ignore_result=True)
-def index_received_email_for_mailbox(resource_id: str) -> None:
+def delete_client(domain: str) -> None:
+    action = PurgeClient(
+        auth=get_auth(),
+        delete_mailbox=DeleteSendgridMailbox(key=config.SENDGRID_KEY),
+        delete_mx_records=DeleteMxRecords(
+            account=config.DNS_ACCOUNT,
+            secret=config.DNS_SECRET,
+            provider=config.DNS_PROVIDER,
+        ),
+        mailbox_storage=get_mailbox_storage(),
+        mailbox_index=get_mailbox_index(),
+        pending_storage=get_pending_storage(),
+        user_storage=get_user_storage(),
+        user_manifests=get_content_manifests(),
+        domain_counters=get_domain_counters(),
+        progress=get_progress_store(),
+        max_workers=config.DELETE_CLIENT_MAX_WORKERS,
+    )
+
+    action(domain)
+
+
+@celery.task(ignore_result=True)
+def index_received_email_for_mailbox(resource_id: str, domain: Optional[str] = None, defers: int = 0) -> None:
     action = IndexReceivedEmailForMailbox(
         email_storage=get_email_storage(),
-        mailbox_storage=get_mailbox_storage(),
+        mailbox_index=get_mailbox_index(),
+        search_index=get_search_index(),
     )
 
-    action(resource_id)
+    _run_with_domain_token(index_received_email_for_mailbox, config.MAILBOX_RECEIVED_LANES, resource_id, domain, action,
+                           defers)
 
 
 @celery.task(ignore_result=True)
-def index_sent_email_for_mailbox(resource_id: str) -> None:
+def index_sent_email_for_mailbox(resource_id: str, domain: Optional[str] = None, defers: int = 0) -> None:
     action = IndexSentEmailForMailbox(
+        email_storage=get_email_storage(),
+        mailbox_index=get_mailbox_index(),
+        search_index=get_search_index(),
+    )
+
+    _run_with_domain_token(index_sent_email_for_mailbox, config.MAILBOX_SENT_LANES, resource_id, domain, action, defers)
+
+
+@celery.task(ignore_result=True)
+def backfill_mailbox_index(domain: str) -> None:
+    action = BackfillMailboxIndex(
         email_storage=get_email_storage(),
         mailbox_storage=get_mailbox_storage(),
+        mailbox_index=get_mailbox_index(),
+        search_index=get_search_index(),
     )
 
-    action(resource_id)
+    action(domain)
 
 
 @celery.task(ignore_result=True)
@@ -71,38 +127,67 @@ def inbound_store(resource_id: str) -> None:
         raw_email_storage=get_raw_email_storage(),
         email_storage=get_email_storage(),
         pending_storage=get_pending_storage(),
-        next_task=index_received_email_for_mailbox.delay,
+        domain_counters=get_domain_counters(),
+        next_task=index_received_email_for_domain,
     )
 
     action(resource_id)
 
 
-def send_and_index_email(resource_id: str) -> None:
-    send.delay(resource_id)
-    index_sent_email_for_mailbox.delay(resource_id)
-    index_received_email_for_mailbox.delay(resource_id)
+def index_received_email_for_domain(resource_id: str, domain: str) -> None:
+    _apply_in_lane(index_received_email_for_mailbox, config.MAILBOX_RECEIVED_LANES, resource_id, domain)
 
 
-@celery.task(ignore_result=True)
-def written_store(resource_id: str) -> None:
+def inbound_store_for_size(resource_id: str, num_bytes: int) -> None:
+    if _is_large(num_bytes):
+        inbound_store.apply_async(args=(resource_id, ), queue=config.INBOUND_STORE_LARGE_QUEUE)
+    else:
+        inbound_store.delay(resource_id)
+
+
+def send_and_index_email(resource_id: str, domain: str, num_bytes: int) -> None:
+    if _is_large(num_bytes):
+        send.apply_async(args=(resource_id, ), queue=config.SEND_LARGE_QUEUE)
+    else:
+        _apply_in_lane(send, config.SEND_LANES, resource_id, domain)
+    _apply_in_lane(index_sent_email_for_mailbox, config.MAILBOX_SENT_LANES, resource_id, domain)
+    _apply_in_lane(index_received_email_for_mailbox, config.MAILBOX_RECEIVED_LANES, resource_id, domain)
+
+
+def written_store_for_domain(resource_id: str, domain: str) -> None:
+    _apply_in_lane(written_store, config.WRITTEN_STORE_LANES, resource_id, domain)
+
+
+@celery.task(ignore_result=True,
+             acks_late=True,
+             reject_on_worker_lost=True,
+             autoretry_for=(Exception, ),
+             retry_backoff=True,
+             max_retries=config.WRITTEN_STORE_MAX_RETRIES)
+def written_store(resource_id: str, domain: Optional[str] = None, defers: int = 0) -> None:
     action = StoreWrittenClientEmails(
         client_storage=get_client_storage(),
         email_storage=get_email_storage(),
         user_storage=get_user_storage(),
+        user_manifests=get_content_manifests(),
+        domain_counters=get_domain_counters(),
         next_task=send_and_index_email,
+        checkpoints=get_checkpoint_store(),
+        max_workers=config.WRITTEN_STORE_MAX_WORKERS,
+        checkpoint_interval=config.WRITTEN_STORE_CHECKPOINT_INTERVAL,
     )
 
-    action(resource_id)
+    _run_with_domain_token(written_store, config.WRITTEN_STORE_LANES, resource_id, domain, action, defers)
 
 
 @celery.task(ignore_result=True)
-def send(resource_id: str) -> None:
+def send(resource_id: str, domain: Optional[str] = None, defers: int = 0) -> None:
     action = SendOutboundEmails(
         email_storage=get_email_storage(),
         send_email=SendSendgridEmail(key=config.SENDGRID_KEY),
     )
 
-    action(resource_id)
+    _run_with_domain_token(send, config.SEND_LANES, resource_id, domain, action, defers)
 
 
 @celery.task(ignore_result=True)
@@ -112,23 +197,88 @@ def process_service_email(resource_id: str) -> None:
         email_storage=get_email_storage(),
         registry=REGISTRY,
         next_task=send_and_index_email,
+        max_workers=config.SERVICE_MAILERS_MAX_WORKERS,
     )
 
     action(resource_id)
 
 
+def process_service_email_for_size(resource_id: str, num_bytes: int) -> None:
+    if _is_large(num_bytes):
+        process_service_email.apply_async(args=(resource_id, ), queue=config.PROCESS_SERVICE_LARGE_QUEUE)
+    else:
+        process_service_email.delay(resource_id)
+
+
+@celery.task(ignore_result=True)
+def reconcile_metrics(domain: str) -> None:
+    action = ReconcileDomainMetrics(
+        pending_storage=get_pending_storage(),
+        user_storage=get_user_storage(),
+        domain_counters=get_domain_counters(),
+    )
+
+    action(domain)
+
+
 def _fqn(task):
     return f'{__name__}.{task.__name__}'
 
 
+def _is_large(num_bytes: int) -> bool:
+    return num_bytes >= config.LARGE_EMAIL_BYTES
+
+
+def _apply_in_lane(task, queues: Tuple[str, ...], resource_id: str, domain: str) -> None:
+    task.apply_async(args=(resource_id, ), kwargs={'domain': domain}, queue=lane_queue(queues, domain))
+
+
+def _defer_seconds(defers: int) -> float:
+    max_seconds = min(config.DOMAIN_TOKEN_DEFER_SECONDS * 2**defers, config.DOMAIN_TOKEN_DEFER_MAX_SECONDS)
+    return uniform(config.DOMAIN_TOKEN_DEFER_SECONDS, max(max_seconds, config.DOMAIN_TOKEN_DEFER_SECONDS))  # nosec
+
+
+def _run_with_domain_token(task,
+                           queues: Tuple[str, ...],
+                           resource_id: str,
+                           domain: Optional[str],
+                           action: Callable[[str], object],
+                           defers: int = 0) -> None:
+    if not domain or config.DOMAIN_MAX_CONCURRENCY <= 0:
+        action(resource_id)
+        return
+
+    tokens = get_domain_tokens()
+    name = queues[0]
+    lease = tokens.acquire(domain, name)
+    if lease is None and defers < config.DOMAIN_TOKEN_MAX_DEFERS:
+        # count deferrals outside of the celery retries so that they don't use up the retries for errors
+        task.apply_async(args=(resource_id, ),
+                         kwargs={'domain': domain, 'defers': defers + 1},
+                         queue=lane_queue(queues, domain),
+                         countdown=_defer_seconds(defers),
+                         retries=task.request.retries or 0)
+        return
+
+    # per-domain fairness is best effort so run without a token once the deferrals are used up
+    try:
+        action(resource_id)
+    finally:
+        if lease is not None:
+            tokens.release(domain, name, lease)
+
+
 task_routes = {
     _fqn(register_client): {'queue': config.REGISTER_CLIENT_QUEUE},
+    _fqn(delete_client): {'queue': config.DELETE_CLIENT_QUEUE},
     _fqn(index_received_email_for_mailbox): {'queue': config.MAILBOX_RECEIVED_QUEUE},
+    _fqn(backfill_mailbox_index): {'queue': config.MAILBOX_RECEIVED_QUEUE},
     _fqn(index_sent_email_for_mailbox): {'queue': config.MAILBOX_SENT_QUEUE},
     _fqn(process_service_email): {'queue': config.PROCESS_SERVICE_QUEUE},
     _fqn(inbound_store): {'queue': config.INBOUND_STORE_QUEUE},
     _fqn(written_store): {'queue': config.WRITTEN_STORE_QUEUE},
-    _fqn(send): {'queue': config.SEND_QUEUE}
+    _fqn(send): {'queue': config.SEND_QUEUE},
+    _fqn(reconcile_metrics): {'queue': config.RECONCILE_METRICS_QUEUE},
 }
 
 celery.conf.update(task_routes=task_routes)
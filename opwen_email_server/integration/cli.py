@@ -6,6 +6,8 @@ from azure.servicebus import ServiceBusClient
 from libcloud.storage.providers import get_driver
 
 from opwen_email_server import config
+from opwen_email_server.integration.azure import get_auth
+from opwen_email_server.integration.celery import backfill_mailbox_index
 
 _STORAGES = (
     (
@@ -36,17 +38,45 @@ def cli():
 
 @cli.command()
 @click.option('--separator', '-s', default='\n')
-def print_queues(separator):
-    click.echo(
-        separator.join((
-            config.REGISTER_CLIENT_QUEUE,
-            config.INBOUND_STORE_QUEUE,
-            config.WRITTEN_STORE_QUEUE,
-            config.PROCESS_SERVICE_QUEUE,
-            config.SEND_QUEUE,
-            config.MAILBOX_RECEIVED_QUEUE,
-            config.MAILBOX_SENT_QUEUE,
-        )))
+@click.option('--pool', type=click.Choice(['all', 'small', 'large', 'service']), default='all')
+def print_queues(separator, pool):
+    small_queues = (
+        config.REGISTER_CLIENT_QUEUE,
+        config.INBOUND_STORE_QUEUE,
+        *config.WRITTEN_STORE_LANES,
+        *config.SEND_LANES,
+        *config.MAILBOX_RECEIVED_LANES,
+        *config.MAILBOX_SENT_LANES,
+        config.RECONCILE_METRICS_QUEUE,
+        config.DELETE_CLIENT_QUEUE,
+    )
+
+    large_queues = (
+        config.INBOUND_STORE_LARGE_QUEUE,
+        config.SEND_LARGE_QUEUE,
+        config.PROCESS_SERVICE_LARGE_QUEUE,
+    )
+
+    service_queues = (config.PROCESS_SERVICE_QUEUE, )
+
+    queues = {
+        'all': small_queues + large_queues + service_queues,
+        'small': small_queues,
+        'large': large_queues,
+        'service': service_queues,
+    }
+
+    click.echo(separator.join(queues[pool]))
+
+
+@cli.command('backfill-mailbox-index')
+@click.option('--domain', '-d', multiple=True)
+def schedule_mailbox_index_backfill(domain):
+    domains = domain or get_auth().domains()
+
+    for name in domains:
+        click.echo(f'Scheduling mailbox index backfill for {name}')
+        backfill_mailbox_index.delay(name)
 
 
 @cli.command()
@@ -1,46 +1,50 @@
 from opwen_email_server import config
+from opwen_email_server.actions import CalculateClientsMetrics
 from opwen_email_server.actions import CalculateNumberOfUsersMetric
 from opwen_email_server.actions import CalculatePendingEmailsMetric
 from opwen_email_server.actions import CreateClient
 from opwen_email_server.actions import DeleteClient
 from opwen_email_server.actions import DownloadClientEmails
 from opwen_email_server.actions import GetClient
+from opwen_email_server.actions import GetClientDeletion
 from opwen_email_server.actions import ListClients
 from opwen_email_server.actions import Ping
 from opwen_email_server.actions import ReceiveInboundEmail
 from opwen_email_server.actions import UploadClientEmails
 from opwen_email_server.integration.azure import get_auth
 from opwen_email_server.integration.azure import get_client_storage
+from opwen_email_server.integration.azure import get_domain_counters
 from opwen_email_server.integration.azure import get_email_storage
-from opwen_email_server.integration.azure import get_mailbox_storage
 from opwen_email_server.integration.azure import get_no_auth
 from opwen_email_server.integration.azure import get_pending_storage
+from opwen_email_server.integration.azure import get_progress_store
 from opwen_email_server.integration.azure import get_raw_email_storage
 from opwen_email_server.integration.azure import get_user_storage
-from opwen_email_server.integration.celery import inbound_store
-from opwen_email_server.integration.celery import process_service_email
+from opwen_email_server.integration.celery import delete_client
+from opwen_email_server.integration.celery import inbound_store_for_size
+from opwen_email_server.integration.celery import process_service_email_for_size
+from opwen_email_server.integration.celery import reconcile_metrics
 from opwen_email_server.integration.celery import register_client
-from opwen_email_server.integration.celery import written_store
+from opwen_email_server.integration.celery import written_store_for_domain
 from opwen_email_server.services.auth import BasicAuth
 from opwen_email_server.services.auth import GithubAuth
-from opwen_email_server.services.dns import DeleteMxRecords
-from opwen_email_server.services.sendgrid import DeleteSendgridMailbox
+from opwen_email_server.utils.cache import TTLCache
 
 email_receive = ReceiveInboundEmail(
     auth=get_auth(),
     raw_email_storage=get_raw_email_storage(),
-    next_task=inbound_store.delay,
+    next_task=inbound_store_for_size,
 )
 
 receive_service_email = ReceiveInboundEmail(
     auth=get_no_auth(),
     raw_email_storage=get_raw_email_storage(),
-    next_task=process_service_email,
+    next_task=process_service_email_for_size,
 )
 
 client_write = UploadClientEmails(
     auth=get_auth(),
-    next_task=written_store.delay,
+    next_task=written_store_for_domain,
 )
 
 client_read = DownloadClientEmails(
@@ -48,6 +52,7 @@ client_read = DownloadClientEmails(
     client_storage=get_client_storage(),
     email_storage=get_email_storage(),
     pending_storage=get_pending_storage(),
+    domain_counters=get_domain_counters(),
 )
 
 client_create = CreateClient(
@@ -64,31 +69,44 @@ client_get = GetClient(
 
 client_delete = DeleteClient(
     auth=get_auth(),
-    delete_mailbox=DeleteSendgridMailbox(key=config.SENDGRID_KEY),
-    delete_mx_records=DeleteMxRecords(
-        account=config.DNS_ACCOUNT,
-        secret=config.DNS_SECRET,
-        provider=config.DNS_PROVIDER,
-    ),
-    mailbox_storage=get_mailbox_storage(),
-    pending_storage=get_pending_storage(),
-    user_storage=get_user_storage(),
+    progress=get_progress_store(),
+    task=delete_client.delay,
+)
+
+client_deletion_get = GetClientDeletion(
+    auth=get_auth(),
+    progress=get_progress_store(),
 )
 
 metrics_users = CalculateNumberOfUsersMetric(
     auth=get_auth(),
-    user_storage=get_user_storage(),
+    storage=get_user_storage(),
+    domain_counters=get_domain_counters(),
+    reconcile=reconcile_metrics.delay,
 )
 
 metrics_pending = CalculatePendingEmailsMetric(
     auth=get_auth(),
-    pending_storage=get_pending_storage(),
+    storage=get_pending_storage(),
+    domain_counters=get_domain_counters(),
+    reconcile=reconcile_metrics.delay,
+)
+
+metrics_clients = CalculateClientsMetrics(
+    auth=get_auth(),
+    domain_metrics=[metrics_pending, metrics_users],
+    cache=TTLCache(ttl_seconds=config.METRICS_CACHE_TTL_SECONDS),
+    max_workers=config.METRICS_MAX_WORKERS,
 )
 
 basic_auth = BasicAuth(users={
     config.REGISTRATION_USERNAME: {'password': config.REGISTRATION_PASSWORD},
 })
 
-github_auth = GithubAuth(organization=config.REGISTRATION_GITHUB_ORGANIZATION)
+github_auth = GithubAuth(
+    organization=config.REGISTRATION_GITHUB_ORGANIZATION,
+    cache_ttl_seconds=config.GITHUB_AUTH_CACHE_TTL_SECONDS,
+    cache_max_items=config.GITHUB_AUTH_CACHE_MAX_ITEMS,
+)
 
 healthcheck = Ping()
@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Callable
+from typing import Dict
 from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 from cached_property import cached_property
@@ -16,17 +20,24 @@ from opwen_email_client.domain.email.user_store import UserStore
 from opwen_email_client.domain.email.user_store import UserWriteStore
 from opwen_email_client.webapp.config import AppConfig
 from opwen_email_server.constants import mailbox
+from opwen_email_server.constants import sync
+from opwen_email_server.integration.azure import get_content_manifests
 from opwen_email_server.integration.azure import get_email_storage
-from opwen_email_server.integration.azure import get_mailbox_storage
+from opwen_email_server.integration.azure import get_mailbox_index
 from opwen_email_server.integration.azure import get_pending_storage
+from opwen_email_server.integration.azure import get_search_index
 from opwen_email_server.integration.azure import get_user_storage
 from opwen_email_server.integration.celery import send_and_index_email
+from opwen_email_server.services.index import MailboxIndex
+from opwen_email_server.services.index import SearchIndex
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.services.index_store import MarkerStore
+from opwen_email_server.services.manifests import ContentManifests
 from opwen_email_server.services.storage import AzureObjectStorage
-from opwen_email_server.services.storage import AzureTextStorage
-from opwen_email_server.utils.collections import chunks
 from opwen_email_server.utils.email_parser import descending_timestamp
 from opwen_email_server.utils.email_parser import ensure_has_sent_at
 from opwen_email_server.utils.email_parser import get_domain
+from opwen_email_server.utils.email_parser import get_email_size
 from opwen_email_server.utils.email_parser import get_recipients
 from opwen_email_server.utils.log import LogMixin
 
@@ -74,11 +85,12 @@ class AzureUser(User):
 
 
 class AzureUserStore(UserStore, UserReadStore, UserWriteStore):
-    def __init__(self, user_storage: AzureObjectStorage):
+    def __init__(self, user_storage: IndexStore, user_manifests: ContentManifests):
         UserReadStore.__init__(self, user_model=AzureUser, role_model=AzureRole)
         UserWriteStore.__init__(self, db=None)
         UserStore.__init__(self, read=self, write=self)
         self._user_storage = user_storage
+        self._user_manifests = user_manifests
 
     def init_app(self, app):
         pass
@@ -120,6 +132,7 @@ class AzureUserStore(UserStore, UserReadStore, UserWriteStore):
 
     def delete(self, user: AzureUser) -> None:
         self._user_storage.delete(self._path_for(user.email))
+        self._user_manifests.delete(get_domain(user.email), sync.USERS_MANIFEST)
 
     @classmethod
     def _path_for(cls, email: str) -> str:
@@ -127,13 +140,20 @@ class AzureUserStore(UserStore, UserReadStore, UserWriteStore):
 
 
 class AzureEmailStore(EmailStore, LogMixin):
-    def __init__(self, email_storage: AzureObjectStorage, mailbox_storage: AzureTextStorage,
-                 pending_storage: AzureTextStorage, send_email: Callable[[str], None]):
+    def __init__(self,
+                 email_storage: AzureObjectStorage,
+                 mailbox_index: MailboxIndex,
+                 search_index: SearchIndex,
+                 pending_storage: MarkerStore,
+                 send_email: Callable[[str, str, int], None],
+                 max_fetch_workers: int = 8):
         super().__init__(restricted=None)
         self._email_storage = email_storage
-        self._mailbox_storage = mailbox_storage
+        self._mailbox_index = mailbox_index
+        self._search_index = search_index
         self._pending_storage = pending_storage
         self._send_email = send_email
+        self._max_fetch_workers = max_fetch_workers
 
     def _create(self, emails_or_attachments: Iterable[dict]):
         for email in emails_or_attachments:
@@ -148,8 +168,8 @@ class AzureEmailStore(EmailStore, LogMixin):
             email.pop('csrf_token', None)
             email_id = email['_uid']
             self._email_storage.store_object(email_id, email)
-            self._pending_storage.store_text(f'{domain}/{email_id}', 'pending')
-            self._send_email(email_id)
+            self._pending_storage.mark(f'{domain}/{email_id}')
+            self._send_email(email_id, domain, get_email_size(email))
 
     def get(self, uid: str) -> Optional[dict]:
         try:
@@ -179,26 +199,74 @@ class AzureEmailStore(EmailStore, LogMixin):
         except (IndexError, ValueError):
             return None
 
-    def inbox(self, email_address: str, page: int) -> Iterable[dict]:
-        return self._iter_mailbox(email_address, page, mailbox.RECEIVED_FOLDER)
+    def inbox(self, email_address: str, page: int, cursor: Optional[str] = None) -> Iterable[dict]:
+        return self._iter_mailbox(email_address, page, mailbox.RECEIVED_FOLDER, cursor)
 
-    def sent(self, email_address: str, page: int) -> Iterable[dict]:
-        return self._iter_mailbox(email_address, page, mailbox.SENT_FOLDER)
+    def sent(self, email_address: str, page: int, cursor: Optional[str] = None) -> Iterable[dict]:
+        return self._iter_mailbox(email_address, page, mailbox.SENT_FOLDER, cursor)
 
-    def _iter_mailbox(self, email_address: str, page: int, folder: str) -> Iterable[dict]:
-        domain = get_domain(email_address)
-        emails = self._mailbox_storage.iter(f'{domain}/{email_address}/{folder}')
-        for i, resource_ids in enumerate(chunks(emails, AppConfig.EMAILS_PER_PAGE), start=1):
-            if i != page:
-                continue
-            for resource_id in resource_ids:
-                email_id = resource_id.split('/')[-1]
-                email = self.get(email_id)
-                if email:
-                    yield email
+    def cursor_for(self, email: dict) -> Optional[str]:
+        sent_at = email.get('sent_at')
+        email_id = email.get('_uid')
+        if not sent_at or not email_id:
+            return None
+        return f'{descending_timestamp(sent_at)}/{email_id}'
+
+    def _iter_mailbox(self, email_address: str, page: int, folder: str, cursor: Optional[str]) -> Iterable[dict]:
+        after = self._parse_cursor(cursor)
+        if after is not None:
+            start = 0
+        else:
+            start = (page - 1) * AppConfig.EMAILS_PER_PAGE
+
+        entries = list(
+            islice(self._mailbox_index.iter(email_address, folder, after), start, start + AppConfig.EMAILS_PER_PAGE))
+
+        legacy_ids = [email_id for _, email_id, summary in entries if 'snippet' not in (summary or {})]
+        legacy_emails = {}  # type: Dict[str, Optional[dict]]
+        if legacy_ids:
+            with ThreadPoolExecutor(max_workers=min(len(legacy_ids), self._max_fetch_workers)) as executor:
+                legacy_emails = dict(zip(legacy_ids, executor.map(self.get, legacy_ids)))
+
+        for _, email_id, summary in entries:
+            if email_id in legacy_emails:
+                email = legacy_emails[email_id]
+            else:
+                email = self._from_summary(email_id, summary)
+
+            if email:
+                yield email
+
+    @classmethod
+    def _from_summary(cls, email_id: str, summary: dict) -> dict:
+        email = {field: summary.get(field) for field in mailbox.SUMMARY_FIELDS}
+        email['_uid'] = email_id
+        email['read'] = True
+        email['body'] = summary.get('snippet')
+        email['is_summary'] = True
+        email['attachments'] = [{
+            '_uid': i,
+            'cid': None,
+            'filename': attachment.get('filename'),
+            'size': attachment.get('size'),
+        } for i, attachment in enumerate(summary.get('attachments') or [])]
+        return email
+
+    @classmethod
+    def _parse_cursor(cls, cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+        if not cursor:
+            return None
+
+        desc_ts, _, email_id = cursor.partition('/')
+        if not desc_ts or not email_id:
+            return None
+
+        return desc_ts, email_id
 
     def search(self, email_address: str, page: int, query: Optional[str]) -> Iterable[dict]:
-        return []
+        start = (page - 1) * AppConfig.EMAILS_PER_PAGE
+        entries = self._search_index.search(email_address, query, start, AppConfig.EMAILS_PER_PAGE)
+        return [self._from_summary(email_id, summary) for _, email_id, summary in entries]
 
     def outbox(self, email_address: str, page: int) -> Iterable[dict]:
         return []
@@ -213,8 +281,6 @@ class AzureEmailStore(EmailStore, LogMixin):
         return 0
 
     def _delete(self, email_address: str, uids: Iterable[str]):
-        domain = get_domain(email_address)
-
         for uid in uids:
             email = self.get(uid)
             if not email:
@@ -229,7 +295,8 @@ class AzureEmailStore(EmailStore, LogMixin):
 
             desc_prefix = descending_timestamp(email['sent_at'])
 
-            self._mailbox_storage.delete(f"{domain}/{email_address}/{folder}/{desc_prefix}/{uid}")
+            self._mailbox_index.remove(email_address, folder, desc_prefix, uid)
+            self._search_index.remove(email_address, desc_prefix, uid)
 
     def _mark_sent(self, uids: Iterable[str]):
         pass
@@ -251,7 +318,8 @@ class AzureIoc:
     def email_store(self):
         return AzureEmailStore(
             email_storage=get_email_storage(),
-            mailbox_storage=get_mailbox_storage(),
+            mailbox_index=get_mailbox_index(),
+            search_index=get_search_index(),
             pending_storage=get_pending_storage(),
             send_email=send_and_index_email,
         )
@@ -262,7 +330,7 @@ class AzureIoc:
 
     @cached_property
     def user_store(self):
-        return AzureUserStore(user_storage=get_user_storage())
+        return AzureUserStore(user_storage=get_user_storage(), user_manifests=get_content_manifests())
 
     @cached_property
     def login_form(self):
@@ -0,0 +1,65 @@
+from asyncio import gather
+from asyncio import get_running_loop
+from asyncio import run
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Union
+from typing import cast
+
+from opwen_email_server.utils.email_parser import remove_spooled_attachments
+from opwen_email_server.utils.log import LogMixin
+
+SyncMailer = Callable[[dict], dict]
+AsyncMailer = Callable[[dict], Awaitable[dict]]
+Mailer = Union[SyncMailer, AsyncMailer]
+
+
+def is_async_mailer(mailer: Any) -> bool:
+    return iscoroutinefunction(mailer) or iscoroutinefunction(getattr(mailer, '__call__', None))
+
+
+class MailerRunner(LogMixin):
+    def __init__(self, registry: Dict[str, Mailer], max_workers: int = 4):
+        self._registry = registry
+        self._max_workers = max(max_workers, 1)
+
+    def __call__(self, email: dict) -> List[dict]:
+        mailers = []
+        for address in email.get('to', []):
+            try:
+                mailers.append(self._registry[address])
+            except KeyError:
+                self.log_warning('Skipping unknown mailer service: %s', address)
+
+        if not mailers:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(len(mailers), self._max_workers)) as executor:
+            return run(self._run(mailers, email, executor))
+
+    async def _run(self, mailers: Iterable[Mailer], email: dict, executor: Executor) -> List[dict]:
+        results = await gather(*(self._format(mailer, dict(email), executor) for mailer in mailers),
+                               return_exceptions=True)
+
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    remove_spooled_attachments(result)
+            raise errors[0]
+
+        return [cast(dict, result) for result in results]
+
+    @classmethod
+    async def _format(cls, mailer: Mailer, email: dict, executor: Executor) -> dict:
+        if is_async_mailer(mailer):
+            return await cast(AsyncMailer, mailer)(email)
+
+        return await get_running_loop().run_in_executor(executor, cast(SyncMailer, mailer), email)
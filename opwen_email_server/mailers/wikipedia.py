@@ -1,7 +1,13 @@
 from datetime import datetime
+from os.path import join
+from tempfile import gettempdir
+from threading import Lock
 from typing import Callable
+from typing import Optional
+from typing import Tuple
 from urllib.parse import urlparse
 
+from requests import RequestException
 from requests import get
 from wikipedia import WikipediaPage
 from wikipedia import languages
@@ -10,35 +16,104 @@ from wikipedia import set_lang
 from wikipedia.exceptions import DisambiguationError
 from wikipedia.exceptions import PageError
 
+from opwen_email_server.config import WIKIPEDIA_LANGUAGES_TTL_SECONDS
+from opwen_email_server.config import WIKIPEDIA_PAGES_CACHE_MAX_ITEMS
+from opwen_email_server.config import WIKIPEDIA_PAGES_TTL_SECONDS
+from opwen_email_server.config import WIKIPEDIA_PDF_CACHE_DIR
+from opwen_email_server.config import WIKIPEDIA_PDF_CACHE_MAX_BYTES
+from opwen_email_server.config import WIKIPEDIA_PDF_CACHE_MAX_ITEM_BYTES
+from opwen_email_server.config import WIKIPEDIA_PDF_CONNECT_TIMEOUT_SECONDS
+from opwen_email_server.config import WIKIPEDIA_PDF_READ_TIMEOUT_SECONDS
+from opwen_email_server.utils.cache import FileCache
+from opwen_email_server.utils.cache import TTLCache
 from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.temporary import SpooledBytes
 
 WIKIPEDIA_ADDRESS = 'wikipedia@bot.lokole.ca'
 
 
 class WikipediaEmailFormatter(LogMixin):
+    _language_lock = Lock()
+
     def __init__(self,
                  languages_getter: Callable[[], dict] = languages,
                  language_setter: Callable[[str], None] = set_lang,
                  page_fetch: Callable[[str], WikipediaPage] = page,
-                 now: Callable[[], datetime] = datetime.utcnow):
+                 now: Callable[[], datetime] = datetime.utcnow,
+                 languages_cache: Optional[TTLCache] = None,
+                 pages_cache: Optional[TTLCache] = None,
+                 pdf_cache: Optional[FileCache] = None,
+                 pdf_connect_timeout_seconds: float = WIKIPEDIA_PDF_CONNECT_TIMEOUT_SECONDS,
+                 pdf_read_timeout_seconds: float = WIKIPEDIA_PDF_READ_TIMEOUT_SECONDS):
         self._now = now
         self._languages = languages_getter
         self._language_setter = language_setter
         self._page_fetch = page_fetch
 
+        if languages_cache is None:
+            languages_cache = TTLCache(ttl_seconds=WIKIPEDIA_LANGUAGES_TTL_SECONDS, max_items=1)
+        if pages_cache is None:
+            pages_cache = TTLCache(ttl_seconds=WIKIPEDIA_PAGES_TTL_SECONDS, max_items=WIKIPEDIA_PAGES_CACHE_MAX_ITEMS)
+        if pdf_cache is None:
+            pdf_cache = FileCache(root=WIKIPEDIA_PDF_CACHE_DIR or join(gettempdir(), 'lokole-wikipedia'),
+                                  max_bytes=WIKIPEDIA_PDF_CACHE_MAX_BYTES,
+                                  max_item_bytes=WIKIPEDIA_PDF_CACHE_MAX_ITEM_BYTES)
+
+        self._languages_cache = languages_cache
+        self._pages_cache = pages_cache
+        self._pdf_cache = pdf_cache
+        self._pdf_timeout_seconds = (pdf_connect_timeout_seconds, pdf_read_timeout_seconds)
+
     def _get_download_link(self, url: str) -> str:
         parsed_url = urlparse(url)
         return parsed_url.scheme + '://' + parsed_url.netloc + '/api/rest_v1/page/pdf/' + parsed_url.path.split('/')[-1]
 
+    def _get_languages(self) -> dict:
+        languages = self._languages_cache.get('languages')
+        if languages is None:
+            languages = self._languages()
+            self._languages_cache.put('languages', languages)
+        return languages
+
+    def _get_page(self, language: str, query: str) -> Tuple[str, str]:
+        key = (language, query)
+        wiki_page = self._pages_cache.get(key)
+        if wiki_page is None:
+            fetched_page = self._page_fetch(query)
+            wiki_page = (fetched_page.title, fetched_page.url)
+            self._pages_cache.put(key, wiki_page)
+        return wiki_page
+
+    def _get_pdf(self, language: str, title: str, url: str) -> Optional[SpooledBytes]:
+        key = f'{language}/{title}'
+        pdf_file = self._pdf_cache.get(key, '.pdf')
+        if pdf_file is not None:
+            return pdf_file
+
+        try:
+            with get(self._get_download_link(url), stream=True, timeout=self._pdf_timeout_seconds) as response:
+                if not response.ok:
+                    self.log_warning('Unable to download %s: status %d', url, response.status_code)
+                    return None
+
+                pdf_file = SpooledBytes.spool(response.iter_content(SpooledBytes.chunk_size), '.pdf')
+        except RequestException as ex:
+            self.log_exception(ex, 'Unable to download %s', url)
+            return None
+
+        self._pdf_cache.put(key, pdf_file)
+        return pdf_file
+
     def __call__(self, email: dict) -> dict:
         language = email['subject']
-        if language in self._languages():
-            self._language_setter(language)
-        else:
-            self._language_setter('en')
+        if language not in self._get_languages():
+            language = 'en'
 
         try:
-            wiki_page = self._page_fetch(email['body'].strip())
+            with self._language_lock:
+                # the wikipedia library keeps the language globally so look up one page at a time
+                self._language_setter(language)
+                title, url = self._get_page(language, email['body'].strip())
         except DisambiguationError as e:
             subject = 'Suggested Searches'
             body = 'Multiple results found. Try again with the following: \n{}'.format('\n'.join(e.options))
@@ -46,14 +121,16 @@ class WikipediaEmailFormatter(LogMixin):
             subject = 'No results'
             body = 'No results found for: {}'.format(email['body'])
         else:
-            subject = wiki_page.title
-            body = 'Results found'
-            download_link = self._get_download_link(wiki_page.url)
-            pdf_file = get(download_link)
-            email['attachments'] = [{
-                'filename': subject + '.pdf',
-                'content': pdf_file.content,
-            }]
+            subject = title
+            pdf_file = self._get_pdf(language, title, url)
+            if pdf_file is None:
+                body = 'Unable to download the article. Please try again later.'
+            else:
+                body = 'Results found'
+                email['attachments'] = [{
+                    'filename': subject + '.pdf',
+                    'content': pdf_file,
+                }]
 
         email['to'] = [email['from']]
         email['from'] = WIKIPEDIA_ADDRESS
@@ -1,6 +1,12 @@
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+from typing import Dict
 from typing import Iterable
 from typing import Iterator
 from typing import Optional
+from typing import Tuple
+from uuid import uuid4
 
 from libcloud.storage.types import ObjectDoesNotExistError
 from requests import RequestException
@@ -8,9 +14,13 @@ from requests import post as http_post
 
 from opwen_email_server.constants import events
 from opwen_email_server.constants import github
-from opwen_email_server.services.storage import AzureObjectStorage
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.utils.cache import SingleFlight
+from opwen_email_server.utils.cache import TTLCache
 from opwen_email_server.utils.log import LogMixin
 
+_MISSING = object()
+
 
 class BasicAuth(LogMixin):
     def __init__(self, users: dict):
@@ -36,23 +46,42 @@ class BasicAuth(LogMixin):
 
 
 class GithubAuth(LogMixin):
-    def __init__(self, organization: str, page_size: int = 50):
+    def __init__(self,
+                 organization: str,
+                 page_size: int = 50,
+                 cache_ttl_seconds: float = 300,
+                 cache_max_items: int = 1024):
         self._organization = organization
         self._page_size = page_size
+        self._cache = TTLCache(ttl_seconds=cache_ttl_seconds, max_items=cache_max_items)
+        self._single_flight = SingleFlight()
 
     def __call__(self, access_token, required_scopes=None):
         if not access_token or not self._organization:
             return None
 
+        token_hash = sha256(access_token.encode('utf-8')).hexdigest()
+
+        user = self._cache.get(token_hash)
+        if user is None:
+            user = self._single_flight(token_hash, lambda: self._fetch_user(access_token, token_hash))
+        if user is None:
+            return None
+
+        login, scopes = user
+        return {'sub': {'name': login, 'scopes': list(scopes)}, 'scope': list(scopes)}
+
+    def _fetch_user(self, access_token: str, token_hash: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
         try:
             query = self._query_github(access_token)
             login = next(query)
-            scopes = list(query)
+            scopes = tuple(query)
         except RequestException:
             self.log_event(events.BAD_PASSWORD, {'username': 'access_token'})  # noqa: E501  # yapf: disable
             return None
 
-        return {'sub': {'name': login, 'scopes': scopes}, 'scope': scopes}
+        self._cache.put(token_hash, (login, scopes))
+        return login, scopes
 
     def _query_github(self, access_token: str) -> Iterator[str]:
         cursor = None
@@ -127,23 +156,40 @@ class Auth:
 
 
 class AzureAuth(Auth, LogMixin):
-    def __init__(self, storage: AzureObjectStorage, sudo_scope: str) -> None:
+    _generation_file = 'cache/generation'
+
+    def __init__(self,
+                 storage: IndexStore,
+                 sudo_scope: str,
+                 cache_ttl_seconds: float = 300,
+                 cache_negative_ttl_seconds: float = 30,
+                 cache_max_items: int = 10000,
+                 cache_check_seconds: float = 5) -> None:
         self._storage = storage
         self._sudo_scope = sudo_scope
+        self._cache = TTLCache(ttl_seconds=cache_ttl_seconds, max_items=cache_max_items)
+        self._cache_negative_ttl_seconds = cache_negative_ttl_seconds
+        self._cache_check_seconds = cache_check_seconds
+        self._single_flight = SingleFlight()
+        self._versions_lock = Lock()
+        self._versions = {}  # type: Dict[str, int]
+        self._epoch = 0
+        self._generation = None  # type: Optional[str]
+        self._generation_checked_at = None  # type: Optional[float]
 
     def insert(self, client_id: str, domain: str, owner: dict) -> None:
         auth = {'client_id': client_id, 'owner': owner['name'], 'domain': domain}
         self._storage.store_object(self._client_id_file(client_id), auth)
         self._storage.store_object(self._domain_file(domain), auth)
+        self._invalidate(self._client_id_file(client_id), self._domain_file(domain))
         self.log_info('Registered client %s at domain %s', client_id, domain)
 
     def is_owner(self, domain: str, user: dict) -> bool:
         if self._sudo_scope in user.get('scopes', []):
             return True
 
-        try:
-            auth = self._storage.fetch_object(self._domain_file(domain))
-        except ObjectDoesNotExistError:
+        auth = self._fetch_auth(self._domain_file(domain))
+        if auth is None:
             self.log_warning('Unrecognized domain %s', domain)
             return False
 
@@ -152,12 +198,12 @@ class AzureAuth(Auth, LogMixin):
     def delete(self, client_id: str, domain: str) -> bool:
         self._storage.delete(self._domain_file(domain))
         self._storage.delete(self._client_id_file(client_id))
+        self._invalidate(self._client_id_file(client_id), self._domain_file(domain))
         return True
 
     def client_id_for(self, domain: str) -> Optional[str]:
-        try:
-            auth = self._storage.fetch_object(self._domain_file(domain))
-        except ObjectDoesNotExistError:
+        auth = self._fetch_auth(self._domain_file(domain))
+        if auth is None:
             self.log_warning('Unrecognized domain %s', domain)
             return None
 
@@ -167,19 +213,75 @@ class AzureAuth(Auth, LogMixin):
         return client_id
 
     def domain_for(self, client_id: str) -> Optional[str]:
-        try:
-            auth = self._storage.fetch_object(self._client_id_file(client_id))
-        except ObjectDoesNotExistError:
+        auth = self._fetch_auth(self._client_id_file(client_id))
+        if auth is None:
             self.log_warning('Unrecognized client %s', client_id)
             return None
-        else:
-            domain = auth['domain']
-            self.log_debug('Client %s has domain %s', client_id, domain)
-            return domain
+
+        domain = auth['domain']
+        self.log_debug('Client %s has domain %s', client_id, domain)
+        return domain
 
     def domains(self) -> Iterable[str]:
         return self._storage.iter(self._domain_file(''))
 
+    def _fetch_auth(self, resource_id: str) -> Optional[dict]:
+        self._sync_generation()
+
+        auth = self._cache.get(resource_id, _MISSING)
+        if auth is not _MISSING:
+            return auth
+
+        return self._single_flight(resource_id, lambda: self._load_auth(resource_id))
+
+    def _load_auth(self, resource_id: str) -> Optional[dict]:
+        with self._versions_lock:
+            version = self._version(resource_id)
+
+        try:
+            auth = self._storage.fetch_object(resource_id)  # type: Optional[dict]
+        except ObjectDoesNotExistError:
+            auth = None
+
+        with self._versions_lock:
+            if self._version(resource_id) == version:
+                ttl_seconds = None if auth is not None else self._cache_negative_ttl_seconds
+                self._cache.put(resource_id, auth, ttl_seconds)
+
+        return auth
+
+    def _version(self, resource_id: str) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(resource_id, 0)
+
+    def _invalidate(self, *resource_ids: str) -> None:
+        with self._versions_lock:
+            for resource_id in resource_ids:
+                self._versions[resource_id] = self._versions.get(resource_id, 0) + 1
+                self._cache.delete(resource_id)
+
+        # clients are registered and deleted by the workers so let the other processes know to drop their caches
+        self._storage.store_object(self._generation_file, {'generation': uuid4().hex})
+
+    def _sync_generation(self) -> None:
+        now = monotonic()
+        with self._versions_lock:
+            checked_at = self._generation_checked_at
+            if checked_at is not None and now - checked_at < self._cache_check_seconds:
+                return
+            self._generation_checked_at = now
+
+        try:
+            generation = self._storage.fetch_object(self._generation_file).get('generation')
+        except ObjectDoesNotExistError:
+            generation = None
+
+        with self._versions_lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._epoch += 1
+                self._cache.clear()
+                self.log_debug('Auth cache generation changed to %s', generation)
+
     @classmethod
     def _domain_file(cls, domain: str) -> str:
         return f'domain/{domain}'
@@ -0,0 +1,62 @@
+from collections import namedtuple
+from time import time
+from typing import Optional
+
+from libcloud.storage.types import ObjectDoesNotExistError
+
+from opwen_email_server.services.index_store import VersionedStore
+from opwen_email_server.utils.log import LogMixin
+
+Counter = namedtuple('Counter', ['value', 'reconciled_at'])
+
+
+class DomainCounters(LogMixin):
+    def __init__(self, storage: VersionedStore, reconcile_interval_seconds: float = 3600, max_attempts: int = 5):
+        self._storage = storage
+        self._reconcile_interval_seconds = reconcile_interval_seconds
+        self._max_attempts = max_attempts
+
+    def get(self, domain: str, name: str) -> Optional[Counter]:
+        try:
+            counter = self._storage.fetch_object(self._path(domain, name))
+        except ObjectDoesNotExistError:
+            return None
+        else:
+            return Counter(counter['value'], counter['reconciled_at'])
+
+    def increment(self, domain: str, name: str, amount: int = 1):
+        if not amount:
+            return
+
+        path = self._path(domain, name)
+
+        for _ in range(self._max_attempts):
+            try:
+                counter, version = self._storage.fetch_versioned_object(path)
+            except ObjectDoesNotExistError:
+                self.log_debug('skipping increment of unreconciled counter %s for %s', name, domain)
+                return
+
+            updated = Counter(max(counter['value'] + amount, 0), counter['reconciled_at'])
+            if self._storage.store_versioned_object(path, updated._asdict(), version):
+                return
+
+        self.log_warning('contention on counter %s for %s, leaving it to the reconcile', name, domain)
+
+    def reconcile(self, domain: str, name: str, value: int) -> int:
+        self._store(domain, name, Counter(value, time()))
+        self.log_debug('reconciled counter %s for %s to %d', name, domain, value)
+        return value
+
+    def is_stale(self, counter: Counter) -> bool:
+        return time() - counter.reconciled_at >= self._reconcile_interval_seconds
+
+    def delete_domain(self, domain: str) -> int:
+        return self._storage.delete_prefix(f'{domain}/')
+
+    def _store(self, domain: str, name: str, counter: Counter):
+        self._storage.store_object(self._path(domain, name), counter._asdict())
+
+    @classmethod
+    def _path(cls, domain: str, name: str) -> str:
+        return f'{domain}/{name}'
@@ -0,0 +1,391 @@
+from bisect import bisect_right
+from collections import defaultdict
+from heapq import merge
+from time import time_ns
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from uuid import uuid4
+from zlib import crc32
+
+from libcloud.storage.types import ObjectDoesNotExistError
+
+from opwen_email_server.services.index_store import VersionedStore
+from opwen_email_server.utils.email_parser import get_domain
+from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.string import tokenize
+
+IndexEntry = Tuple[str, str, dict]
+IndexKey = Tuple[str, str]
+
+
+def _entry_key(entry: Iterable) -> IndexKey:
+    desc_ts, email_id = tuple(entry)[:2]
+    return desc_ts, email_id
+
+
+def _new_name() -> str:
+    return f'{time_ns():020d}-{uuid4().hex}'
+
+
+class _DeltaIndex(LogMixin):
+    def __init__(self, storage: VersionedStore, max_deltas: int):
+        self._storage = storage
+        self._max_deltas = max_deltas
+
+    def _append_delta(self, prefix: str, delta: dict):
+        self._storage.store_object(f'{prefix}/deltas/{_new_name()}', delta)
+        self._compact_if_needed(prefix)
+
+    def _delta_names(self, prefix: str) -> List[str]:
+        return sorted(self._storage.iter(f'{prefix}/deltas/'))
+
+    def _delete_deltas(self, prefix: str, names: Iterable[str]):
+        self._storage.delete_many([f'{prefix}/deltas/{name}' for name in names])
+
+    def _compact_if_needed(self, prefix: str):
+        num_deltas = sum(1 for _ in self._storage.iter(f'{prefix}/deltas/'))
+        if num_deltas >= self._max_deltas:
+            self._compact(prefix)
+
+    def _compact(self, prefix: str):
+        raise NotImplementedError  # pragma: no cover
+
+    def _fetch_manifest(self, prefix: str) -> Tuple[dict, Optional[str]]:
+        try:
+            return self._storage.fetch_versioned_object(f'{prefix}/manifest')
+        except ObjectDoesNotExistError:
+            return {}, None
+
+    def _store_manifest(self, prefix: str, manifest: dict, version: Optional[str]) -> bool:
+        if not self._storage.store_versioned_object(f'{prefix}/manifest', manifest, version):
+            self.log_warning('Concurrent compaction of %s, discarding generation %s', prefix, manifest['generation'])
+            return False
+
+        return True
+
+    def _fetch_deltas(self, prefix: str, names: Iterable[str]) -> Dict[IndexKey, Optional[list]]:
+        deltas = {}  # type: Dict[IndexKey, Optional[list]]
+
+        for name in names:
+            try:
+                delta = self._storage.fetch_object(f'{prefix}/deltas/{name}')
+            except ObjectDoesNotExistError:
+                continue
+
+            for entry in delta.get('add', []):
+                deltas[_entry_key(entry)] = entry
+            for entry in delta.get('remove', []):
+                deltas[_entry_key(entry)] = None
+
+        return deltas
+
+
+class MailboxIndex(_DeltaIndex):
+    def __init__(self, storage: VersionedStore, max_deltas: int = 64, segment_size: int = 500):
+        super().__init__(storage, max_deltas)
+        self._segment_size = segment_size
+
+    def add(self, email_address: str, folder: str, desc_ts: str, email_id: str, summary: dict):
+        self._append_delta(self._mailbox(email_address, folder), {'add': [[desc_ts, email_id, summary]]})
+
+    def add_many(self, email_address: str, folder: str, entries: Iterable[IndexEntry]):
+        self._append_delta(self._mailbox(email_address, folder), {'add': [list(entry) for entry in entries]})
+
+    def remove(self, email_address: str, folder: str, desc_ts: str, email_id: str):
+        self._append_delta(self._mailbox(email_address, folder), {'remove': [[desc_ts, email_id]]})
+
+    def iter(self, email_address: str, folder: str, after: Optional[IndexKey] = None) -> Iterator[IndexEntry]:
+        mailbox = self._mailbox(email_address, folder)
+        manifest, _ = self._fetch_manifest(mailbox)
+        deltas = self._fetch_deltas(mailbox, self._delta_names(mailbox))
+        return self._merge(mailbox, manifest, deltas, after)
+
+    def compact(self, email_address: str, folder: str):
+        self._compact(self._mailbox(email_address, folder))
+
+    def delete_domain(self, domain: str) -> int:
+        return self._storage.delete_prefix(f'{domain}/')
+
+    @classmethod
+    def _mailbox(cls, email_address: str, folder: str) -> str:
+        return f'{get_domain(email_address)}/{email_address}/{folder}'
+
+    def _compact(self, mailbox: str):
+        manifest, version = self._fetch_manifest(mailbox)
+        delta_names = self._delta_names(mailbox)
+        if not delta_names:
+            return
+
+        deltas = self._fetch_deltas(mailbox, delta_names)
+
+        names = manifest.get('segments', [])  # type: List[str]
+        bounds = [_entry_key(bound) for bound in manifest.get('bounds', [])]
+        counts = manifest.get('counts', [])  # type: List[int]
+
+        touched = defaultdict(dict)  # type: Dict[int, Dict[IndexKey, Optional[list]]]
+        for key, entry in deltas.items():
+            touched[max(bisect_right(bounds, key) - 1, 0)][key] = entry
+
+        segments = []  # type: List[Tuple[str, IndexKey, int]]
+        retired = []  # type: List[str]
+        stored = []  # type: List[str]
+        for index in range(max(len(names), 1)):
+            if index < len(names) and index not in touched:
+                segments.append((names[index], bounds[index], counts[index]))
+                continue
+
+            entries = []  # type: List[list]
+            if index < len(names):
+                entries = self._fetch_segment(mailbox, names[index])
+                retired.append(names[index])
+
+            for segment in self._split(list(self._merge_entries(entries, touched[index])), partial_first=index == 0):
+                name = _new_name()
+                self._storage.store_object(f'{mailbox}/segments/{name}', {'entries': segment})
+                stored.append(name)
+                segments.append((name, _entry_key(segment[0]), len(segment)))
+
+        is_stored = self._store_manifest(
+            mailbox, {
+                'generation': _new_name(),
+                'segments': [name for name, _, _ in segments],
+                'bounds': [bound for _, bound, _ in segments],
+                'counts': [count for _, _, count in segments],
+                'entries': sum(count for _, _, count in segments),
+                'retired': retired,
+            }, version)
+
+        if not is_stored:
+            self._delete_segments(mailbox, stored)
+            return
+
+        self._delete_segments(mailbox, manifest.get('retired', []))
+        self._delete_deltas(mailbox, delta_names)
+
+        self.log_debug('compacted %d deltas into %d of %d segments for %s', len(delta_names), len(stored),
+                       len(segments), mailbox)
+
+    def _split(self, entries: List[IndexEntry], partial_first: bool) -> Iterator[List[IndexEntry]]:
+        # new emails sort first so the head segment keeps the partial chunk and the full ones behind it stay untouched
+        head = len(entries) % self._segment_size if partial_first else 0
+        if head:
+            yield entries[:head]
+
+        for start in range(head, len(entries), self._segment_size):
+            yield entries[start:start + self._segment_size]
+
+    def _fetch_segment(self, mailbox: str, name: str) -> List[list]:
+        return self._storage.fetch_object(f'{mailbox}/segments/{name}')['entries']
+
+    def _delete_segments(self, mailbox: str, names: Iterable[str]):
+        self._storage.delete_many([f'{mailbox}/segments/{name}' for name in names])
+
+    def _iter_segments(self, mailbox: str, manifest: dict, after: Optional[IndexKey]) -> Iterator[list]:
+        names = manifest.get('segments', [])  # type: List[str]
+        first_segment = 0
+        if after is not None:
+            bounds = [_entry_key(bound) for bound in manifest.get('bounds', [])]
+            first_segment = max(bisect_right(bounds, after) - 1, 0)
+
+        for name in names[first_segment:]:
+            for entry in self._fetch_segment(mailbox, name):
+                if after is None or _entry_key(entry) > after:
+                    yield entry
+
+    def _merge(self,
+               mailbox: str,
+               manifest: dict,
+               deltas: Dict[IndexKey, Optional[list]],
+               after: Optional[IndexKey] = None) -> Iterator[IndexEntry]:
+        return self._merge_entries(self._iter_segments(mailbox, manifest, after), deltas, after)
+
+    @classmethod
+    def _merge_entries(cls,
+                       entries: Iterable[list],
+                       deltas: Dict[IndexKey, Optional[list]],
+                       after: Optional[IndexKey] = None) -> Iterator[IndexEntry]:
+        segment_entries = (entry for entry in entries if _entry_key(entry) not in deltas)
+        delta_entries = sorted(
+            (entry for entry in deltas.values() if entry is not None and (after is None or _entry_key(entry) > after)),
+            key=_entry_key)  # type: List[list]
+
+        for desc_ts, email_id, summary in merge(segment_entries, delta_entries, key=_entry_key):
+            yield desc_ts, email_id, summary
+
+
+class SearchIndex(_DeltaIndex):
+    def __init__(self, storage: VersionedStore, max_deltas: int = 64, num_buckets: int = 32):
+        super().__init__(storage, max_deltas)
+        self._num_buckets = num_buckets
+
+    def add(self, email_address: str, desc_ts: str, email_id: str, summary: dict, terms: Iterable[str]):
+        self._append_delta(self._prefix(email_address), {'add': [[desc_ts, email_id, summary, sorted(terms)]]})
+
+    def add_many(self, email_address: str, entries: Iterable[Tuple[str, str, dict, Iterable[str]]]):
+        self._append_delta(self._prefix(email_address), {
+            'add': [[desc_ts, email_id, summary, sorted(terms)] for desc_ts, email_id, summary, terms in entries],
+        })
+
+    def remove(self, email_address: str, desc_ts: str, email_id: str):
+        self._append_delta(self._prefix(email_address), {'remove': [[desc_ts, email_id]]})
+
+    def search(self,
+               email_address: str,
+               query: Optional[str],
+               offset: int = 0,
+               limit: Optional[int] = None) -> List[IndexEntry]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        prefix = self._prefix(email_address)
+        manifest, _ = self._fetch_manifest(prefix)
+        deltas = self._fetch_deltas(prefix, self._delta_names(prefix))
+        delta_terms = {key: set(entry[3]) for key, entry in deltas.items() if entry is not None}
+
+        matches = None  # type: Optional[Set[IndexKey]]
+        for term in terms:
+            postings = {key for key in self._fetch_postings(prefix, manifest, term) if key not in deltas}
+            postings.update(key for key, entry_terms in delta_terms.items() if term in entry_terms)
+            matches = postings if matches is None else matches & postings
+            if not matches:
+                return []
+
+        keys = sorted(matches or [])
+        keys = keys[offset:offset + limit if limit is not None else None]
+        return self._fetch_entries(prefix, manifest, deltas, keys)
+
+    def compact(self, email_address: str):
+        self._compact(self._prefix(email_address))
+
+    @classmethod
+    def _prefix(cls, email_address: str) -> str:
+        return f'{get_domain(email_address)}/{email_address}/search'
+
+    @classmethod
+    def _bucket(cls, value: str, num_buckets: int) -> int:
+        return crc32(value.encode('utf-8')) % num_buckets
+
+    def _fetch_postings(self, prefix: str, manifest: dict, term: str) -> Iterator[IndexKey]:
+        if not manifest.get('terms'):
+            return
+
+        bucket = self._bucket(term, manifest['buckets'])
+        for key in self._fetch_bucket(prefix, 'terms', manifest['terms'][bucket], bucket).get(term, []):
+            yield _entry_key(key)
+
+    def _fetch_entries(self, prefix: str, manifest: dict, deltas: Dict[IndexKey, Optional[list]],
+                       keys: List[IndexKey]) -> List[IndexEntry]:
+        docs_buckets = {}  # type: Dict[int, dict]
+        entries = []  # type: List[IndexEntry]
+
+        for key in keys:
+            desc_ts, email_id = key
+            delta = deltas.get(key)
+            if delta is not None:
+                entries.append((desc_ts, email_id, delta[2]))
+                continue
+
+            bucket = self._bucket(email_id, manifest['buckets'])
+            if bucket not in docs_buckets:
+                docs_buckets[bucket] = self._fetch_bucket(prefix, 'docs', manifest['docs'][bucket], bucket)
+            entries.append((desc_ts, email_id, docs_buckets[bucket][email_id][1]))
+
+        return entries
+
+    def _fetch_bucket(self, prefix: str, kind: str, generation: Optional[str], bucket: int) -> dict:
+        if not generation:
+            return {}
+
+        return self._storage.fetch_object(f'{prefix}/{kind}/{generation}/{bucket}')[kind]
+
+    def _compact(self, prefix: str):
+        manifest, version = self._fetch_manifest(prefix)
+        delta_names = self._delta_names(prefix)
+        if not delta_names:
+            return
+
+        deltas = self._fetch_deltas(prefix, delta_names)
+        num_buckets = manifest.get('buckets') or self._num_buckets
+        generations = {
+            'terms': list(manifest.get('terms') or [None] * num_buckets),
+            'docs': list(manifest.get('docs') or [None] * num_buckets),
+        }  # type: Dict[str, List[Optional[str]]]
+        generation = _new_name()
+
+        added_postings = defaultdict(lambda: defaultdict(list))  # type: Dict[int, Dict[str, list]]
+        added_docs = defaultdict(dict)  # type: Dict[int, Dict[str, list]]
+        for key, entry in deltas.items():
+            if entry is None:
+                continue
+
+            desc_ts, email_id, summary, terms = entry
+            added_docs[self._bucket(email_id, num_buckets)][email_id] = [desc_ts, summary, terms]
+            for term in terms:
+                added_postings[self._bucket(term, num_buckets)][term].append([desc_ts, email_id])
+
+        removed_ids = {email_id for _, email_id in deltas}
+        docs_buckets = {self._bucket(email_id, num_buckets) for email_id in removed_ids}
+        old_docs = {
+            bucket: self._fetch_bucket(prefix, 'docs', generations['docs'][bucket], bucket)
+            for bucket in docs_buckets
+        }  # type: Dict[int, Dict[str, list]]
+
+        terms_buckets = set(added_postings)
+        for email_id in removed_ids:
+            old_doc = old_docs[self._bucket(email_id, num_buckets)].get(email_id)
+            if old_doc is not None:
+                terms_buckets.update(self._bucket(term, num_buckets) for term in old_doc[2])
+
+        stored = []  # type: List[str]
+        retired = []  # type: List[str]
+        num_docs = manifest.get('entries', 0)
+
+        def store_bucket(kind: str, bucket: int, content: dict):
+            name = f'{kind}/{generation}/{bucket}'
+            self._storage.store_object(f'{prefix}/{name}', {kind: content})
+            stored.append(name)
+            if generations[kind][bucket]:
+                retired.append(f'{kind}/{generations[kind][bucket]}/{bucket}')
+            generations[kind][bucket] = generation
+
+        for bucket in sorted(docs_buckets):
+            docs = {email_id: doc for email_id, doc in old_docs[bucket].items() if email_id not in removed_ids}
+            docs.update(added_docs[bucket])
+            num_docs += len(docs) - len(old_docs[bucket])
+            store_bucket('docs', bucket, docs)
+
+        for bucket in sorted(terms_buckets):
+            postings = self._fetch_bucket(prefix, 'terms', generations['terms'][bucket], bucket)
+            postings = {term: [key for key in keys if _entry_key(key) not in deltas] for term, keys in postings.items()}
+            for term, keys in added_postings[bucket].items():
+                postings.setdefault(term, []).extend(keys)
+            store_bucket('terms', bucket, {term: sorted(keys) for term, keys in postings.items() if keys})
+
+        is_stored = self._store_manifest(
+            prefix, {
+                'generation': generation,
+                'buckets': num_buckets,
+                'terms': generations['terms'],
+                'docs': generations['docs'],
+                'entries': num_docs,
+                'retired': retired,
+            }, version)
+
+        if not is_stored:
+            self._delete_objects(prefix, stored)
+            return
+
+        self._delete_objects(prefix, manifest.get('retired', []))
+        self._delete_deltas(prefix, delta_names)
+
+        self.log_debug('compacted %d deltas into %d of %d buckets for %s', len(delta_names), len(stored),
+                       2 * num_buckets, prefix)
+
+    def _delete_objects(self, prefix: str, names: Iterable[str]):
+        self._storage.delete_many([f'{prefix}/{name}' for name in names])
@@ -0,0 +1,604 @@
+from email.utils import formatdate
+from hashlib import sha256
+from hmac import new as hmac_new
+from os import getpid
+from re import MULTILINE
+from re import compile as re_compile
+from sqlite3 import Connection
+from sqlite3 import connect
+from threading import local
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from urllib.parse import quote
+from urllib.parse import unquote
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from cached_property import cached_property
+from libcloud.common.types import LibcloudError
+from libcloud.storage.types import ObjectDoesNotExistError
+from requests import Response
+from requests import Session
+from typing_extensions import Protocol
+
+from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.serialization import from_base64
+from opwen_email_server.utils.serialization import from_msgpack_bytes
+from opwen_email_server.utils.serialization import to_base64
+from opwen_email_server.utils.serialization import to_json
+from opwen_email_server.utils.serialization import to_msgpack_bytes
+
+_TABLE_NAME_INVALID = re_compile('[^A-Za-z0-9]')
+
+_BATCH_RESPONSE_STATUS = re_compile(r'^HTTP/1\.1 (\d{3})', MULTILINE)
+
+_UNSAFE_KEY_CHARACTERS = frozenset('/\\#?%')
+
+
+def _prefix_end(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _escape_key(key: str) -> str:
+    return ''.join(f'%{ord(c):02X}' if c in _UNSAFE_KEY_CHARACTERS or ord(c) < 0x20 or 0x7f <= ord(c) <= 0x9f else c
+                   for c in key)
+
+
+def _odata_string(value: str) -> str:
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
+
+
+class KeyStore(Protocol):
+    def ensure_exists(self) -> None:
+        ...
+
+    def exists(self, resource_id: str) -> bool:
+        ...
+
+    def delete(self, resource_id: str) -> None:
+        ...
+
+    def delete_many(self, resource_ids: Iterable[str]) -> int:
+        ...
+
+    def delete_prefix(self, prefix: str) -> int:
+        ...
+
+    def count(self, prefix: Optional[str] = None) -> int:
+        ...
+
+    def iter(self, prefix: Optional[str] = None) -> Iterator[str]:
+        ...
+
+
+class MarkerStore(KeyStore, Protocol):
+    def mark(self, resource_id: str) -> None:
+        ...
+
+
+class IndexStore(KeyStore, Protocol):
+    def fetch_object(self, resource_id: str) -> dict:
+        ...
+
+    def store_object(self, resource_id: str, obj: dict) -> None:
+        ...
+
+    def store_many(self, objs: Iterable[Tuple[str, dict]]) -> None:
+        ...
+
+
+class VersionedStore(IndexStore, Protocol):
+    def fetch_versioned_object(self, resource_id: str) -> Tuple[dict, str]:
+        ...
+
+    def store_versioned_object(self, resource_id: str, obj: dict, version: Optional[str]) -> bool:
+        ...
+
+
+class SqliteIndexStore(LogMixin):
+    _encoding = 'utf-8'
+
+    def __init__(self, path: str, table: str, case_sensitive: bool = True, timeout_seconds: float = 30) -> None:
+        if '"' in table:
+            raise ValueError(f'Invalid table name: {table}')
+
+        self._path = path
+        self._table = table
+        self._case_sensitive = case_sensitive
+        self._timeout_seconds = timeout_seconds
+        self._local = local()
+
+    @property
+    def _connection(self) -> Connection:
+        pid = getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = connect(self._path, timeout=self._timeout_seconds)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                connection.execute(f'CREATE TABLE IF NOT EXISTS "{self._table}" '
+                                   '(key TEXT PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID')
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def ensure_exists(self):
+        # noinspection PyStatementEffect
+        self._connection
+
+    def mark(self, resource_id: str):
+        self._store_many([(resource_id, b'')])
+
+    def store_text(self, resource_id: str, text: str):
+        self._store_many([(resource_id, text.encode(self._encoding))])
+
+    def fetch_text(self, resource_id: str) -> str:
+        return self._fetch(resource_id).decode(self._encoding)
+
+    def store_object(self, resource_id: str, obj: dict):
+        self._store_many([(resource_id, to_msgpack_bytes(obj))])
+
+    def store_many(self, objs: Iterable[Tuple[str, dict]]):
+        self._store_many((resource_id, to_msgpack_bytes(obj)) for resource_id, obj in objs)
+
+    def fetch_object(self, resource_id: str) -> dict:
+        return from_msgpack_bytes(self._fetch(resource_id))
+
+    def fetch_versioned_object(self, resource_id: str) -> Tuple[dict, str]:
+        value = self._fetch(resource_id)
+        return from_msgpack_bytes(value), self._version(value)
+
+    def store_versioned_object(self, resource_id: str, obj: dict, version: Optional[str]) -> bool:
+        key = self._key(resource_id)
+        with self._connection as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(f'SELECT value FROM "{self._table}" WHERE key = ?', (key, )).fetchone()
+            current = self._version(row[0]) if row is not None else None
+            if current != version:
+                self.log_debug('version of %s changed from %s to %s', key, version, current)
+                return False
+
+            connection.execute(f'INSERT OR REPLACE INTO "{self._table}" (key, value) VALUES (?, ?)',
+                               (key, to_msgpack_bytes(obj)))
+
+        return True
+
+    def exists(self, resource_id: str) -> bool:
+        cursor = self._connection.execute(f'SELECT 1 FROM "{self._table}" WHERE key = ?', (self._key(resource_id), ))
+        return cursor.fetchone() is not None
+
+    def delete(self, resource_id: str):
+        key = self._key(resource_id)
+        with self._connection as connection:
+            cursor = connection.execute(f'DELETE FROM "{self._table}" WHERE key = ?', (key, ))
+
+        if cursor.rowcount:
+            self.log_debug('deleted %s', key)
+        else:
+            self.log_warning('deleted missing %s', key)
+
+    def delete_many(self, resource_ids: Iterable[str]) -> int:
+        keys = [(self._key(resource_id), ) for resource_id in resource_ids]
+        if not keys:
+            return 0
+
+        with self._connection as connection:
+            cursor = connection.executemany(f'DELETE FROM "{self._table}" WHERE key = ?', keys)
+
+        self.log_debug('deleted %d keys from %s', cursor.rowcount, self._table)
+        return cursor.rowcount
+
+    def delete_prefix(self, prefix: str) -> int:
+        where, params = self._where(prefix)
+        with self._connection as connection:
+            cursor = connection.execute(f'DELETE FROM "{self._table}"{where}', params)
+
+        self.log_debug('deleted %d keys under %s from %s', cursor.rowcount, prefix, self._table)
+        return cursor.rowcount
+
+    def count(self, prefix: Optional[str] = None) -> int:
+        where, params = self._where(prefix)
+        cursor = self._connection.execute(f'SELECT COUNT(*) FROM "{self._table}"{where}', params)
+        return cursor.fetchone()[0]
+
+    def iter(self, prefix: Optional[str] = None) -> Iterator[str]:
+        for key in self._scan(prefix):
+            resource_id = self._to_resource_id(key, prefix)
+            yield resource_id
+            self.log_debug('listed %s', resource_id)
+
+    def _fetch(self, resource_id: str) -> bytes:
+        key = self._key(resource_id)
+        cursor = self._connection.execute(f'SELECT value FROM "{self._table}" WHERE key = ?', (key, ))
+        row = cursor.fetchone()
+        if row is None:
+            raise ObjectDoesNotExistError(f'Key {key} does not exist', None, key)
+
+        self.log_debug('fetched %d bytes from %s', len(row[0]), key)
+        return row[0]
+
+    def _store_many(self, values: Iterable[Tuple[str, bytes]]):
+        rows = [(self._key(resource_id), value) for resource_id, value in values]
+        if not rows:
+            return
+
+        with self._connection as connection:
+            connection.executemany(f'INSERT OR REPLACE INTO "{self._table}" (key, value) VALUES (?, ?)', rows)
+
+        self.log_debug('stored %d keys in %s', len(rows), self._table)
+
+    def _scan(self, prefix: Optional[str]) -> List[str]:
+        where, params = self._where(prefix)
+        query = f'SELECT key FROM "{self._table}"{where} ORDER BY key'
+        return [key for key, in self._connection.execute(query, params)]
+
+    def _where(self, prefix: Optional[str]) -> Tuple[str, list]:
+        clauses = []
+        params = []
+
+        if prefix:
+            prefix = self._key(prefix)
+            clauses.extend(['key >= ?', 'key < ?'])
+            params.extend([prefix, _prefix_end(prefix)])
+
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        return where, params
+
+    def _key(self, resource_id: str) -> str:
+        return resource_id if self._case_sensitive else resource_id.lower()
+
+    @classmethod
+    def _version(cls, value: bytes) -> str:
+        return sha256(value).hexdigest()
+
+    def _to_resource_id(self, key: str, prefix: Optional[str]) -> str:
+        return key[len(prefix):] if prefix else key
+
+
+class AzureTableIndexStore(LogMixin):
+    _encoding = 'utf-8'
+    _api_version = '2019-02-02'
+    _max_batch_operations = 100
+    _max_batch_bytes = 3 * 1024 * 1024
+    _max_property_bytes = 64 * 1024
+    _max_page_size = 1000
+
+    def __init__(self,
+                 account: str,
+                 key: str,
+                 table: str,
+                 host: Optional[str] = None,
+                 secure: bool = True,
+                 case_sensitive: bool = True,
+                 timeout_seconds: float = 30) -> None:
+        self._account = account
+        self._key = key
+        self._table = _TABLE_NAME_INVALID.sub('', table)
+        self._host = host or None
+        self._secure = secure
+        self._case_sensitive = case_sensitive
+        self._timeout_seconds = timeout_seconds
+
+    @cached_property
+    def _session(self) -> Session:
+        return Session()
+
+    @cached_property
+    def _base_url(self) -> str:
+        scheme = 'https' if self._secure else 'http'
+        if self._host:
+            return f'{scheme}://{self._host}/{self._account}'
+        return f'{scheme}://{self._account}.table.core.windows.net'
+
+    @cached_property
+    def _table_path(self) -> str:
+        response = self._request('POST',
+                                 '/Tables',
+                                 body=to_json({'TableName': self._table}),
+                                 headers={
+                                     'Content-Type': 'application/json',
+                                     'Prefer': 'return-no-content',
+                                 })
+        if response.status_code != 409:
+            self._raise_for_status(response)
+        return f'/{self._table}'
+
+    def ensure_exists(self):
+        # noinspection PyStatementEffect
+        self._table_path
+
+    def mark(self, resource_id: str):
+        self._store(resource_id, b'')
+
+    def store_text(self, resource_id: str, text: str):
+        self._store(resource_id, text.encode(self._encoding))
+
+    def fetch_text(self, resource_id: str) -> str:
+        return self._fetch(resource_id).decode(self._encoding)
+
+    def store_object(self, resource_id: str, obj: dict):
+        self._store(resource_id, to_msgpack_bytes(obj))
+
+    def fetch_object(self, resource_id: str) -> dict:
+        return from_msgpack_bytes(self._fetch(resource_id))
+
+    def fetch_versioned_object(self, resource_id: str) -> Tuple[dict, str]:
+        value, etag = self._fetch_entity(resource_id)
+        return from_msgpack_bytes(value), etag
+
+    def store_versioned_object(self, resource_id: str, obj: dict, version: Optional[str]) -> bool:
+        body = to_json(self._entity(resource_id, to_msgpack_bytes(obj)))
+        if version is None:
+            response = self._request('POST',
+                                     self._table_path,
+                                     body=body,
+                                     headers={
+                                         'Content-Type': 'application/json',
+                                         'Prefer': 'return-no-content',
+                                     })
+        else:
+            response = self._request('PUT',
+                                     self._entity_path(resource_id),
+                                     body=body,
+                                     headers={
+                                         'Content-Type': 'application/json',
+                                         'If-Match': version,
+                                     })
+
+        if response.status_code in (404, 409, 412):
+            self.log_debug('version of %s changed from %s', resource_id, version)
+            return False
+
+        self._raise_for_status(response)
+        return True
+
+    def store_many(self, objs: Iterable[Tuple[str, dict]]):
+        operations = [('PUT', resource_id, self._entity(resource_id, to_msgpack_bytes(obj)))
+                      for resource_id, obj in objs]
+
+        for batch in self._batches(operations):
+            if not self._batch(batch):
+                raise LibcloudError(f'Unable to store batch of {len(batch)} entities in {self._table}')
+
+        self.log_debug('stored %d keys in %s', len(operations), self._table)
+
+    def exists(self, resource_id: str) -> bool:
+        response = self._request('GET', self._entity_path(resource_id), params={'$select': 'RowKey'})
+        if response.status_code == 404:
+            return False
+        self._raise_for_status(response)
+        return True
+
+    def delete(self, resource_id: str):
+        if not self._delete(resource_id):
+            self.log_warning('deleted missing %s', resource_id)
+
+    def delete_many(self, resource_ids: Iterable[str]) -> int:
+        operations = [('DELETE', resource_id, None) for resource_id in resource_ids]
+
+        num_deleted = 0
+        for batch in self._batches(operations):
+            if self._batch(batch):
+                num_deleted += len(batch)
+            else:
+                # a missing entity fails the whole changeset so find out which ones existed one by one
+                num_deleted += sum(self._delete(resource_id) for _, resource_id, _ in batch)
+
+        self.log_debug('deleted %d keys from %s', num_deleted, self._table)
+        return num_deleted
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self.delete_many([f'{prefix}{resource_id}' for resource_id in self.iter(prefix)])
+
+    def count(self, prefix: Optional[str] = None) -> int:
+        return sum(1 for _ in self._query(prefix))
+
+    def iter(self, prefix: Optional[str] = None) -> Iterator[str]:
+        for key in self._query(prefix):
+            resource_id = self._to_resource_id(key, prefix)
+            yield resource_id
+            self.log_debug('listed %s', resource_id)
+
+    def _delete(self, resource_id: str) -> bool:
+        response = self._request('DELETE', self._entity_path(resource_id), headers={'If-Match': '*'})
+        if response.status_code == 404:
+            return False
+        self._raise_for_status(response)
+        self.log_debug('deleted %s', resource_id)
+        return True
+
+    def _store(self, resource_id: str, value: bytes):
+        response = self._request('PUT',
+                                 self._entity_path(resource_id),
+                                 body=to_json(self._entity(resource_id, value)),
+                                 headers={'Content-Type': 'application/json'})
+        self._raise_for_status(response)
+        self.log_debug('stored %d bytes at %s', len(value), resource_id)
+
+    def _fetch(self, resource_id: str) -> bytes:
+        value, _ = self._fetch_entity(resource_id)
+        return value
+
+    def _fetch_entity(self, resource_id: str) -> Tuple[bytes, str]:
+        response = self._request('GET', self._entity_path(resource_id))
+        if response.status_code == 404:
+            raise ObjectDoesNotExistError(f'Key {resource_id} does not exist', None, resource_id)
+        self._raise_for_status(response)
+
+        entity = response.json()
+        chunks = []  # type: List[bytes]
+        while f'Value{len(chunks)}' in entity:
+            chunks.append(from_base64(entity[f'Value{len(chunks)}']))
+
+        value = b''.join(chunks)
+        self.log_debug('fetched %d bytes from %s', len(value), resource_id)
+        return value, response.headers.get('ETag', '')
+
+    def _query(self, prefix: Optional[str]) -> Iterator[str]:
+        params = {'$select': 'PartitionKey,RowKey', '$top': str(self._max_page_size)}
+
+        filters = self._filters(prefix)
+        if filters:
+            params['$filter'] = ' and '.join(filters)
+
+        while True:
+            response = self._request('GET', f'{self._table_path}()', params=params)
+            self._raise_for_status(response)
+
+            for entity in response.json()['value']:
+                yield self._join_key(entity['PartitionKey'], entity['RowKey'])
+
+            next_partition_key = response.headers.get('x-ms-continuation-NextPartitionKey')
+            if not next_partition_key:
+                break
+
+            params['NextPartitionKey'] = next_partition_key
+            params['NextRowKey'] = response.headers.get('x-ms-continuation-NextRowKey', '')
+
+    def _filters(self, prefix: Optional[str]) -> List[str]:
+        filters = []
+
+        if prefix:
+            partition_key, row_key = self._split_key(prefix)
+            if row_key is None:
+                filters.append(f'PartitionKey ge {_odata_string(partition_key)}')
+                filters.append(f'PartitionKey lt {_odata_string(_prefix_end(partition_key))}')
+            else:
+                filters.append(f'PartitionKey eq {_odata_string(partition_key)}')
+                if row_key:
+                    filters.append(f'RowKey ge {_odata_string(row_key)}')
+                    filters.append(f'RowKey lt {_odata_string(_prefix_end(row_key))}')
+
+        return filters
+
+    def _batches(self, operations: Sequence[Tuple[str, str, Optional[dict]]]) -> Iterator[list]:
+        partitions = {}  # type: Dict[str, list]
+        for operation in operations:
+            partition_key, _ = self._split_key(operation[1])
+            partitions.setdefault(partition_key, []).append(operation)
+
+        for partition in partitions.values():
+            batch = []  # type: list
+            batch_bytes = 0
+            for operation in partition:
+                operation_bytes = len(to_json(operation[2])) if operation[2] is not None else 0
+                if batch and (len(batch) >= self._max_batch_operations
+                              or batch_bytes + operation_bytes > self._max_batch_bytes):
+                    yield batch
+                    batch = []
+                    batch_bytes = 0
+                batch.append(operation)
+                batch_bytes += operation_bytes
+            if batch:
+                yield batch
+
+    def _batch(self, operations: List[Tuple[str, str, Optional[dict]]]) -> bool:
+        batch_boundary = f'batch_{uuid4()}'
+        changeset_boundary = f'changeset_{uuid4()}'
+
+        lines = [
+            f'--{batch_boundary}',
+            f'Content-Type: multipart/mixed; boundary={changeset_boundary}',
+            '',
+        ]
+        for method, resource_id, entity in operations:
+            lines.extend([
+                f'--{changeset_boundary}',
+                'Content-Type: application/http',
+                'Content-Transfer-Encoding: binary',
+                '',
+                f'{method} {self._base_url}{self._entity_path(resource_id)} HTTP/1.1',
+                'Accept: application/json;odata=nometadata',
+                'DataServiceVersion: 3.0;',
+            ])
+            if entity is None:
+                lines.extend(['If-Match: *', '', ''])
+            else:
+                lines.extend(['Content-Type: application/json', '', to_json(entity)])
+        lines.extend([
+            f'--{changeset_boundary}--',
+            f'--{batch_boundary}--',
+            '',
+        ])
+
+        response = self._request('POST',
+                                 '/$batch',
+                                 body='\r\n'.join(lines),
+                                 headers={'Content-Type': f'multipart/mixed; boundary={batch_boundary}'})
+        self._raise_for_status(response)
+
+        statuses = [int(status) for status in _BATCH_RESPONSE_STATUS.findall(response.text)]
+        self.log_debug('sent batch of %d operations to %s', len(operations), self._table)
+        return all(status < 400 for status in statuses)
+
+    def _request(self,
+                 method: str,
+                 path: str,
+                 params: Optional[dict] = None,
+                 body: Optional[str] = None,
+                 headers: Optional[dict] = None) -> Response:
+        url = f'{self._base_url}{path}'
+        date = formatdate(usegmt=True)
+
+        string_to_sign = f'{date}\n/{self._account}{urlparse(url).path}'
+        signature = hmac_new(from_base64(self._key), string_to_sign.encode(self._encoding), sha256).digest()
+
+        request_headers = {
+            'Accept': 'application/json;odata=nometadata',
+            'Authorization': f'SharedKeyLite {self._account}:{to_base64(signature)}',
+            'DataServiceVersion': '3.0;NetFx',
+            'MaxDataServiceVersion': '3.0;NetFx',
+            'x-ms-date': date,
+            'x-ms-version': self._api_version,
+        }
+        request_headers.update(headers or {})
+
+        data = body.encode(self._encoding) if body is not None else None
+        return self._session.request(method,
+                                     url,
+                                     params=params,
+                                     data=data,
+                                     headers=request_headers,
+                                     timeout=self._timeout_seconds)
+
+    def _raise_for_status(self, response: Response):
+        if response.status_code >= 400:
+            raise LibcloudError(f'Unexpected status code {response.status_code} from {self._table}: {response.text}')
+
+    def _entity(self, resource_id: str, value: bytes) -> dict:
+        partition_key, row_key = self._split_key(resource_id)
+        entity = {'PartitionKey': partition_key, 'RowKey': row_key or ''}
+        for i, start in enumerate(range(0, len(value), self._max_property_bytes)):
+            entity[f'Value{i}'] = to_base64(value[start:start + self._max_property_bytes])
+            entity[f'Value{i}@odata.type'] = 'Edm.Binary'
+        return entity
+
+    def _entity_path(self, resource_id: str) -> str:
+        partition_key, row_key = self._split_key(resource_id)
+        partition_key = quote(_odata_string(partition_key), safe='')
+        row_key = quote(_odata_string(row_key or ''), safe='')
+        return f'{self._table_path}(PartitionKey={partition_key},RowKey={row_key})'
+
+    def _split_key(self, resource_id: str) -> Tuple[str, Optional[str]]:
+        if not self._case_sensitive:
+            resource_id = resource_id.lower()
+
+        partition_key, separator, row_key = resource_id.partition('/')
+        if not separator:
+            return _escape_key(partition_key), None
+        return _escape_key(partition_key), _escape_key(row_key)
+
+    @classmethod
+    def _join_key(cls, partition_key: str, row_key: str) -> str:
+        if not row_key:
+            return unquote(partition_key)
+        return f'{unquote(partition_key)}/{unquote(row_key)}'
+
+    def _to_resource_id(self, key: str, prefix: Optional[str]) -> str:
+        return key[len(prefix):] if prefix else key
@@ -0,0 +1,31 @@
+from typing import Dict
+
+from libcloud.storage.types import ObjectDoesNotExistError
+
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.utils.log import LogMixin
+
+
+class ContentManifests(LogMixin):
+    def __init__(self, storage: IndexStore):
+        self._storage = storage
+
+    def get(self, domain: str, name: str) -> Dict[str, str]:
+        try:
+            return self._storage.fetch_object(self._path(domain, name))['hashes']
+        except ObjectDoesNotExistError:
+            return {}
+
+    def store(self, domain: str, name: str, hashes: Dict[str, str]):
+        self._storage.store_object(self._path(domain, name), {'hashes': hashes})
+        self.log_debug('stored %s manifest with %d entries for %s', name, len(hashes), domain)
+
+    def delete(self, domain: str, name: str):
+        self._storage.delete(self._path(domain, name))
+
+    def delete_domain(self, domain: str) -> int:
+        return self._storage.delete_prefix(f'{domain}/')
+
+    @classmethod
+    def _path(cls, domain: str, name: str) -> str:
+        return f'{domain}/{name}'
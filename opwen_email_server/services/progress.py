@@ -0,0 +1,100 @@
+from time import time
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+from libcloud.storage.types import ObjectDoesNotExistError
+
+from opwen_email_server.constants import jobs
+from opwen_email_server.services.index_store import IndexStore
+from opwen_email_server.utils.log import LogMixin
+
+
+class ProgressStore(LogMixin):
+    def __init__(self, storage: IndexStore, stale_after_seconds: float = 3600):
+        self._storage = storage
+        self._stale_after_seconds = stale_after_seconds
+
+    def get(self, job_id: str) -> Optional[dict]:
+        try:
+            job = self._storage.fetch_object(job_id)
+        except ObjectDoesNotExistError:
+            return None
+
+        steps = {}
+        for step in self._storage.iter(f'{job_id}/'):
+            steps[step] = self._storage.fetch_object(f'{job_id}/{step}')
+
+        job['steps'] = steps
+        return job
+
+    def is_active(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job['state'] not in (jobs.QUEUED, jobs.RUNNING):
+            return False
+
+        updated_at = max([job['updated_at']] + [step['updated_at'] for step in job['steps'].values()])
+        return time() - updated_at < self._stale_after_seconds
+
+    def start(self, job_id: str, owner: str):
+        self._storage.delete_prefix(f'{job_id}/')
+        self._storage.store_object(job_id, {'state': jobs.QUEUED, 'owner': owner, 'updated_at': time()})
+        self.log_debug('queued job %s', job_id)
+
+    def set_state(self, job_id: str, state: str):
+        try:
+            job = self._storage.fetch_object(job_id)
+        except ObjectDoesNotExistError:
+            job = {'owner': None}
+
+        job.update({'state': state, 'updated_at': time()})
+        self._storage.store_object(job_id, job)
+        self.log_debug('job %s is %s', job_id, state)
+
+    def set_step(self, job_id: str, step: str, state: str, num_deleted: int = 0):
+        self._storage.store_object(f'{job_id}/{step}', {'state': state, 'deleted': num_deleted, 'updated_at': time()})
+
+
+class Checkpoint:
+    def __init__(self, offset: int = 0, dispatched: Iterable[str] = ()):
+        self.offset = offset
+        self._dispatched = set(dispatched)
+        self._completed = {}  # type: Dict[int, Optional[str]]
+
+    def is_done(self, line: int, item_id: Optional[str] = None) -> bool:
+        return line < self.offset or item_id in self._dispatched
+
+    def complete(self, line: int, item_id: Optional[str] = None):
+        self._completed[line] = item_id
+        if item_id is not None:
+            self._dispatched.add(item_id)
+
+        while self.offset in self._completed:
+            completed_id = self._completed.pop(self.offset)
+            if completed_id is not None:
+                self._dispatched.discard(completed_id)
+            self.offset += 1
+
+    def to_dict(self) -> dict:
+        return {'offset': self.offset, 'dispatched': sorted(self._dispatched)}
+
+
+class CheckpointStore(LogMixin):
+    def __init__(self, storage: IndexStore):
+        self._storage = storage
+
+    def get(self, job_id: str) -> Checkpoint:
+        try:
+            checkpoint = self._storage.fetch_object(job_id)
+        except ObjectDoesNotExistError:
+            return Checkpoint()
+
+        self.log_debug('resuming job %s from line %d', job_id, checkpoint['offset'])
+        return Checkpoint(checkpoint['offset'], checkpoint['dispatched'])
+
+    def store(self, job_id: str, checkpoint: Checkpoint):
+        self._storage.store_object(job_id, checkpoint.to_dict())
+        self.log_debug('checkpointed job %s at line %d', job_id, checkpoint.offset)
+
+    def delete(self, job_id: str):
+        self._storage.delete(job_id)
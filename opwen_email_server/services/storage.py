@@ -1,23 +1,41 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from gzip import GzipFile
+from hashlib import sha256
 from io import BytesIO
+from os import makedirs
+from os.path import dirname
+from os.path import exists
+from os.path import join
 from tarfile import TarFile
 from tempfile import NamedTemporaryFile
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from threading import local
 from typing import IO
 from typing import Callable
 from typing import Iterable
 from typing import Iterator
+from typing import List
 from typing import Optional
 from typing import Tuple
+from typing import TypeVar
+from typing import cast
 
 from cached_property import cached_property
+from libcloud.common.types import LibcloudError
 from libcloud.storage.base import Container
 from libcloud.storage.base import Object
 from libcloud.storage.base import StorageDriver
+from libcloud.storage.drivers.azure_blobs import AzureBlobsStorageDriver
+from libcloud.storage.drivers.local import LocalStorageDriver
+from libcloud.storage.drivers.local import LockLocalStorage
 from libcloud.storage.providers import get_driver
 from libcloud.storage.types import ContainerAlreadyExistsError
 from libcloud.storage.types import ContainerDoesNotExistError
 from libcloud.storage.types import ObjectDoesNotExistError
 from libcloud.storage.types import Provider
+from lockfile import LockFailed
 from xtarfile import open as tarfile_open
 from xtarfile.xtarfile import SUPPORTED_FORMATS
 
@@ -25,14 +43,27 @@ from opwen_email_server.utils.log import LogMixin
 from opwen_email_server.utils.serialization import from_msgpack_bytes
 from opwen_email_server.utils.serialization import gunzip_bytes
 from opwen_email_server.utils.serialization import gzip_bytes
+from opwen_email_server.utils.serialization import msgpack_map_header
 from opwen_email_server.utils.serialization import to_msgpack_bytes
+from opwen_email_server.utils.serialization import write_msgpack
+from opwen_email_server.utils.serialization import write_msgpack_entries
 from opwen_email_server.utils.temporary import create_tempfilename
 from opwen_email_server.utils.temporary import removing
 
 AccessInfo = namedtuple('AccessInfo', ['account', 'key', 'container'])
 
+StoredObject = namedtuple('StoredObject', ['resource_id', 'num_bytes'])
+
+_T = TypeVar('_T')
+
 Upload = Tuple[str, Iterable[dict], Callable[[dict], bytes]]
-Download = Tuple[str, Callable[[bytes], dict]]
+Download = Tuple[str, Callable[[bytes], Optional[_T]]]
+
+_local_versions_lock = Lock()
+
+
+def _version_of(obj: Object) -> str:
+    return (obj.extra or {}).get('etag') or obj.hash
 
 
 class _Container:
@@ -51,6 +82,55 @@ class _Container:
     def upload_object_via_stream(self, iterator: Iterator[bytes], object_name: str) -> Object:
         return self._wrapped.upload_object_via_stream(iterator, object_name)
 
+    def upload_versioned_object_via_stream(self, iterator: Iterator[bytes], object_name: str,
+                                           version: Optional[str]) -> bool:
+        if not isinstance(self._wrapped.driver, AzureBlobsStorageDriver):
+            # the local driver has no conditional writes so emulate them with its file lock
+            path = self._local_path(object_name)
+            makedirs(dirname(path), exist_ok=True)
+            with _local_versions_lock, LockLocalStorage(f'{path}.version'):
+                if self._version(object_name) != version:
+                    return False
+                self._wrapped.upload_object_via_stream(iterator, object_name)
+                return True
+
+        headers = {'If-Match': version} if version is not None else {'If-None-Match': '*'}
+        try:
+            self._wrapped.upload_object_via_stream(iterator, object_name, headers=headers)
+        except LibcloudError:
+            if self._version(object_name) != version:
+                return False
+            raise
+
+        return True
+
+    def _version(self, object_name: str) -> Optional[str]:
+        try:
+            return _version_of(self.get_object(object_name))
+        except ObjectDoesNotExistError:
+            return None
+
+    def _local_path(self, object_name: str) -> str:
+        driver = cast(LocalStorageDriver, self._wrapped.driver)
+        return join(driver.base_path, self._wrapped.name, object_name)
+
+    def delete_object(self, object_name: str) -> bool:
+        driver = self._wrapped.driver
+        obj = Object(object_name, 0, '', {}, {}, self._wrapped, driver)
+
+        try:
+            return driver.delete_object(obj)
+        except ObjectDoesNotExistError:
+            return False
+        except LockFailed:
+            # the local driver can't lock a file whose folder is missing, e.g. pruned by a concurrent delete
+            if exists(self._local_path(object_name)):
+                raise
+            return False
+        except FileNotFoundError:
+            # the local driver prunes empty folders which may race with a concurrent delete
+            return True
+
 
 class _CaseInsensitiveContainer(_Container):
     def get_object(self, object_name: str) -> Object:
@@ -69,8 +149,19 @@ class _CaseInsensitiveContainer(_Container):
         object_name = object_name.lower()
         return super().upload_object_via_stream(iterator, object_name)
 
+    def upload_versioned_object_via_stream(self, iterator: Iterator[bytes], object_name: str,
+                                           version: Optional[str]) -> bool:
+        object_name = object_name.lower()
+        return super().upload_versioned_object_via_stream(iterator, object_name, version)
+
+    def delete_object(self, object_name: str) -> bool:
+        object_name = object_name.lower()
+        return super().delete_object(object_name)
+
 
 class _BaseAzureStorage(LogMixin):
+    _max_delete_workers = 8
+
     def __init__(self,
                  account: str,
                  key: str,
@@ -86,22 +177,36 @@ class _BaseAzureStorage(LogMixin):
         self._host = host or None
         self._secure = secure
         self._case_sensitive = case_sensitive
+        self._local = local()
 
-    @cached_property
+    @property
     def _driver(self) -> StorageDriver:
-        driver = get_driver(self._provider)
-        return driver(self._account, self._key, host=self._host, secure=self._secure)
+        driver = getattr(self._local, 'driver', None)
+        if driver is None:
+            driver = get_driver(self._provider)(self._account, self._key, host=self._host, secure=self._secure)
+            self._local.driver = driver
+        return driver
 
     @cached_property
-    def _client(self) -> _Container:
+    def _resolved_container(self) -> Container:
         try:
-            container = self._driver.get_container(self._container)
+            return self._driver.get_container(self._container)
         except ContainerDoesNotExistError:
             try:
-                container = self._driver.create_container(self._container)
+                return self._driver.create_container(self._container)
             except ContainerAlreadyExistsError:
-                container = self._driver.get_container(self._container)
-        return _Container(container) if self._case_sensitive else _CaseInsensitiveContainer(container)
+                return self._driver.get_container(self._container)
+
+    @property
+    def _client(self) -> _Container:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            container = self._resolved_container
+            if container.driver is not self._driver:
+                container = Container(container.name, container.extra, self._driver)
+            client = _Container(container) if self._case_sensitive else _CaseInsensitiveContainer(container)
+            self._local.client = client
+        return client
 
     @property
     def _generated_suffix(self) -> str:
@@ -127,20 +232,47 @@ class _BaseAzureStorage(LogMixin):
             resource.delete()
             self.log_debug('deleted %s', resource_id)
 
+    def delete_many(self, resource_ids: Iterable[str]) -> int:
+        return self._delete_objects([self._to_filename(resource_id) for resource_id in resource_ids])
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self._delete_objects([resource.name for resource in self._client.iterate_objects(prefix=prefix)])
+
     def iter(self, prefix: Optional[str] = None) -> Iterator[str]:
-        resources = self._client.iterate_objects(prefix=prefix)
+        for resource in self._client.iterate_objects(prefix=prefix):
+            resource_id = self._to_resource_id(resource.name, prefix)
+            yield resource_id
+            self.log_debug('listed %s', resource_id)
 
-        for resource in resources:
-            resource_id = resource.name
+    def count(self, prefix: Optional[str] = None) -> int:
+        return sum(1 for _ in self._client.iterate_objects(prefix=prefix))
 
-            if prefix is not None:
-                resource_id = resource_id[len(prefix):]
+    def _delete_objects(self, names: List[str]) -> int:
+        if not names:
+            return 0
 
-            if resource_id.endswith(self._generated_suffix):
-                resource_id = resource_id[:-len(self._generated_suffix)]
+        with ThreadPoolExecutor(max_workers=min(len(names), self._max_delete_workers)) as executor:
+            num_deleted = sum(executor.map(self._delete_object, names))
 
-            yield resource_id
-            self.log_debug('listed %s', resource_id)
+        self.log_debug('deleted %d of %d objects', num_deleted, len(names))
+        return num_deleted
+
+    def _delete_object(self, name: str) -> bool:
+        return self._client.delete_object(name)
+
+    def _to_filename(self, resource_id: str) -> str:
+        return resource_id
+
+    def _to_resource_id(self, name: str, prefix: Optional[str]) -> str:
+        resource_id = name
+
+        if prefix is not None:
+            resource_id = resource_id[len(prefix):]
+
+        if self._generated_suffix and resource_id.endswith(self._generated_suffix):
+            resource_id = resource_id[:-len(self._generated_suffix)]
+
+        return resource_id
 
 
 class AzureFileStorage(_BaseAzureStorage):
@@ -182,6 +314,14 @@ class _AzureBytesStorage(_BaseAzureStorage):
         filename = self._to_filename(resource_id)
         super().delete(filename)
 
+    def exists(self, resource_id: str) -> bool:
+        try:
+            self._client.get_object(self._to_filename(resource_id))
+        except ObjectDoesNotExistError:
+            return False
+        else:
+            return True
+
     def _to_filename(self, resource_id: str) -> str:
         if resource_id.endswith(self._generated_suffix):
             return resource_id
@@ -209,6 +349,43 @@ class AzureTextStorage(_AzureBytesStorage):
         return content.decode(self._encoding)
 
 
+class AzureMarkerStorage(_BaseAzureStorage):
+    _legacy_suffix = '.txt.gz'
+
+    def mark(self, resource_id: str):
+        self._client.upload_object_via_stream(BytesIO(), resource_id)
+        self.log_debug('marked %s', resource_id)
+
+    def exists(self, resource_id: str) -> bool:
+        for name in (resource_id, f'{resource_id}{self._legacy_suffix}'):
+            try:
+                self._client.get_object(name)
+            except ObjectDoesNotExistError:
+                continue
+            else:
+                return True
+        return False
+
+    def delete(self, resource_id: str):
+        if not self.delete_many([resource_id]):
+            self.log_warning('deleted missing %s', resource_id)
+
+    def _delete_object(self, name: str) -> bool:
+        if self._client.delete_object(name):
+            return True
+        if name.endswith(self._legacy_suffix):
+            return False
+        return self._client.delete_object(f'{name}{self._legacy_suffix}')
+
+    def _to_resource_id(self, name: str, prefix: Optional[str]) -> str:
+        resource_id = super()._to_resource_id(name, prefix)
+
+        if resource_id.endswith(self._legacy_suffix):
+            resource_id = resource_id[:-len(self._legacy_suffix)]
+
+        return resource_id
+
+
 class AzureObjectsStorage(LogMixin):
     _compression = 'zstd'
     _compression_level = 20
@@ -285,7 +462,7 @@ class AzureObjectsStorage(LogMixin):
         self.log_debug('stored %d objects at %s', num_stored, resource_id)
         return resource_id if num_stored > 0 else None
 
-    def fetch_objects(self, resource_id: str, download: Download) -> Iterable[dict]:
+    def fetch_objects(self, resource_id: str, download: Download[_T]) -> Iterable[_T]:
 
         name, decoder = download
 
@@ -307,11 +484,63 @@ class AzureObjectsStorage(LogMixin):
 
 class AzureObjectStorage(_AzureBytesStorage):
     _extension = 'msgpack'
+    _spool_max_bytes = 1024 * 1024
 
     def fetch_object(self, resource_id: str) -> dict:
         serialized = self.fetch_bytes(resource_id)
         return from_msgpack_bytes(serialized)
 
     def store_object(self, resource_id: str, obj: dict) -> None:
-        serialized = to_msgpack_bytes(obj)
-        self.store_bytes(resource_id, serialized)
+        filename = self._to_filename(resource_id)
+        with SpooledTemporaryFile(max_size=self._spool_max_bytes) as upload:
+            with GzipFile(fileobj=upload, mode='wb') as fobj:
+                write_msgpack(obj, fobj.write)
+            self.log_debug('storing %d bytes at %s', upload.tell(), filename)
+            upload.seek(0)
+            self._client.upload_object_via_stream(upload, filename)
+
+    def fetch_versioned_object(self, resource_id: str) -> Tuple[dict, str]:
+        filename = self._to_filename(resource_id)
+        resource = self._client.get_object(filename)
+        content = gunzip_bytes(b''.join(resource.as_stream()))
+        self.log_debug('fetched %d bytes from %s', len(content), filename)
+        return from_msgpack_bytes(content), _version_of(resource)
+
+    def store_versioned_object(self, resource_id: str, obj: dict, version: Optional[str]) -> bool:
+        filename = self._to_filename(resource_id)
+        upload = BytesIO(gzip_bytes(to_msgpack_bytes(obj)))
+        self.log_debug('storing version after %s at %s', version, filename)
+        return self._client.upload_versioned_object_via_stream(upload, filename, version)
+
+    def store_many(self, objs: Iterable[Tuple[str, dict]]):
+        for resource_id, obj in objs:
+            self.store_object(resource_id, obj)
+
+    def store_object_with_id(self, obj: dict, id_key: str = '_uid') -> StoredObject:
+        entries = {key: value for key, value in obj.items() if key != id_key}
+        digest = sha256()
+
+        with SpooledTemporaryFile(max_size=self._spool_max_bytes) as upload:
+            with GzipFile(fileobj=upload, mode='wb') as fobj:
+
+                def write(chunk: bytes):
+                    fobj.write(chunk)
+                    digest.update(chunk)
+
+                fobj.write(msgpack_map_header(len(entries) + 1))
+                digest.update(msgpack_map_header(len(entries)))
+                write_msgpack_entries(entries, write)
+                digest.update(b'\n')
+
+                resource_id = digest.hexdigest()
+                write_msgpack_entries({id_key: resource_id}, fobj.write)
+                fobj.write(b'\n')
+
+            num_bytes = upload.tell()
+            filename = self._to_filename(resource_id)
+            self.log_debug('storing %d bytes at %s', num_bytes, filename)
+            upload.seek(0)
+            self._client.upload_object_via_stream(upload, filename)
+
+        obj[id_key] = resource_id
+        return StoredObject(resource_id=resource_id, num_bytes=num_bytes)
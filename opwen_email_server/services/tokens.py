@@ -0,0 +1,59 @@
+from time import time
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from libcloud.storage.types import ObjectDoesNotExistError
+
+from opwen_email_server.services.index_store import VersionedStore
+from opwen_email_server.utils.log import LogMixin
+
+
+class DomainTokens(LogMixin):
+    def __init__(self, storage: VersionedStore, max_tokens: int, lease_seconds: float = 600, max_attempts: int = 5):
+        self._storage = storage
+        self._max_tokens = max_tokens
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+
+    def acquire(self, domain: str, name: str) -> Optional[str]:
+        lease = uuid4().hex
+
+        for _ in range(self._max_attempts):
+            leases, version = self._fetch(domain, name)
+            if len(leases) >= self._max_tokens:
+                self.log_debug('no %s tokens left for %s', name, domain)
+                return None
+
+            leases[lease] = time() + self._lease_seconds
+            if self._storage.store_versioned_object(self._path(domain, name), {'leases': leases}, version):
+                return lease
+
+        self.log_warning('contention on %s tokens for %s, deferring', name, domain)
+        return None
+
+    def release(self, domain: str, name: str, lease: str):
+        for _ in range(self._max_attempts):
+            leases, version = self._fetch(domain, name)
+            if leases.pop(lease, None) is None:
+                return
+
+            if self._storage.store_versioned_object(self._path(domain, name), {'leases': leases}, version):
+                return
+
+        self.log_warning('unable to release %s token for %s, letting lease %s expire', name, domain, lease)
+
+    def _fetch(self, domain: str, name: str) -> Tuple[Dict[str, float], Optional[str]]:
+        try:
+            tokens, version = self._storage.fetch_versioned_object(self._path(domain, name))
+        except ObjectDoesNotExistError:
+            return {}, None
+
+        now = time()
+        leases = {lease: expires_at for lease, expires_at in tokens['leases'].items() if expires_at > now}
+        return leases, version
+
+    @classmethod
+    def _path(cls, domain: str, name: str) -> str:
+        return f'{domain}/{name}'
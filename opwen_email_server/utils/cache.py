@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from hashlib import sha256
+from os import link
+from os import makedirs
+from os import replace
+from os import scandir
+from os import utime
+from os.path import getsize
+from os.path import join
+from shutil import copyfile
+from threading import Event
+from threading import Lock
+from time import monotonic
+from time import time_ns
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from opwen_email_server.utils.temporary import SpooledBytes
+from opwen_email_server.utils.temporary import create_tempfilename
+from opwen_email_server.utils.temporary import remove_if_exists
+
+
+class ContentCache:
+    def __init__(self, max_bytes: int, max_item_bytes: Optional[int] = None) -> None:
+        self._max_bytes = max_bytes
+        self._max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes
+        self._lock = Lock()
+        self._keys = OrderedDict()  # type: OrderedDict[str, str]
+        self._contents = {}  # type: Dict[str, bytes]
+        self._references = {}  # type: Dict[str, int]
+        self._num_bytes = 0
+
+    @property
+    def num_bytes(self) -> int:
+        return self._num_bytes
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            digest = self._keys.get(key)
+            if digest is None:
+                return None
+
+            self._keys.move_to_end(key)
+            return self._contents[digest]
+
+    def put(self, key: str, content: bytes) -> None:
+        if len(content) > self._max_item_bytes:
+            return
+
+        digest = sha256(content).hexdigest()
+
+        with self._lock:
+            previous = self._keys.pop(key, None)
+            if previous is not None:
+                self._release(previous)
+
+            self._keys[key] = digest
+            self._references[digest] = self._references.get(digest, 0) + 1
+            if digest not in self._contents:
+                self._contents[digest] = content
+                self._num_bytes += len(content)
+
+            while self._num_bytes > self._max_bytes:
+                _, evicted = self._keys.popitem(last=False)
+                self._release(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+            self._contents.clear()
+            self._references.clear()
+            self._num_bytes = 0
+
+    def _release(self, digest: str) -> None:
+        self._references[digest] -= 1
+        if self._references[digest] > 0:
+            return
+
+        del self._references[digest]
+        self._num_bytes -= len(self._contents.pop(digest))
+
+
+def _link_or_copy(source: str, target: str) -> None:
+    try:
+        link(source, target)
+    except OSError:
+        copyfile(source, target)
+
+
+class FileCache:
+    def __init__(self, root: str, max_bytes: int, max_item_bytes: Optional[int] = None) -> None:
+        self._root = root
+        self._max_bytes = max_bytes
+        self._max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes
+        self._lock = Lock()
+        self._last_used_ns = 0
+
+        with self._lock:
+            self._enforce_limit()
+
+    @property
+    def num_bytes(self) -> int:
+        return sum(size for _, _, size in self._scan())
+
+    def __len__(self) -> int:
+        return len(self._scan())
+
+    def get(self, key: str, suffix: Optional[str] = None) -> Optional[SpooledBytes]:
+        path = self._path_for(key)
+        copy = create_tempfilename(suffix)
+
+        with self._lock:
+            try:
+                _link_or_copy(path, copy)
+                self._touch(path)
+            except FileNotFoundError:
+                remove_if_exists(copy)
+                return None
+
+        return SpooledBytes(copy, getsize(copy))
+
+    def put(self, key: str, content: SpooledBytes) -> None:
+        if len(content) > self._max_item_bytes:
+            return
+
+        makedirs(self._root, exist_ok=True)
+        path = self._path_for(key)
+        staged = f'{path}.{uuid4()}'
+
+        with self._lock:
+            try:
+                _link_or_copy(content.path, staged)
+                replace(staged, path)
+                self._touch(path)
+            finally:
+                remove_if_exists(staged)
+
+            self._enforce_limit()
+
+    def _path_for(self, key: str) -> str:
+        return join(self._root, sha256(key.encode('utf-8')).hexdigest())
+
+    def _touch(self, path: str) -> None:
+        self._last_used_ns = max(time_ns(), self._last_used_ns + 1)
+        utime(path, ns=(self._last_used_ns, self._last_used_ns))
+
+    def _scan(self) -> List[Tuple[int, str, int]]:
+        try:
+            entries = list(scandir(self._root))
+        except FileNotFoundError:
+            return []
+
+        files = []
+        for entry in entries:
+            if '.' in entry.name:
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append((stat.st_mtime_ns, entry.path, stat.st_size))
+
+        return files
+
+    def _enforce_limit(self) -> None:
+        files = sorted(self._scan())
+        num_bytes = sum(size for _, _, size in files)
+
+        for _, path, size in files:
+            if num_bytes <= self._max_bytes:
+                break
+
+            remove_if_exists(path)
+            num_bytes -= size
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: float, max_items: int = 1024, clock: Callable[[], float] = monotonic) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._max_items = max_items
+        self._clock = clock
+        self._lock = Lock()
+        self._items = OrderedDict()  # type: OrderedDict[Hashable, Tuple[float, Any]]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at <= self._clock():
+                del self._items[key]
+                return default
+
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        if ttl_seconds is None:
+            ttl_seconds = self._ttl_seconds
+
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (self._clock() + ttl_seconds, value)
+
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result = None  # type: Any
+        self.error = None  # type: Optional[BaseException]
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._calls = {}  # type: Dict[Hashable, _Call]
+
+    def __call__(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            existing = self._calls.get(key)
+            is_leader = existing is None
+            call = self._calls[key] = existing or _Call()
+
+        if not is_leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except BaseException as ex:
+                call.error = ex
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
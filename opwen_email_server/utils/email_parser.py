@@ -1,29 +1,70 @@
+from binascii import a2b_base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from copy import deepcopy
 from datetime import datetime
 from datetime import timezone
 from email.utils import mktime_tz
 from email.utils import parsedate_tz
-from io import BytesIO
 from itertools import chain
 from mimetypes import guess_type
+from typing import Any
 from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
+from typing import Union
 
 from bs4 import BeautifulSoup
-from PIL import Image
+from bs4 import Tag
+from cached_property import cached_property
 from pyzmail import PyzMessage
 from pyzmail.parse import MailPart
 from requests import Response
-from requests import get as http_get
-
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from opwen_email_server.config import IMAGES_MAX_BYTES
+from opwen_email_server.config import IMAGES_OUTPUT_FORMAT
+from opwen_email_server.config import INLINE_IMAGES_CACHE_MAX_BYTES
+from opwen_email_server.config import INLINE_IMAGES_CACHE_MAX_ITEM_BYTES
+from opwen_email_server.config import INLINE_IMAGES_MAX_WORKERS
+from opwen_email_server.config import INLINE_IMAGES_TIMEOUT_SECONDS
 from opwen_email_server.config import MAX_HEIGHT_IMAGES
 from opwen_email_server.config import MAX_WIDTH_IMAGES
+from opwen_email_server.config import MIME_PARSER_MAX_MEMORY_MB
+from opwen_email_server.config import MIME_PARSER_MAX_TASKS_PER_PROCESS
+from opwen_email_server.config import MIME_PARSER_PROCESSES
+from opwen_email_server.config import MIME_PARSER_TIMEOUT_SECONDS
+from opwen_email_server.config import MIME_SPOOL_THRESHOLD_BYTES
 from opwen_email_server.constants import mailbox
+from opwen_email_server.utils.cache import ContentCache
+from opwen_email_server.utils.collections import singleton
+from opwen_email_server.utils.image import ImageShrinker
+from opwen_email_server.utils.image import mimetype_for
 from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.process import ProcessPool
 from opwen_email_server.utils.serialization import to_base64
+from opwen_email_server.utils.string import tokenize
+from opwen_email_server.utils.temporary import SpooledBytes
+
+FetchImages = Callable[[Iterable[str], Callable], Dict[str, str]]
+
+Payload = Union[bytes, SpooledBytes]
+
+_BASE64_CHUNK_CHARS = 64 * 1024
+
+_shrink_image = ImageShrinker(
+    max_width=MAX_WIDTH_IMAGES,
+    max_height=MAX_HEIGHT_IMAGES,
+    output_format=IMAGES_OUTPUT_FORMAT,
+    max_bytes=IMAGES_MAX_BYTES,
+)
 
 
 def _parse_body(message: PyzMessage, default_charset: str = 'ascii') -> str:
@@ -39,11 +80,50 @@ def _parse_body(message: PyzMessage, default_charset: str = 'ascii') -> str:
     return ''
 
 
-def _parse_attachments(mailparts: Iterable[MailPart]) -> Iterable[dict]:
+def _iter_base64_chunks(encoded: str) -> Iterator[bytes]:
+    remainder = ''
+    for start in range(0, len(encoded), _BASE64_CHUNK_CHARS):
+        chunk = remainder + ''.join(encoded[start:start + _BASE64_CHUNK_CHARS].split())
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        if usable:
+            yield a2b_base64(chunk[:usable])
+    if remainder:
+        yield a2b_base64(remainder + '=' * (-len(remainder) % 4))
+
+
+def _spool_payload(part: MailPart, spool_bytes: int) -> Optional[Payload]:
+    encoded = part.part.get_payload()
+    if not isinstance(encoded, str) or len(encoded) * 3 // 4 <= spool_bytes:
+        return part.get_payload()
+
+    if (part.part.get('Content-Transfer-Encoding') or '').strip().lower() == 'base64':
+        spooled = SpooledBytes.spool(_iter_base64_chunks(encoded), part.sanitized_filename)
+    else:
+        payload = part.get_payload()
+        if not payload or len(payload) <= spool_bytes:
+            return payload
+        spooled = SpooledBytes.spool([payload], part.sanitized_filename)
+
+    if not spooled:
+        spooled.remove()
+        return None
+
+    return spooled
+
+
+def _get_payload(part: MailPart, spool_bytes: Optional[int]) -> Optional[Payload]:
+    if not spool_bytes or part.type.startswith('message/'):
+        return part.get_payload()
+
+    return _spool_payload(part, spool_bytes)
+
+
+def _parse_attachments(mailparts: Iterable[MailPart], spool_bytes: Optional[int] = None) -> Iterable[dict]:
     attachment_parts = (part for part in mailparts if not part.is_body)
     for part in attachment_parts:
         filename = part.sanitized_filename
-        payload = part.get_payload()
+        payload = _get_payload(part, spool_bytes)
         attachment_id = part.content_id
         if filename and payload:
             attachment = {'filename': filename, 'content': payload}
@@ -73,7 +153,7 @@ def _parse_sent_at(message: PyzMessage) -> Optional[str]:
     return date_utc.strftime('%Y-%m-%d %H:%M')
 
 
-def parse_mime_email(mime_email: str) -> dict:
+def parse_mime_email(mime_email: str, spool_bytes: Optional[int] = None) -> dict:
     message = PyzMessage.factory(mime_email)
 
     return {
@@ -84,10 +164,34 @@ def parse_mime_email(mime_email: str) -> dict:
         'from': _parse_address(message, 'from'),
         'subject': message.get_subject(),
         'body': _parse_body(message),
-        'attachments': list(_parse_attachments(message.mailparts)),
+        'attachments': list(_parse_attachments(message.mailparts, spool_bytes)),
     }
 
 
+def remove_spooled_attachments(email: dict) -> None:
+    for attachment in email.get('attachments') or []:
+        content = attachment.get('content')
+        if isinstance(content, SpooledBytes):
+            content.remove()
+
+
+def _shrink_attachment(filename: str, content: Payload) -> Tuple[str, Payload]:
+    if not isinstance(content, SpooledBytes):
+        return _shrink_image.shrink_attachment(filename, content)
+
+    attachment_type = guess_type(filename)[0]
+    if not attachment_type or 'image' not in attachment_type.lower():
+        return filename, content
+
+    original_content = content.read()
+    small_filename, small_content = _shrink_image.shrink_attachment(filename, original_content)
+    if small_content is original_content:
+        return filename, content
+
+    content.remove()
+    return small_filename, small_content
+
+
 def format_attachments(email: dict) -> dict:
     attachments = email.get('attachments', [])
 
@@ -100,9 +204,10 @@ def format_attachments(email: dict) -> dict:
     for i, attachment in enumerate(attachments):
         filename = attachment.get('filename', '')
         content = attachment.get('content', b'')
-        formatted_content = _format_attachment(filename, content)
+        formatted_filename, formatted_content = _shrink_attachment(filename, content)
 
         if content != formatted_content:
+            formatted_attachments[i]['filename'] = formatted_filename
             formatted_attachments[i]['content'] = formatted_content
             is_any_attachment_changed = True
 
@@ -114,16 +219,11 @@ def format_attachments(email: dict) -> dict:
     return new_email
 
 
-def _format_attachment(filename: str, content: bytes) -> bytes:
-    attachment_type = guess_type(filename)[0]
-
-    if not attachment_type:
-        return content
-
-    if 'image' in attachment_type.lower():
-        content = _change_image_size(content)
-
-    return content
+def get_email_size(email: dict) -> int:
+    size = len(email.get('body') or '')
+    for attachment in email.get('attachments') or []:
+        size += len(attachment.get('content') or b'')
+    return size
 
 
 def get_recipients(email: dict) -> Iterable[str]:
@@ -150,76 +250,130 @@ def _get_image_type(response: Response, url: str) -> Optional[str]:
     return content_type
 
 
-def _is_already_small(size: Tuple[int, int]) -> bool:
-    width, height = size
-    return width <= MAX_WIDTH_IMAGES and height <= MAX_HEIGHT_IMAGES
+def _is_valid_url(url: Optional[str]) -> bool:
+    if not url:
+        return False
+    has_http_prefix = url.startswith('http://')
+    has_https_prefix = url.startswith('https://')
+    return has_http_prefix or has_https_prefix
 
 
-def _change_image_size(image_content_bytes: bytes) -> bytes:
-    image_bytes = BytesIO(image_content_bytes)
-    image_bytes.seek(0)
-    image = Image.open(image_bytes)
+class InlineImageFetcher:
+    def __init__(self,
+                 max_workers: int = INLINE_IMAGES_MAX_WORKERS,
+                 timeout_seconds: float = INLINE_IMAGES_TIMEOUT_SECONDS,
+                 cache: Optional[ContentCache] = None) -> None:
+        self._max_workers = max(max_workers, 1)
+        self._timeout_seconds = timeout_seconds
+        self._cache = cache
 
-    if _is_already_small(image.size):
-        return image_content_bytes
+    @cached_property
+    def _session(self) -> Session:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=self._max_workers, pool_maxsize=self._max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
-    new_size = (MAX_WIDTH_IMAGES, MAX_HEIGHT_IMAGES)
-    image.thumbnail(new_size, Image.ANTIALIAS)
-    new_image = BytesIO()
-    image.save(new_image, image.format)
-    new_image.seek(0)
-    new_image_bytes = new_image.read()
-    return new_image_bytes
+    def __call__(self, image_urls: Iterable[str], on_error: Callable) -> Dict[str, str]:
+        encoded_images = {}
+        missing_urls = []
 
+        for image_url in OrderedDict.fromkeys(image_urls):
+            cached = self._cache.get(image_url) if self._cache is not None else None
+            if cached is not None:
+                encoded_images[image_url] = cached.decode('ascii')
+            else:
+                missing_urls.append(image_url)
 
-def _fetch_image_to_base64(image_url: str) -> Optional[str]:
-    response = http_get(image_url)
-    if not response.ok:
-        return None
+        if not missing_urls:
+            return encoded_images
 
-    image_type = _get_image_type(response, image_url)
-    if not image_type:
-        return None
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(missing_urls))) as executor:
+            futures = {executor.submit(self._fetch_image_to_base64, image_url): image_url for image_url in missing_urls}
 
-    if not response.content:
-        return None
+            for future in as_completed(futures):
+                image_url = futures[future]
+                try:
+                    encoded_image = future.result()
+                except Exception as ex:
+                    on_error('Unable to inline image %s: %s', image_url, ex)
+                    continue
 
-    small_image_bytes = _change_image_size(response.content)
-    small_image_base64 = to_base64(small_image_bytes)
-    return f'data:{image_type};base64,{small_image_base64}'
+                if not encoded_image:
+                    continue
 
+                encoded_images[image_url] = encoded_image
+                if self._cache is not None:
+                    self._cache.put(image_url, encoded_image.encode('ascii'))
 
-def _is_valid_url(url: Optional[str]) -> bool:
-    if not url:
-        return False
-    has_http_prefix = url.startswith('http://')
-    has_https_prefix = url.startswith('https://')
-    return has_http_prefix or has_https_prefix
+        return encoded_images
 
+    def _fetch_image_to_base64(self, image_url: str) -> Optional[str]:
+        response = self._session.get(image_url, timeout=self._timeout_seconds)
+        if not response.ok:
+            return None
 
-def format_inline_images(email: dict, on_error: Callable) -> dict:
+        image_type = _get_image_type(response, image_url)
+        if not image_type:
+            return None
+
+        if not response.content:
+            return None
+
+        small_image_bytes, image_format = _shrink_image(response.content)
+        image_type = mimetype_for(image_format) or image_type
+        small_image_base64 = to_base64(small_image_bytes)
+        return f'data:{image_type};base64,{small_image_base64}'
+
+
+@singleton
+def get_inline_image_fetcher() -> InlineImageFetcher:
+    return InlineImageFetcher(cache=ContentCache(
+        max_bytes=INLINE_IMAGES_CACHE_MAX_BYTES,
+        max_item_bytes=INLINE_IMAGES_CACHE_MAX_ITEM_BYTES,
+    ))
+
+
+def _image_source(image_tag: Tag) -> str:
+    return str(image_tag.get('src') or '')
+
+
+def _find_image_tags(soup: BeautifulSoup) -> List[Tag]:
+    return [image_tag for image_tag in soup.find_all('img') if _is_valid_url(_image_source(image_tag))]
+
+
+def _replace_image_sources(image_tags: Iterable[Tag], encoded_images: Dict[str, str]) -> None:
+    for image_tag in image_tags:
+        encoded_image = encoded_images.get(_image_source(image_tag))
+        if encoded_image:
+            image_tag['src'] = encoded_image
+
+
+def _find_inline_image_urls(email_body: str) -> List[str]:
+    soup = BeautifulSoup(email_body, 'html.parser')
+    return [_image_source(image_tag) for image_tag in _find_image_tags(soup)]
+
+
+def _inline_images(email_body: str, encoded_images: Dict[str, str]) -> str:
+    soup = BeautifulSoup(email_body, 'html.parser')
+    _replace_image_sources(_find_image_tags(soup), encoded_images)
+    return str(soup)
+
+
+def format_inline_images(email: dict, on_error: Callable, fetch_images: Optional[FetchImages] = None) -> dict:
     email_body = email.get('body', '')
     if not email_body:
         return email
 
     soup = BeautifulSoup(email_body, 'html.parser')
-    image_tags = soup.find_all('img')
+    image_tags = _find_image_tags(soup)
     if not image_tags:
         return email
 
-    for image_tag in image_tags:
-        image_url = image_tag.get('src')
-
-        if not _is_valid_url(image_url):
-            continue
-
-        try:
-            encoded_image = _fetch_image_to_base64(image_url)
-        except Exception as ex:
-            on_error('Unable to inline image %s: %s', image_url, ex)
-        else:
-            if encoded_image:
-                image_tag['src'] = encoded_image
+    fetch_images = fetch_images or InlineImageFetcher()
+    encoded_images = fetch_images((_image_source(image_tag) for image_tag in image_tags), on_error)
+    _replace_image_sources(image_tags, encoded_images)
 
     new_email = dict(email)
     new_email['body'] = str(soup)
@@ -230,9 +384,87 @@ def descending_timestamp(email_sent_at: str) -> str:
     return str(mailbox.FUTURE_TIMESTAMP - int(datetime.fromisoformat(email_sent_at).timestamp()))
 
 
+def get_snippet(body: Optional[str], max_length: int = mailbox.SNIPPET_LENGTH) -> str:
+    if not body:
+        return ''
+
+    text = ' '.join(BeautifulSoup(body, 'html.parser').get_text(' ').split())
+    if len(text) <= max_length:
+        return text
+
+    return text[:max_length].rstrip() + '...'
+
+
+def summarize_email(email: dict) -> dict:
+    summary = {field: email.get(field) for field in mailbox.SUMMARY_FIELDS}
+    summary['snippet'] = get_snippet(email.get('body'))
+    summary['attachments'] = [{
+        'filename': attachment.get('filename'),
+        'size': len(attachment.get('content') or b''),
+    } for attachment in email.get('attachments', [])]
+    return summary
+
+
+def get_search_terms(email: dict) -> Set[str]:
+    terms = set()  # type: Set[str]
+    terms.update(tokenize(email.get('subject')))
+    terms.update(tokenize(email.get('from')))
+    for address in chain(email.get('to') or [], email.get('cc') or [], email.get('bcc') or []):
+        terms.update(tokenize(address))
+    for attachment in email.get('attachments', []):
+        terms.update(tokenize(attachment.get('filename')))
+
+    body = email.get('body')
+    if body:
+        terms.update(tokenize(BeautifulSoup(body, 'html.parser').get_text(' ')))
+
+    return terms
+
+
+def _parse_and_format_attachments(mime_email: str, spool_bytes: Optional[int]) -> dict:
+    email = parse_mime_email(mime_email, spool_bytes)
+    return format_attachments(email)
+
+
+@singleton
+def get_mime_parser_pool() -> Optional[ProcessPool]:
+    if MIME_PARSER_PROCESSES <= 0:
+        return None
+
+    return ProcessPool(
+        processes=MIME_PARSER_PROCESSES,
+        timeout_seconds=MIME_PARSER_TIMEOUT_SECONDS,
+        max_memory_bytes=MIME_PARSER_MAX_MEMORY_MB * 1024 * 1024,
+        max_tasks_per_child=MIME_PARSER_MAX_TASKS_PER_PROCESS,
+    )
+
+
 class MimeEmailParser(LogMixin):
+    def __init__(self,
+                 fetch_images: Optional[FetchImages] = None,
+                 process_pool: Optional[Callable[..., Any]] = None,
+                 spool_bytes: Optional[int] = MIME_SPOOL_THRESHOLD_BYTES) -> None:
+        self._fetch_images = fetch_images or get_inline_image_fetcher()
+        self._process_pool = process_pool or get_mime_parser_pool()
+        self._spool_bytes = spool_bytes
+
     def __call__(self, mime_email: str) -> dict:
-        email = parse_mime_email(mime_email)
-        email = format_attachments(email)
-        email = format_inline_images(email, self.log_warning)
+        if self._process_pool is None:
+            email = parse_mime_email(mime_email, self._spool_bytes)
+            email = format_attachments(email)
+            email = format_inline_images(email, self.log_warning, self._fetch_images)
+            return email
+
+        email = self._process_pool(_parse_and_format_attachments, mime_email, self._spool_bytes)
+
+        email_body = email.get('body')
+        if not email_body:
+            return email
+
+        image_urls = self._process_pool(_find_inline_image_urls, email_body)
+        if not image_urls:
+            return email
+
+        encoded_images = self._fetch_images(image_urls, self.log_warning)
+        email['body'] = self._process_pool(_inline_images, email_body, encoded_images)
         return email
@@ -0,0 +1,108 @@
+from io import BytesIO
+from mimetypes import guess_type
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from PIL import Image
+
+_LOSSY_FORMATS = frozenset(['JPEG', 'WEBP'])
+
+_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+}
+
+
+def mimetype_for(image_format: str) -> Optional[str]:
+    return Image.MIME.get(image_format.upper())
+
+
+def extension_for(image_format: str) -> str:
+    image_format = image_format.upper()
+    return _EXTENSIONS.get(image_format, f'.{image_format.lower()}')
+
+
+def _replace_extension(filename: str, extension: str) -> str:
+    stem, dot, _ = filename.rpartition('.')
+    return f'{stem if dot else filename}{extension}'
+
+
+class ImageShrinker:
+    def __init__(self,
+                 max_width: int,
+                 max_height: int,
+                 output_format: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 qualities: Iterable[int] = (75, 60, 45, 30)) -> None:
+        self._max_size = (max_width, max_height)
+        self._output_format = output_format.upper() if output_format else None
+        self._max_bytes = max_bytes or None
+        self._qualities = tuple(qualities)
+
+    def __call__(self, content: bytes) -> Tuple[bytes, str]:
+        image = Image.open(BytesIO(content))
+        original_format = image.format
+        output_format = self._output_format or original_format
+
+        is_small = self._is_already_small(image.size)
+        if is_small and output_format == original_format and self._fits_budget(content):
+            return content, original_format
+
+        if not is_small:
+            if original_format == 'JPEG':
+                image.draft(image.mode, self._max_size)
+            image.thumbnail(self._max_size, Image.LANCZOS)
+
+        encoded = self._encode(image, output_format)
+
+        if is_small and len(encoded) >= len(content):
+            return content, original_format
+
+        return encoded, output_format
+
+    def shrink_attachment(self, filename: str, content: bytes) -> Tuple[str, bytes]:
+        attachment_type = guess_type(filename)[0]
+
+        if not attachment_type or 'image' not in attachment_type.lower():
+            return filename, content
+
+        small_content, image_format = self(content)
+        if small_content is content:
+            return filename, content
+
+        if mimetype_for(image_format) != attachment_type:
+            filename = _replace_extension(filename, extension_for(image_format))
+
+        return filename, small_content
+
+    def _is_already_small(self, size: Tuple[int, int]) -> bool:
+        width, height = size
+        max_width, max_height = self._max_size
+        return width <= max_width and height <= max_height
+
+    def _fits_budget(self, content: bytes) -> bool:
+        return self._max_bytes is None or len(content) <= self._max_bytes
+
+    def _encode(self, image: Image.Image, image_format: str) -> bytes:
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        if image_format not in _LOSSY_FORMATS:
+            return self._save(image, image_format)
+
+        encoded = b''
+        for quality in self._qualities:
+            encoded = self._save(image, image_format, quality=quality, optimize=True)
+            if self._fits_budget(encoded):
+                break
+
+        return encoded
+
+    @classmethod
+    def _save(cls, image: Image.Image, image_format: str, **kwargs) -> bytes:
+        buffer = BytesIO()
+        image.save(buffer, image_format, **kwargs)
+        return buffer.getvalue()
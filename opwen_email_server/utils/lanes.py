@@ -0,0 +1,12 @@
+from typing import Sequence
+from zlib import crc32
+
+
+def lane_for(domain: str, num_lanes: int) -> int:
+    if num_lanes <= 1:
+        return 0
+    return crc32(domain.lower().encode('utf-8')) % num_lanes
+
+
+def lane_queue(queues: Sequence[str], domain: str) -> str:
+    return queues[lane_for(domain, len(queues))]
@@ -0,0 +1,122 @@
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from threading import BoundedSemaphore
+from threading import Lock
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from opwen_email_server.utils.log import LogMixin
+
+_STOP_TIMEOUT_SECONDS = 5
+
+
+def _limit_memory(max_memory_bytes: Optional[int]) -> None:
+    if not max_memory_bytes:
+        return
+
+    from resource import RLIMIT_AS
+    from resource import setrlimit
+
+    setrlimit(RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+
+def _serve(connection: Connection, max_memory_bytes: Optional[int]) -> None:
+    _limit_memory(max_memory_bytes)
+
+    while True:
+        try:
+            func, args = connection.recv()
+        except EOFError:
+            return
+
+        try:
+            response = (True, func(*args))
+        except Exception as ex:
+            response = (False, ex)
+
+        try:
+            connection.send(response)
+        except Exception as ex:
+            connection.send((False, ex))
+
+
+class _Worker:
+    def __init__(self, context: Any, max_memory_bytes: Optional[int]) -> None:
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, max_memory_bytes), daemon=True)
+        self.process.start()
+        child.close()
+        self.num_tasks = 0
+
+    def stop(self) -> None:
+        self.connection.close()
+        self.process.join(_STOP_TIMEOUT_SECONDS)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class ProcessPool(LogMixin):
+    def __init__(self,
+                 processes: int,
+                 timeout_seconds: float,
+                 max_memory_bytes: Optional[int] = None,
+                 max_tasks_per_child: Optional[int] = None) -> None:
+        self._timeout_seconds = timeout_seconds
+        self._max_memory_bytes = max_memory_bytes
+        self._max_tasks_per_child = max_tasks_per_child
+        self._context = get_context('forkserver')
+        self._slots = BoundedSemaphore(max(processes, 1))
+        self._lock = Lock()
+        self._idle = []  # type: List[_Worker]
+
+    def __call__(self, func: Callable, *args: Any) -> Any:
+        with self._slots:
+            worker = self._checkout()
+
+            try:
+                worker.connection.send((func, args))
+                if not worker.connection.poll(self._timeout_seconds):
+                    self.log_warning('%s timed out after %ss, restarting worker', func.__name__, self._timeout_seconds)
+                    raise PoolTimeoutError()
+                succeeded, result = worker.connection.recv()
+            except BaseException:
+                worker.kill()
+                raise
+
+            self._checkin(worker)
+
+        if not succeeded:
+            raise result
+
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            workers, self._idle = self._idle, []
+
+        for worker in workers:
+            worker.stop()
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        return _Worker(self._context, self._max_memory_bytes)
+
+    def _checkin(self, worker: _Worker) -> None:
+        worker.num_tasks += 1
+        if self._max_tasks_per_child and worker.num_tasks >= self._max_tasks_per_child:
+            worker.stop()
+            return
+
+        with self._lock:
+            self._idle.append(worker)
@@ -5,10 +5,16 @@ from io import BytesIO
 from json import JSONDecodeError
 from json import dumps
 from json import loads
+from struct import pack
+from typing import Any
+from typing import Callable
 from typing import Optional
 
+from msgpack import Packer
+from msgpack import Unpacker
 from msgpack import packb as msgpack_dump
-from msgpack import unpackb as msgpack_load
+
+from opwen_email_server.utils.temporary import SpooledBytes
 
 
 def to_json(obj: object) -> str:
@@ -35,14 +41,64 @@ def from_jsonl_bytes(obj: bytes) -> Optional[dict]:
         return None
 
 
+def _read_spooled(obj: object) -> bytes:
+    if isinstance(obj, SpooledBytes):
+        return obj.read()
+    raise TypeError(f'Cannot serialize {obj!r}')
+
+
 def to_msgpack_bytes(obj) -> bytes:
-    encoded = msgpack_dump(obj, use_bin_type=True)
+    encoded = msgpack_dump(obj, use_bin_type=True, default=_read_spooled)
     return encoded + b'\n'
 
 
+def _msgpack_bin_header(size: int) -> bytes:
+    if size < 2**8:
+        return pack('>BB', 0xc4, size)
+    if size < 2**16:
+        return pack('>BH', 0xc5, size)
+    return pack('>BI', 0xc6, size)
+
+
+def msgpack_map_header(size: int) -> bytes:
+    return Packer().pack_map_header(size)
+
+
+def _write_msgpack(obj, write: Callable[[bytes], Any], packer: Packer) -> None:
+    if isinstance(obj, dict):
+        write(packer.pack_map_header(len(obj)))
+        _write_msgpack_entries(obj, write, packer)
+    elif isinstance(obj, (list, tuple)):
+        write(packer.pack_array_header(len(obj)))
+        for value in obj:
+            _write_msgpack(value, write, packer)
+    elif isinstance(obj, SpooledBytes):
+        write(_msgpack_bin_header(len(obj)))
+        for chunk in obj.iter_chunks():
+            write(chunk)
+    else:
+        write(packer.pack(obj))
+
+
+def _write_msgpack_entries(obj: dict, write: Callable[[bytes], Any], packer: Packer) -> None:
+    for key, value in obj.items():
+        _write_msgpack(key, write, packer)
+        _write_msgpack(value, write, packer)
+
+
+def write_msgpack(obj, write: Callable[[bytes], Any]) -> None:
+    _write_msgpack(obj, write, Packer(use_bin_type=True))
+    write(b'\n')
+
+
+def write_msgpack_entries(obj: dict, write: Callable[[bytes], Any]) -> None:
+    _write_msgpack_entries(obj, write, Packer(use_bin_type=True))
+
+
 def from_msgpack_bytes(serialized: bytes) -> dict:
-    encoded = serialized.rstrip(b'\n')
-    return msgpack_load(encoded, raw=False)
+    unpacker = Unpacker(raw=False, max_buffer_size=max(len(serialized), 1024 * 1024))
+    unpacker.feed(serialized)
+    return next(unpacker)
 
 
 def to_base64(content: bytes) -> str:
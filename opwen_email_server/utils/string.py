@@ -1,5 +1,10 @@
+from re import compile as re_compile
+from typing import Optional
+from typing import Set
 from urllib.parse import quote
 
+_TOKEN_PATTERN = re_compile(r'\w+')
+
 
 def is_lowercase(string: str) -> bool:
     return string.lower() == string
@@ -7,3 +12,10 @@ def is_lowercase(string: str) -> bool:
 
 def urlsafe(urlpart: str) -> str:
     return quote(urlpart, safe='')
+
+
+def tokenize(text: Optional[str], min_length: int = 2) -> Set[str]:
+    if not text:
+        return set()
+
+    return {token for token in _TOKEN_PATTERN.findall(text.lower()) if len(token) >= min_length}
@@ -4,6 +4,8 @@ from os import remove
 from os.path import join
 from tempfile import gettempdir
 from typing import Generator
+from typing import Iterable
+from typing import Iterator
 from typing import Optional
 from uuid import uuid4
 
@@ -26,3 +28,48 @@ def removing(path: str) -> Generator[str, None, None]:
 def remove_if_exists(path: str):
     with suppress(FileNotFoundError):
         remove(path)
+
+
+class SpooledBytes:
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def spool(cls, chunks: Iterable[bytes], suffix: Optional[str] = None) -> 'SpooledBytes':
+        path = create_tempfilename(suffix)
+        size = 0
+
+        try:
+            with open(path, 'wb') as fobj:
+                for chunk in chunks:
+                    fobj.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            remove_if_exists(path)
+            raise
+
+        return cls(path, size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(path={self.path!r}, size={self.size})'
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        with open(self.path, 'rb') as fobj:
+            while True:
+                chunk = fobj.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read(self) -> bytes:
+        with open(self.path, 'rb') as fobj:
+            return fobj.read()
+
+    def remove(self):
+        remove_if_exists(self.path)
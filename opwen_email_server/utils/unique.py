@@ -4,7 +4,7 @@ from typing import Optional
 from uuid import UUID
 from uuid import uuid4
 
-from opwen_email_server.utils.serialization import to_msgpack_bytes
+from opwen_email_server.utils.serialization import write_msgpack
 
 
 class NewGuid:
@@ -25,4 +25,12 @@ class NewGuid:
 
 
 def new_email_id(email: dict) -> str:
-    return sha256(to_msgpack_bytes(email)).hexdigest()
+    digest = sha256()
+    write_msgpack(email, digest.update)
+    return digest.hexdigest()
+
+
+def new_content_hash(obj: dict) -> str:
+    digest = sha256()
+    write_msgpack(dict(sorted(obj.items())), digest.update)
+    return digest.hexdigest()[:32]
@@ -60,11 +60,17 @@ class ClientCard extends React.Component {
     const {
       isDeleting,
       isFetchingPendingEmails,
-      numPendingEmails,
       isFetchingNumberOfUsers,
-      numUsers,
     } = this.state;
 
+    const numPendingEmails =
+      this.state.numPendingEmails != null
+        ? this.state.numPendingEmails
+        : this.props.numPendingEmails;
+
+    const numUsers =
+      this.state.numUsers != null ? this.state.numUsers : this.props.numUsers;
+
     return (
       <Card
         actions={[
@@ -88,16 +94,14 @@ class ClientCard extends React.Component {
               icon={isFetchingPendingEmails ? 'loading' : 'mail'}
               onClick={this._onClickFetchPendingEmails}
             />
-            {this.state.numPendingEmails != null && (
-              <span>&nbsp;{numPendingEmails}</span>
-            )}
+            {numPendingEmails != null && <span>&nbsp;{numPendingEmails}</span>}
           </div>,
           <div>
             <Button
               icon={isFetchingNumberOfUsers ? 'loading' : 'user'}
               onClick={this._onClickFetchNumberOfUsers}
             />
-            {this.state.numUsers != null && <span>&nbsp;{numUsers}</span>}
+            {numUsers != null && <span>&nbsp;{numUsers}</span>}
           </div>,
         ]}
         style={{
@@ -113,12 +117,16 @@ class ClientCard extends React.Component {
 ClientCard.propTypes = {
   domain: PropTypes.string.isRequired,
   fetchNumPendingEmails: PropTypes.func.isRequired,
+  fetchNumUsers: PropTypes.func.isRequired,
   onDelete: PropTypes.func.isRequired,
+  numPendingEmails: PropTypes.number,
+  numUsers: PropTypes.number,
 };
 
 class ClientStats extends React.Component {
   state = {
     clients: [],
+    metrics: {},
     isLoading: true,
   };
 
@@ -158,6 +166,22 @@ class ClientStats extends React.Component {
     });
   };
 
+  _fetchMetrics = async () => {
+    try {
+      const response = await this._client.get('/api/email/metrics/');
+      const metrics = {};
+      response.data.clients.forEach(client => {
+        metrics[client.domain] = client;
+      });
+      this.setState({ metrics });
+    } catch (exception) {
+      ErrorNotification({
+        message: 'Unable to fetch client metrics',
+        exception,
+      });
+    }
+  };
+
   _deleteClient = async domain => {
     try {
       await this._client
@@ -202,6 +226,8 @@ class ClientStats extends React.Component {
   };
 
   _renderListItem = ({ domain }) => {
+    const metrics = this.state.metrics[domain] || {};
+
     return (
       <List.Item key={domain}>
         <ClientCard
@@ -209,6 +235,8 @@ class ClientStats extends React.Component {
           onDelete={this._deleteClient}
           fetchNumPendingEmails={this._fetchNumPendingEmails}
           fetchNumUsers={this._fetchNumUsers}
+          numPendingEmails={metrics.pending_emails}
+          numUsers={metrics.users}
         />
       </List.Item>
     );
@@ -217,6 +245,7 @@ class ClientStats extends React.Component {
   componentDidMount() {
     if (this._isEnabled) {
       this._fetchClients();
+      this._fetchMetrics();
     }
   }
 
@@ -3,15 +3,23 @@ from random import choice
 from string import ascii_letters
 from unittest import TestCase
 from unittest import skipUnless
+from unittest.mock import ANY
+from unittest.mock import Mock
+from unittest.mock import patch
 
 from cached_property import cached_property
+from celery.exceptions import Retry
 from kombu import Connection
 from kombu import Exchange
 from kombu import Queue
 
+from opwen_email_server import config
 from opwen_email_server.config import QUEUE_BROKER
+from opwen_email_server.integration.celery import _defer_seconds
+from opwen_email_server.integration.celery import _run_with_domain_token
 from opwen_email_server.integration.celery import celery as app
 from opwen_email_server.integration.celery import task_routes
+from opwen_email_server.integration.celery import written_store
 
 
 class TransportTests(TestCase):
@@ -48,3 +56,104 @@ class TransportTests(TestCase):
 
         for task_name in registered_celery_tasks:
             self.assertIn(task_name, task_routes)
+
+
+@patch('opwen_email_server.integration.celery.get_domain_tokens')
+class RunWithDomainTokenTests(TestCase):
+    queues = ('send', 'send1')
+
+    def test_runs_and_releases_token(self, get_domain_tokens):
+        tokens = get_domain_tokens.return_value
+        tokens.acquire.return_value = 'lease'
+        task, action = Mock(), Mock()
+
+        _run_with_domain_token(task, self.queues, 'resource', 'test.lokole.ca', action)
+
+        action.assert_called_once_with('resource')
+        tokens.acquire.assert_called_once_with('test.lokole.ca', 'send')
+        tokens.release.assert_called_once_with('test.lokole.ca', 'send', 'lease')
+        task.apply_async.assert_not_called()
+
+    def test_releases_token_on_error(self, get_domain_tokens):
+        tokens = get_domain_tokens.return_value
+        tokens.acquire.return_value = 'lease'
+        action = Mock(side_effect=ValueError())
+
+        with self.assertRaises(ValueError):
+            _run_with_domain_token(Mock(), self.queues, 'resource', 'test.lokole.ca', action)
+
+        tokens.release.assert_called_once_with('test.lokole.ca', 'send', 'lease')
+
+    def test_defers_when_domain_is_over_capacity(self, get_domain_tokens):
+        get_domain_tokens.return_value.acquire.return_value = None
+        task, action = Mock(), Mock()
+        task.request.retries = 1
+
+        _run_with_domain_token(task, self.queues, 'resource', 'test.lokole.ca', action, defers=3)
+
+        action.assert_not_called()
+        task.retry.assert_not_called()
+        task.apply_async.assert_called_once_with(args=('resource', ),
+                                                 kwargs={'domain': 'test.lokole.ca', 'defers': 4},
+                                                 queue=ANY,
+                                                 countdown=ANY,
+                                                 retries=1)
+        self.assertIn(task.apply_async.call_args[1]['queue'], self.queues)
+
+    def test_backs_off_exponentially_with_jitter(self, get_domain_tokens):
+        base = config.DOMAIN_TOKEN_DEFER_SECONDS
+
+        for retries in range(4):
+            for _ in range(20):
+                self.assertGreaterEqual(_defer_seconds(retries), base)
+                self.assertLessEqual(_defer_seconds(retries), base * 2**retries)
+
+        self.assertLessEqual(_defer_seconds(100), config.DOMAIN_TOKEN_DEFER_MAX_SECONDS)
+
+    def test_runs_without_token_once_deferrals_are_used_up(self, get_domain_tokens):
+        tokens = get_domain_tokens.return_value
+        tokens.acquire.return_value = None
+        task, action = Mock(), Mock()
+
+        _run_with_domain_token(task, self.queues, 'resource', 'test.lokole.ca', action, config.DOMAIN_TOKEN_MAX_DEFERS)
+
+        action.assert_called_once_with('resource')
+        task.apply_async.assert_not_called()
+        tokens.release.assert_not_called()
+
+    def test_runs_without_domain(self, get_domain_tokens):
+        action = Mock()
+
+        _run_with_domain_token(Mock(), self.queues, 'resource', None, action)
+
+        action.assert_called_once_with('resource')
+        get_domain_tokens.assert_not_called()
+
+
+@patch('opwen_email_server.integration.celery.get_checkpoint_store')
+@patch('opwen_email_server.integration.celery.get_domain_counters')
+@patch('opwen_email_server.integration.celery.get_content_manifests')
+@patch('opwen_email_server.integration.celery.get_user_storage')
+@patch('opwen_email_server.integration.celery.get_email_storage')
+@patch('opwen_email_server.integration.celery.get_client_storage')
+@patch('opwen_email_server.integration.celery.get_domain_tokens')
+@patch('opwen_email_server.integration.celery.StoreWrittenClientEmails')
+class WrittenStoreTests(TestCase):
+    def test_retries_errors_after_deferrals(self, action_type, get_domain_tokens, *_):
+        tokens = get_domain_tokens.return_value
+        tokens.acquire.return_value = None
+        action_type.return_value.side_effect = ValueError()
+        kwargs = {'domain': 'test.lokole.ca'}
+
+        with patch.object(written_store, 'apply_async') as apply_async:
+            for _ in range(config.DOMAIN_TOKEN_MAX_DEFERS):
+                written_store.apply(args=('resource', ), kwargs=kwargs, throw=True)
+                kwargs = apply_async.call_args[1]['kwargs']
+                self.assertEqual(apply_async.call_args[1]['retries'], 0)
+
+        self.assertEqual(kwargs['defers'], config.DOMAIN_TOKEN_MAX_DEFERS)
+        action_type.return_value.assert_not_called()
+
+        tokens.acquire.return_value = 'lease'
+        with self.assertRaises(Retry):
+            written_store.apply(args=('resource', ), kwargs=kwargs, throw=True)
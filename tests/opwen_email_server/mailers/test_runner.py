@@ -0,0 +1,85 @@
+from asyncio import sleep as async_sleep
+from threading import Barrier
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.mailers.echo import EchoEmailFormatter
+from opwen_email_server.mailers.runner import MailerRunner
+from opwen_email_server.mailers.runner import is_async_mailer
+
+
+class AsyncMailer:
+    def __init__(self, subject: str):
+        self.subject = subject
+
+    async def __call__(self, email: dict) -> dict:
+        await async_sleep(0)
+        email['subject'] = self.subject
+        return email
+
+
+class IsAsyncMailerTests(TestCase):
+    def test_detects_async_callables(self):
+        self.assertTrue(is_async_mailer(AsyncMailer('foo')))
+        self.assertTrue(is_async_mailer(EchoEmailFormatter()))
+
+    def test_detects_sync_callables(self):
+        self.assertFalse(is_async_mailer(lambda email: email))
+
+
+class MailerRunnerTests(TestCase):
+    def test_skips_unknown_mailers(self):
+        runner = MailerRunner({})
+
+        formatted = runner({'to': ['unknown@bot.lokole.ca']})
+
+        self.assertEqual(formatted, [])
+
+    def test_runs_async_and_sync_mailers(self):
+        runner = MailerRunner({
+            'async@bot.lokole.ca': AsyncMailer('async'),
+            'sync@bot.lokole.ca': self._sync_mailer('sync'),
+        })
+        email = {'to': ['async@bot.lokole.ca', 'sync@bot.lokole.ca'], 'subject': 'original'}
+
+        formatted = runner(email)
+
+        self.assertEqual([formatted_email['subject'] for formatted_email in formatted], ['async', 'sync'])
+        self.assertEqual(email['subject'], 'original')
+
+    def test_runs_sync_mailers_concurrently(self):
+        barrier = Barrier(2, timeout=5)
+
+        def mailer(email: dict) -> dict:
+            barrier.wait()
+            return email
+
+        runner = MailerRunner({'a@bot.lokole.ca': mailer, 'b@bot.lokole.ca': mailer}, max_workers=2)
+
+        formatted = runner({'to': ['a@bot.lokole.ca', 'b@bot.lokole.ca']})
+
+        self.assertEqual(len(formatted), 2)
+
+    def test_cleans_up_results_when_a_mailer_fails(self):
+        def failing_mailer(email: dict) -> dict:
+            raise ValueError('mailer failed')
+
+        runner = MailerRunner({
+            'ok@bot.lokole.ca': self._sync_mailer('ok'),
+            'failing@bot.lokole.ca': failing_mailer,
+        })
+
+        with patch('opwen_email_server.mailers.runner.remove_spooled_attachments') as mock_remove:
+            with self.assertRaises(ValueError):
+                runner({'to': ['ok@bot.lokole.ca', 'failing@bot.lokole.ca']})
+
+        mock_remove.assert_called_once()
+        self.assertEqual(mock_remove.call_args[0][0]['subject'], 'ok')
+
+    @classmethod
+    def _sync_mailer(cls, subject: str):
+        def mailer(email: dict) -> dict:
+            email['subject'] = subject
+            return email
+
+        return mailer
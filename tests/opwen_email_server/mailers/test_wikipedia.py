@@ -1,13 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from tempfile import TemporaryDirectory
+from time import sleep
+from typing import Union
 from unittest import TestCase
 from unittest.mock import Mock
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
+from requests import ReadTimeout
+from requests import get
 from responses import mock as mock_responses
 from wikipedia.exceptions import DisambiguationError
 from wikipedia.exceptions import PageError
 
 from opwen_email_server.mailers.wikipedia import WikipediaEmailFormatter
+from opwen_email_server.utils.cache import FileCache
+from opwen_email_server.utils.email_parser import remove_spooled_attachments
 from tests.opwen_email_server.helpers import throw
 
 
@@ -17,6 +26,13 @@ class WikipediaServiceTests(TestCase):
         self.languages = MagicMock()
         self.language_setter = Mock()
         self.page_fetch = Mock()
+        self.pdf_cache_dir = TemporaryDirectory()
+        self.addCleanup(self.pdf_cache_dir.cleanup)
+        self.pdf_cache = FileCache(self.pdf_cache_dir.name, max_bytes=1024)
+        self.formatter = WikipediaEmailFormatter(languages_getter=self.languages,
+                                                 language_setter=self.language_setter,
+                                                 page_fetch=self.page_fetch,
+                                                 pdf_cache=self.pdf_cache)
 
     def test_no_results(self):
         email = {
@@ -40,28 +56,111 @@ class WikipediaServiceTests(TestCase):
 
         self.assertEqual(result_email['subject'], 'Suggested Searches')
 
+    def test_fetches_pages_in_their_own_language(self):
+        current = []
+        fetched = []
+
+        def fetch_page(query):
+            sleep(0.01)
+            fetched.append((query, current[-1]))
+            raise PageError(query)
+
+        self.languages.return_value = {'en': 'English', 'fr': 'French'}
+        self.language_setter.side_effect = current.append
+        self.page_fetch.side_effect = fetch_page
+
+        emails = [self._new_email(f'{language}-{i}', language) for i in range(4) for language in ('en', 'fr')]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(self._execute_format, emails))
+
+        self.assertEqual(len(fetched), 8)
+        for query, language in fetched:
+            self.assertEqual(query.split('-')[0], language)
+
     @mock_responses.activate
     def test_returned_article(self):
-        email = {
-            'to': ['wikipedia@bot.lokole.ca'], 'from': 'user@lokole.ca', 'subject': 'en', 'body': 'Linear Regression',
-            'sent_at': '2020-02-01 21:17'
-        }
-        self.page_fetch.return_value = Mock(title='Linear regression',
-                                            url='https://en.wikipedia.org/wiki/Linear_regression')
-        mock_responses.add(mock_responses.GET,
-                           'https://en.wikipedia.org/api/rest_v1/page/pdf/Linear_regression',
-                           body=b'some bytes',
-                           status=200,
-                           content_type='application/json')
+        self._given_article(b'some bytes')
 
-        result_email = self._execute_format(email)
+        result_email = self._execute_format(self._new_email('Linear Regression'))
 
         self.assertEqual('Linear regression', result_email['subject'])
         self.assertEqual('Linear regression.pdf', result_email['attachments'][0]['filename'])
+        self.assertEqual(b'some bytes', result_email['attachments'][0]['content'].read())
 
-    def _execute_format(self, *args, **kwargs):
+    @mock_responses.activate
+    def test_serves_repeat_requests_from_cache(self):
+        self._given_article(b'some bytes')
+
+        self._execute_format(self._new_email('Linear Regression'))
+        result_email = self._execute_format(self._new_email('Linear Regression'))
+
+        self.assertEqual(b'some bytes', result_email['attachments'][0]['content'].read())
+        self.assertEqual(len(mock_responses.calls), 1)
+        self.assertEqual(self.page_fetch.call_count, 1)
+        self.assertEqual(self.languages.call_count, 1)
+
+    @mock_responses.activate
+    def test_does_not_cache_failed_downloads(self):
+        self._given_article(b'error', status=500)
+
+        self._execute_format(self._new_email('Linear Regression'))
+        self._execute_format(self._new_email('Linear Regression'))
+
+        self.assertEqual(len(mock_responses.calls), 2)
+
+    @mock_responses.activate
+    def test_does_not_attach_failed_downloads(self):
+        self._given_article(b'<html>error</html>', status=503)
+
+        result_email = self._execute_format(self._new_email('Linear Regression'))
+
+        self.assertEqual('Linear regression', result_email['subject'])
+        self.assertNotIn('attachments', result_email)
+        self.assertIsNone(self.pdf_cache.get('en/Linear regression', '.pdf'))
+
+    @mock_responses.activate
+    def test_does_not_attach_timed_out_downloads(self):
+        self._given_article(ReadTimeout())
+
+        result_email = self._execute_format(self._new_email('Linear Regression'))
+
+        self.assertEqual('Unable to download the article. Please try again later.', result_email['body'])
+        self.assertNotIn('attachments', result_email)
+        self.assertIsNone(self.pdf_cache.get('en/Linear regression', '.pdf'))
+
+    @mock_responses.activate
+    def test_downloads_with_timeout(self):
         formatter = WikipediaEmailFormatter(languages_getter=self.languages,
                                             language_setter=self.language_setter,
-                                            page_fetch=self.page_fetch)
+                                            page_fetch=self.page_fetch,
+                                            pdf_cache=self.pdf_cache,
+                                            pdf_connect_timeout_seconds=1,
+                                            pdf_read_timeout_seconds=2)
+        self._given_article(b'%PDF')
+
+        with patch('opwen_email_server.mailers.wikipedia.get', wraps=get) as mock_get:
+            email = formatter(self._new_email('Linear Regression'))
+            self.addCleanup(remove_spooled_attachments, email)
 
-        return formatter(*args, **kwargs)
+        self.assertEqual(mock_get.call_args[1]['timeout'], (1, 2))
+
+    def _given_article(self, content: Union[bytes, Exception], status: int = 200):
+        self.page_fetch.return_value = Mock(title='Linear regression',
+                                            url='https://en.wikipedia.org/wiki/Linear_regression')
+        mock_responses.add(mock_responses.GET,
+                           'https://en.wikipedia.org/api/rest_v1/page/pdf/Linear_regression',
+                           body=content,
+                           status=status,
+                           content_type='application/pdf')
+
+    @classmethod
+    def _new_email(cls, query: str, language: str = 'en') -> dict:
+        return {
+            'to': ['wikipedia@bot.lokole.ca'], 'from': 'user@lokole.ca', 'subject': language, 'body': query, 'sent_at':
+            '2020-02-01 21:17'
+        }
+
+    def _execute_format(self, *args, **kwargs):
+        email = self.formatter(*args, **kwargs)
+        self.addCleanup(remove_spooled_attachments, email)
+        return email
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 from shutil import rmtree
 from tempfile import mkdtemp
+from threading import Event
 from unittest import TestCase
+from unittest.mock import patch
 
 from connexion.decorators.security import validate_scope
 from responses import mock as mock_responses
@@ -142,6 +145,50 @@ class GithubAuthTests(TestCase):
         self.assertEqual(user['sub']['name'], 'user')
         self.assertTrue(validate_scope(['team3'], user['scope']))
 
+    @mock_responses.activate
+    def test_caches_user_by_token(self):
+        mock_responses.add(
+            mock_responses.POST,
+            github.GRAPHQL_URL,
+            json={'data': {'viewer': {'login': 'user', 'organization': {'teams': {'edges': [], 'nodes': []}}}}},
+            status=200,
+        )
+
+        first = self._auth(access_token='token')
+        second = self._auth(access_token='token')
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(mock_responses.calls), 1)
+
+    @mock_responses.activate
+    def test_does_not_cache_failures(self):
+        mock_responses.add(
+            mock_responses.POST,
+            github.GRAPHQL_URL,
+            json={'message': 'Bad credentials'},
+            status=401,
+        )
+
+        self.assertIsNone(self._auth(access_token='token'))
+        self.assertIsNone(self._auth(access_token='token'))
+
+        self.assertEqual(len(mock_responses.calls), 2)
+
+    @mock_responses.activate
+    def test_cache_expires(self):
+        auth = GithubAuth(organization='organization', cache_ttl_seconds=0)
+        mock_responses.add(
+            mock_responses.POST,
+            github.GRAPHQL_URL,
+            json={'data': {'viewer': {'login': 'user', 'organization': {'teams': {'edges': [], 'nodes': []}}}}},
+            status=200,
+        )
+
+        auth(access_token='token')
+        auth(access_token='token')
+
+        self.assertEqual(len(mock_responses.calls), 2)
+
 
 class AzureAuthTests(TestCase):
     def setUp(self):
@@ -184,6 +231,74 @@ class AzureAuthTests(TestCase):
         self.assertTrue(self._auth.is_owner('domain', {'name': 'owner'}))
         self.assertTrue(self._auth.is_owner('domain', {'name': 'sudo', 'scopes': ['sudo']}))
 
+    def test_caches_lookups(self):
+        self._auth.insert('client', 'domain', {'name': 'owner'})
+
+        with patch.object(self._storage, 'fetch_object', wraps=self._storage.fetch_object) as fetch_object:
+            self.assertEqual(self._auth.domain_for('client'), 'domain')
+            self.assertEqual(self._auth.domain_for('client'), 'domain')
+            self.assertEqual(self._auth.client_id_for('domain'), 'client')
+            self.assertTrue(self._auth.is_owner('domain', {'name': 'owner'}))
+
+        self.assertEqual(fetch_object.call_count, 3)
+
+    def test_caches_unknown_clients(self):
+        with patch.object(self._storage, 'fetch_object', wraps=self._storage.fetch_object) as fetch_object:
+            self.assertIsNone(self._auth.domain_for('unknown-client'))
+            self.assertIsNone(self._auth.domain_for('unknown-client'))
+
+        self.assertEqual(fetch_object.call_count, 2)
+
+    def test_insert_invalidates_unknown_clients(self):
+        self.assertIsNone(self._auth.domain_for('client'))
+        self.assertIsNone(self._auth.client_id_for('domain'))
+
+        self._auth.insert('client', 'domain', {'name': 'owner'})
+
+        self.assertEqual(self._auth.domain_for('client'), 'domain')
+        self.assertEqual(self._auth.client_id_for('domain'), 'client')
+
+    def test_negative_cache_expires(self):
+        auth = AzureAuth(storage=self._storage, sudo_scope='sudo', cache_negative_ttl_seconds=0)
+        self.assertIsNone(auth.domain_for('client'))
+
+        self._auth.insert('client', 'domain', {'name': 'owner'})
+
+        self.assertEqual(auth.domain_for('client'), 'domain')
+
+    def test_other_instance_invalidates_cache(self):
+        worker = AzureAuth(storage=self._storage, sudo_scope='sudo')
+        api = AzureAuth(storage=self._storage, sudo_scope='sudo', cache_check_seconds=0)
+
+        worker.insert('client', 'domain', {'name': 'owner'})
+        self.assertEqual(api.client_id_for('domain'), 'client')
+
+        worker.delete('client', 'domain')
+        self.assertIsNone(api.client_id_for('domain'))
+
+    def test_coalesces_concurrent_lookups(self):
+        self._auth.insert('client', 'domain', {'name': 'owner'})
+        self.assertIsNone(self._auth.domain_for('unknown-client'))
+        fetch_object = self._storage.fetch_object
+        started = Event()
+        release = Event()
+
+        def slow_fetch_object(resource_id):
+            started.set()
+            release.wait()
+            return fetch_object(resource_id)
+
+        with patch.object(self._storage, 'fetch_object', side_effect=slow_fetch_object) as slow_fetch:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                first = executor.submit(self._auth.domain_for, 'client')
+                started.wait()
+                others = [executor.submit(self._auth.domain_for, 'client') for _ in range(3)]
+                release.set()
+                results = [future.result() for future in [first] + others]
+
+        self.assertEqual(results, ['domain'] * 4)
+        self.assertEqual(slow_fetch.call_count, 1)
+
 
 class NoAuthTests(TestCase):
     def setUp(self):
@@ -0,0 +1,99 @@
+from os import mkdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.services.counters import DomainCounters
+from opwen_email_server.services.storage import AzureObjectStorage
+
+
+class DomainCountersTests(TestCase):
+    domain = 'test.lokole.ca'
+
+    def test_get_missing_counter(self):
+        self.assertIsNone(self._counters.get(self.domain, 'users'))
+
+    def test_reconcile(self):
+        value = self._counters.reconcile(self.domain, 'users', 3)
+
+        self.assertEqual(value, 3)
+        self.assertEqual(self._counters.get(self.domain, 'users').value, 3)
+
+    def test_increment(self):
+        self._counters.reconcile(self.domain, 'users', 1)
+
+        self._counters.increment(self.domain, 'users', 2)
+        self._counters.increment(self.domain, 'users')
+
+        self.assertEqual(self._counters.get(self.domain, 'users').value, 4)
+
+    def test_increment_retries_on_concurrent_write(self):
+        self._counters.reconcile(self.domain, 'users', 1)
+        fetch_versioned_object = self._storage.fetch_versioned_object
+        raced = []
+
+        def racing_fetch_versioned_object(resource_id):
+            fetched = fetch_versioned_object(resource_id)
+            if not raced:
+                raced.append(True)
+                self._counters.increment(self.domain, 'users', 5)
+            return fetched
+
+        with patch.object(self._storage, 'fetch_versioned_object', side_effect=racing_fetch_versioned_object):
+            self._counters.increment(self.domain, 'users', 2)
+
+        self.assertEqual(self._counters.get(self.domain, 'users').value, 8)
+
+    def test_increment_does_not_go_negative(self):
+        self._counters.reconcile(self.domain, 'users', 1)
+
+        self._counters.increment(self.domain, 'users', -3)
+
+        self.assertEqual(self._counters.get(self.domain, 'users').value, 0)
+
+    def test_increment_skips_unreconciled_counter(self):
+        self._counters.increment(self.domain, 'users')
+
+        self.assertIsNone(self._counters.get(self.domain, 'users'))
+
+    def test_increment_keeps_reconciled_at(self):
+        self._counters.reconcile(self.domain, 'users', 0)
+        reconciled_at = self._counters.get(self.domain, 'users').reconciled_at
+
+        self._counters.increment(self.domain, 'users')
+
+        self.assertEqual(self._counters.get(self.domain, 'users').reconciled_at, reconciled_at)
+
+    def test_is_stale(self):
+        self._counters.reconcile(self.domain, 'users', 0)
+        counter = self._counters.get(self.domain, 'users')
+
+        self.assertFalse(self._counters.is_stale(counter))
+        self.assertTrue(self._counters.is_stale(counter._replace(reconciled_at=counter.reconciled_at - 61)))
+
+    def test_delete_domain(self):
+        self._counters.reconcile(self.domain, 'users', 1)
+        self._counters.reconcile('other.lokole.ca', 'users', 1)
+
+        self._counters.delete_domain(self.domain)
+
+        self.assertIsNone(self._counters.get(self.domain, 'users'))
+        self.assertIsNotNone(self._counters.get('other.lokole.ca', 'users'))
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+            case_sensitive=False,
+        )
+        self._counters = DomainCounters(self._storage, reconcile_interval_seconds=60)
+
+    def tearDown(self):
+        rmtree(self._folder)
@@ -0,0 +1,254 @@
+from os import mkdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.services.index import MailboxIndex
+from opwen_email_server.services.index import SearchIndex
+from opwen_email_server.services.storage import AzureObjectStorage
+
+
+class MailboxIndexTests(TestCase):
+    address = 'foo@test.lokole.ca'
+    folder = 'received'
+
+    def test_iterates_empty_mailbox(self):
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), [])
+
+    def test_iterates_entries_sorted(self):
+        self._index.add(self.address, self.folder, '200', 'b', {'subject': 'b'})
+        self._index.add(self.address, self.folder, '100', 'a', {'subject': 'a'})
+        self._index.add(self.address, self.folder, '300', 'c', {'subject': 'c'})
+
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), [
+            ('100', 'a', {'subject': 'a'}),
+            ('200', 'b', {'subject': 'b'}),
+            ('300', 'c', {'subject': 'c'}),
+        ])
+
+    def test_iterates_after_cursor(self):
+        for i in range(9):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+        self._index.add(self.address, self.folder, '0045', 'x', {})
+
+        entries = list(self._index.iter(self.address, self.folder, after=('004', '4')))
+
+        self.assertEqual([email_id for _, email_id, _ in entries], ['x', '5', '6', '7', '8'])
+
+    def test_iterates_after_cursor_from_matching_segment(self):
+        for i in range(9):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+        self._index.compact(self.address, self.folder)
+        fetched = []
+        fetch_object = self._storage.fetch_object
+
+        def fetch_object_spy(resource_id):
+            fetched.append(resource_id)
+            return fetch_object(resource_id)
+
+        with patch.object(self._storage, 'fetch_object', side_effect=fetch_object_spy):
+            entries = self._index.iter(self.address, self.folder, after=('005', '5'))
+            self.assertEqual(next(entries)[1], '6')
+
+        self.assertEqual(len([resource_id for resource_id in fetched if '/segments/' in resource_id]), 1)
+
+    def test_separates_mailboxes(self):
+        self._index.add(self.address, self.folder, '100', 'a', {})
+        self._index.add(self.address, 'sent', '200', 'b', {})
+        self._index.add('bar@test.lokole.ca', self.folder, '300', 'c', {})
+
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), [('100', 'a', {})])
+
+    def test_removes_entries(self):
+        self._index.add(self.address, self.folder, '100', 'a', {})
+        self._index.add(self.address, self.folder, '200', 'b', {})
+
+        self._index.remove(self.address, self.folder, '100', 'a')
+
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), [('200', 'b', {})])
+
+    def test_compacts_deltas_into_segments(self):
+        for i in range(10):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+        self._index.remove(self.address, self.folder, '005', '5')
+
+        entries = list(self._index.iter(self.address, self.folder))
+
+        self.assertEqual([email_id for _, email_id, _ in entries], ['0', '1', '2', '3', '4', '6', '7', '8', '9'])
+        self.assertLess(sum(1 for _ in self._storage.iter(f'test.lokole.ca/{self.address}/{self.folder}/deltas/')), 3)
+        manifest = self._storage.fetch_object(f'test.lokole.ca/{self.address}/{self.folder}/manifest')
+        self.assertEqual(manifest['counts'], [1, 2, 2, 2, 2])
+        self.assertEqual(manifest['entries'], 9)
+
+    def test_compaction_keeps_entries_stable(self):
+        for i in range(5):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+        before = list(self._index.iter(self.address, self.folder))
+
+        self._index.compact(self.address, self.folder)
+        self._index.compact(self.address, self.folder)
+        self._index.compact(self.address, self.folder)
+
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), before)
+        self.assertEqual(sum(1 for _ in self._storage.iter(f'test.lokole.ca/{self.address}/{self.folder}/segments/')),
+                         4)
+
+    def test_compaction_only_rewrites_segments_with_deltas(self):
+        for i in range(10, 19):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+        self._index.compact(self.address, self.folder)
+        before = self._storage.fetch_object(f'test.lokole.ca/{self.address}/{self.folder}/manifest')['segments']
+
+        self._index.add(self.address, self.folder, '001', 'new', {})
+        self._index.compact(self.address, self.folder)
+
+        after = self._storage.fetch_object(f'test.lokole.ca/{self.address}/{self.folder}/manifest')['segments']
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[1:], before[1:])
+        self.assertEqual(next(self._index.iter(self.address, self.folder))[1], 'new')
+
+    def test_discards_compaction_when_manifest_changed(self):
+        for i in range(2):
+            self._index.add(self.address, self.folder, f'{i:03d}', str(i), {})
+
+        with patch.object(self._storage, 'store_versioned_object', return_value=False):
+            self._index.compact(self.address, self.folder)
+
+        self.assertEqual(sum(1 for _ in self._storage.iter(f'test.lokole.ca/{self.address}/{self.folder}/segments/')),
+                         0)
+        self.assertEqual(sum(1 for _ in self._storage.iter(f'test.lokole.ca/{self.address}/{self.folder}/deltas/')), 2)
+        self.assertEqual(len(list(self._index.iter(self.address, self.folder))), 2)
+
+    def test_deletes_domain(self):
+        self._index.add(self.address, self.folder, '100', 'a', {})
+        self._index.add('bar@other.lokole.ca', self.folder, '100', 'a', {})
+
+        self._index.delete_domain('test.lokole.ca')
+
+        self.assertEqual(list(self._index.iter(self.address, self.folder)), [])
+        self.assertEqual(len(list(self._index.iter('bar@other.lokole.ca', self.folder))), 1)
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+            case_sensitive=False,
+        )
+        self._index = MailboxIndex(self._storage, max_deltas=3, segment_size=2)
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class SearchIndexTests(TestCase):
+    address = 'foo@test.lokole.ca'
+
+    def test_searches_empty_index(self):
+        self.assertEqual(self._index.search(self.address, 'hello'), [])
+
+    def test_searches_without_terms(self):
+        self._index.add(self.address, '100', 'a', {}, ['hello'])
+
+        self.assertEqual(self._index.search(self.address, ' ! '), [])
+
+    def test_intersects_terms(self):
+        self._index.add(self.address, '100', 'a', {'subject': 'a'}, ['hello', 'world'])
+        self._index.add(self.address, '200', 'b', {'subject': 'b'}, ['hello'])
+        self._index.add(self.address, '300', 'c', {'subject': 'c'}, ['world', 'hello', 'again'])
+
+        self.assertEqual(self._index.search(self.address, 'World HELLO'), [
+            ('100', 'a', {'subject': 'a'}),
+            ('300', 'c', {'subject': 'c'}),
+        ])
+
+    def test_pages_results(self):
+        for i in range(7):
+            self._index.add(self.address, f'{i:03d}', str(i), {}, ['hello'])
+
+        entries = self._index.search(self.address, 'hello', offset=2, limit=3)
+
+        self.assertEqual([email_id for _, email_id, _ in entries], ['2', '3', '4'])
+
+    def test_removes_entries(self):
+        for i in range(5):
+            self._index.add(self.address, f'{i:03d}', str(i), {}, ['hello'])
+        self._index.remove(self.address, '001', '1')
+        self._index.remove(self.address, '004', '4')
+
+        entries = self._index.search(self.address, 'hello')
+
+        self.assertEqual([email_id for _, email_id, _ in entries], ['0', '2', '3'])
+
+    def test_separates_mailboxes(self):
+        self._index.add(self.address, '100', 'a', {}, ['hello'])
+        self._index.add('bar@test.lokole.ca', '200', 'b', {}, ['hello'])
+
+        self.assertEqual(self._index.search(self.address, 'hello'), [('100', 'a', {})])
+
+    def test_compaction_keeps_results_stable(self):
+        for i in range(5):
+            self._index.add(self.address, f'{i:03d}', str(i), {'subject': str(i)}, ['hello', f'term{i}'])
+        before = self._index.search(self.address, 'hello')
+
+        self._index.compact(self.address)
+        self._index.compact(self.address)
+
+        self.assertEqual(self._index.search(self.address, 'hello'), before)
+        self.assertEqual(self._index.search(self.address, 'term3'), [('003', '3', {'subject': '3'})])
+        self.assertEqual(sum(1 for _ in self._storage.iter(f'test.lokole.ca/{self.address}/search/deltas/')), 0)
+
+    def test_compaction_only_rewrites_buckets_with_deltas(self):
+        for i in range(5):
+            self._index.add(self.address, f'{i:03d}', str(i), {}, [f'term{i}'])
+        self._index.compact(self.address)
+        before = self._storage.fetch_object(f'test.lokole.ca/{self.address}/search/manifest')
+
+        self._index.remove(self.address, '002', '2')
+        self._index.compact(self.address)
+
+        after = self._storage.fetch_object(f'test.lokole.ca/{self.address}/search/manifest')
+        self.assertEqual(sum(1 for old, new in zip(before['terms'], after['terms']) if old != new), 1)
+        self.assertEqual(sum(1 for old, new in zip(before['docs'], after['docs']) if old != new), 1)
+        self.assertEqual(after['entries'], 4)
+        self.assertEqual(self._index.search(self.address, 'term2'), [])
+        self.assertEqual(self._index.search(self.address, 'term3'), [('003', '3', {})])
+
+    def test_search_does_not_read_other_buckets(self):
+        for i in range(5):
+            self._index.add(self.address, f'{i:03d}', str(i), {}, [f'term{i}'])
+        self._index.compact(self.address)
+        fetched = []
+        fetch_object = self._storage.fetch_object
+
+        def fetch_object_spy(resource_id):
+            fetched.append(resource_id)
+            return fetch_object(resource_id)
+
+        with patch.object(self._storage, 'fetch_object', side_effect=fetch_object_spy):
+            self._index.search(self.address, 'term2')
+
+        self.assertEqual(len([resource_id for resource_id in fetched if '/terms/' in resource_id]), 1)
+        self.assertEqual(len([resource_id for resource_id in fetched if '/docs/' in resource_id]), 1)
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+            case_sensitive=False,
+        )
+        self._index = SearchIndex(self._storage, max_deltas=3, num_buckets=4)
+
+    def tearDown(self):
+        rmtree(self._folder)
@@ -0,0 +1,319 @@
+from json import loads
+from os.path import join
+from re import compile as re_compile
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase
+
+from libcloud.common.types import LibcloudError
+from libcloud.storage.types import ObjectDoesNotExistError
+from responses import mock as mock_responses
+
+from opwen_email_server.services.index_store import AzureTableIndexStore
+from opwen_email_server.services.index_store import SqliteIndexStore
+from opwen_email_server.utils.serialization import to_base64
+from opwen_email_server.utils.serialization import to_msgpack_bytes
+
+
+class SqliteIndexStoreTests(TestCase):
+    def test_stores_fetches_and_deletes_text(self):
+        self._store.store_text('domain/id1', 'pending')
+
+        self.assertEqual(self._store.fetch_text('domain/id1'), 'pending')
+        self.assertTrue(self._store.exists('domain/id1'))
+
+        self._store.delete('domain/id1')
+
+        self.assertFalse(self._store.exists('domain/id1'))
+        with self.assertRaises(ObjectDoesNotExistError):
+            self._store.fetch_text('domain/id1')
+
+    def test_stores_and_fetches_objects(self):
+        self._store.store_object('domain/id1', {'a': 1, 'b': [b'c']})
+
+        self.assertEqual(self._store.fetch_object('domain/id1'), {'a': 1, 'b': [b'c']})
+
+    def test_store_object_overwrites(self):
+        self._store.store_object('domain/id1', {'a': 1})
+        self._store.store_object('domain/id1', {'a': 2})
+
+        self.assertEqual(self._store.fetch_object('domain/id1'), {'a': 2})
+        self.assertEqual(self._store.count(), 1)
+
+    def test_delete_missing(self):
+        self._store.delete('domain/missing')
+
+    def test_stores_versioned_objects(self):
+        self.assertTrue(self._store.store_versioned_object('domain/manifest', {'a': 1}, None))
+        self.assertFalse(self._store.store_versioned_object('domain/manifest', {'a': 2}, None))
+
+        obj, version = self._store.fetch_versioned_object('domain/manifest')
+        self.assertEqual(obj, {'a': 1})
+
+        self.assertTrue(self._store.store_versioned_object('domain/manifest', {'a': 3}, version))
+        self.assertFalse(self._store.store_versioned_object('domain/manifest', {'a': 4}, version))
+        self.assertEqual(self._store.fetch_object('domain/manifest'), {'a': 3})
+
+    def test_store_many(self):
+        self._store.store_many([('domain/a', {'a': 1}), ('domain/b', {'b': 2})])
+        self._store.store_many([])
+
+        self.assertEqual(self._store.fetch_object('domain/a'), {'a': 1})
+        self.assertEqual(self._store.fetch_object('domain/b'), {'b': 2})
+
+    def test_iter_and_count_by_prefix(self):
+        for key in ('a.com/3', 'a.com/1', 'a.comx/1', 'b.com/1', 'a.co/1'):
+            self._store.store_text(key, 'pending')
+
+        self.assertEqual(list(self._store.iter('a.com/')), ['1', '3'])
+        self.assertEqual(self._store.count('a.com/'), 2)
+        self.assertEqual(self._store.count(), 5)
+        self.assertEqual(list(self._store.iter()), ['a.co/1', 'a.com/1', 'a.com/3', 'a.comx/1', 'b.com/1'])
+
+    def test_mark(self):
+        self._store.mark('domain/id1')
+
+        self.assertTrue(self._store.exists('domain/id1'))
+        self.assertEqual(self._store.fetch_text('domain/id1'), '')
+        self.assertEqual(list(self._store.iter('domain/')), ['id1'])
+
+    def test_delete_many_and_prefix(self):
+        for key in ('a.com/1', 'a.com/2', 'a.comx/1', 'b.com/1'):
+            self._store.store_text(key, 'pending')
+
+        self.assertEqual(self._store.delete_many(['b.com/1', 'b.com/missing']), 1)
+        self.assertEqual(self._store.delete_prefix('a.com/'), 2)
+        self.assertEqual(list(self._store.iter()), ['a.comx/1'])
+
+    def test_case_insensitive(self):
+        store = SqliteIndexStore(path=self._path, table='users', case_sensitive=False)
+
+        store.store_object('Domain/Foo@Domain', {'a': 1})
+
+        self.assertEqual(store.fetch_object('domain/foo@domain'), {'a': 1})
+        self.assertEqual(list(store.iter('DOMAIN/')), ['foo@domain'])
+
+    def test_tables_are_independent(self):
+        other = SqliteIndexStore(path=self._path, table='other')
+
+        self._store.store_text('domain/id1', 'pending')
+
+        self.assertFalse(other.exists('domain/id1'))
+        self.assertEqual(other.count(), 0)
+
+    def test_is_usable_from_multiple_threads(self):
+        def store(i):
+            self._store.store_text(f'domain/{i}', 'pending')
+
+        threads = [Thread(target=store, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self._store.count('domain/'), 8)
+
+    def test_rejects_invalid_table(self):
+        with self.assertRaises(ValueError):
+            SqliteIndexStore(path=self._path, table='a"b')
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._path = join(self._folder, 'index.sqlite3')
+        self._store = SqliteIndexStore(path=self._path, table='pending')
+        self._store.ensure_exists()
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class AzureTableIndexStoreTests(TestCase):
+    base_url = 'http://azurite:10002/lokolestorage'
+
+    @mock_responses.activate
+    def test_stores_and_fetches_text(self):
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'id1'), status=204)
+        mock_responses.add(mock_responses.GET,
+                           self._entity_url('domain', 'id1'),
+                           json={'Value0': to_base64(b'pending')})
+
+        self._store.store_text('domain/id1', 'pending')
+        text = self._store.fetch_text('domain/id1')
+
+        self.assertEqual(text, 'pending')
+        put = mock_responses.calls[1].request
+        self.assertEqual(loads(put.body)['PartitionKey'], 'domain')
+        self.assertEqual(loads(put.body)['RowKey'], 'id1')
+        self.assertTrue(put.headers['Authorization'].startswith('SharedKeyLite lokolestorage:'))
+
+    @mock_responses.activate
+    def test_mark_stores_entity_without_value(self):
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'id1'), status=204)
+
+        self._store.mark('domain/id1')
+
+        self.assertEqual(loads(mock_responses.calls[1].request.body), {'PartitionKey': 'domain', 'RowKey': 'id1'})
+
+    @mock_responses.activate
+    def test_fetch_missing(self):
+        mock_responses.add(mock_responses.GET, self._entity_url('domain', 'id1'), status=404)
+
+        with self.assertRaises(ObjectDoesNotExistError):
+            self._store.fetch_object('domain/id1')
+
+        self.assertFalse(self._store.exists('domain/id1'))
+
+    @mock_responses.activate
+    def test_fetches_versioned_object(self):
+        mock_responses.add(mock_responses.GET,
+                           self._entity_url('domain', 'manifest'),
+                           json={'Value0': to_base64(to_msgpack_bytes({'a': 1}))},
+                           headers={'ETag': 'W/"etag1"'})
+
+        obj, version = self._store.fetch_versioned_object('domain/manifest')
+
+        self.assertEqual(obj, {'a': 1})
+        self.assertEqual(version, 'W/"etag1"')
+
+    @mock_responses.activate
+    def test_stores_versioned_object_if_version_matches(self):
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'manifest'), status=204)
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'manifest'), status=412)
+
+        self.assertTrue(self._store.store_versioned_object('domain/manifest', {'a': 1}, 'W/"etag1"'))
+        self.assertFalse(self._store.store_versioned_object('domain/manifest', {'a': 2}, 'W/"etag1"'))
+        self.assertEqual(mock_responses.calls[1].request.headers['If-Match'], 'W/"etag1"')
+
+    @mock_responses.activate
+    def test_inserts_versioned_object_if_missing(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/pendingemails', status=204)
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/pendingemails', status=409)
+
+        self.assertTrue(self._store.store_versioned_object('domain/manifest', {'a': 1}, None))
+        self.assertFalse(self._store.store_versioned_object('domain/manifest', {'a': 1}, None))
+
+    @mock_responses.activate
+    def test_splits_large_values_across_properties(self):
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'id1'), status=204)
+
+        self._store.store_text('domain/id1', 'a' * 100000)
+
+        entity = loads(mock_responses.calls[1].request.body)
+        self.assertIn('Value1', entity)
+        self.assertNotIn('Value2', entity)
+        self.assertEqual(entity['Value0@odata.type'], 'Edm.Binary')
+
+    @mock_responses.activate
+    def test_escapes_keys(self):
+        mock_responses.add(mock_responses.PUT, self._entity_url('domain', 'a%252Fb%2523c'), status=204)
+        mock_responses.add(mock_responses.GET,
+                           re_compile(r'.*/pendingemails\(\)\?.*'),
+                           json={'value': [{'PartitionKey': 'domain', 'RowKey': 'a%2Fb%23c'}]})
+
+        self._store.store_text('domain/a/b#c', 'pending')
+
+        self.assertEqual(loads(mock_responses.calls[1].request.body)['RowKey'], 'a%2Fb%23c')
+        self.assertEqual(list(self._store.iter('domain/')), ['a/b#c'])
+
+    @mock_responses.activate
+    def test_iter_follows_continuation(self):
+        mock_responses.add(mock_responses.GET,
+                           re_compile(r'.*/pendingemails\(\)\?.*'),
+                           json={'value': [{'PartitionKey': 'domain', 'RowKey': '1'}]},
+                           headers={
+                               'x-ms-continuation-NextPartitionKey': 'domain',
+                               'x-ms-continuation-NextRowKey': '2',
+                           })
+        mock_responses.add(mock_responses.GET,
+                           re_compile(r'.*/pendingemails\(\)\?.*'),
+                           json={'value': [{'PartitionKey': 'domain', 'RowKey': '2'}]})
+
+        resource_ids = list(self._store.iter('domain/'))
+
+        self.assertEqual(resource_ids, ['1', '2'])
+        self.assertIn("PartitionKey eq 'domain'", mock_responses.calls[1].request.params['$filter'])
+        self.assertEqual(mock_responses.calls[2].request.params['NextRowKey'], '2')
+
+    @mock_responses.activate
+    def test_count(self):
+        mock_responses.add(mock_responses.GET,
+                           re_compile(r'.*/pendingemails\(\)\?.*'),
+                           json={'value': [{'PartitionKey': 'domain', 'RowKey': str(i)} for i in range(3)]})
+
+        self.assertEqual(self._store.count('domain/'), 3)
+
+    @mock_responses.activate
+    def test_store_many_batches_per_partition(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(204))
+
+        self._store.store_many([(f'a.com/{i}', {'i': i}) for i in range(150)] + [('b.com/1', {'i': 1})])
+
+        batches = [call.request for call in mock_responses.calls[1:]]
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(batches[0].body.count(b'PUT '), 100)
+        self.assertEqual(batches[1].body.count(b'PUT '), 50)
+        self.assertEqual(batches[2].body.count(b'PUT '), 1)
+
+    @mock_responses.activate
+    def test_store_many_raises_on_failed_batch(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(400))
+
+        with self.assertRaises(LibcloudError):
+            self._store.store_many([('a.com/1', {'i': 1})])
+
+    @mock_responses.activate
+    def test_delete_many(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(204))
+
+        num_deleted = self._store.delete_many(['a.com/1', 'a.com/2'])
+
+        self.assertEqual(num_deleted, 2)
+        self.assertEqual(len(mock_responses.calls), 2)
+        self.assertEqual(mock_responses.calls[1].request.body.count(b'If-Match: *'), 2)
+
+    @mock_responses.activate
+    def test_delete_many_falls_back_to_single_deletes(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(404))
+        mock_responses.add(mock_responses.DELETE, self._entity_url('a.com', '1'), status=404)
+        mock_responses.add(mock_responses.DELETE, self._entity_url('a.com', '2'), status=204)
+
+        self._store.delete_many(['a.com/1', 'a.com/2'])
+
+        self.assertEqual([call.request.method for call in mock_responses.calls[1:]], ['POST', 'DELETE', 'DELETE'])
+
+    @mock_responses.activate
+    def test_delete_many_counts_only_existing_entities(self):
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(404))
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/$batch', body=self._batch_response(204))
+        mock_responses.add(mock_responses.DELETE, self._entity_url('a.com', '1'), status=204)
+        mock_responses.add(mock_responses.DELETE, self._entity_url('a.com', 'missing'), status=404)
+        mock_responses.add(mock_responses.DELETE, self._entity_url('a.com', '2'), status=204)
+
+        num_deleted = self._store.delete_many(['a.com/1', 'a.com/missing', 'a.com/2', 'b.com/1'])
+
+        self.assertEqual(num_deleted, 3)
+
+    def setUp(self):
+        self._store = AzureTableIndexStore(
+            account='lokolestorage',
+            key='c2VjcmV0a2V5',
+            table='pendingemails',
+            host='azurite:10002',
+            secure=False,
+        )
+        mock_responses.add(mock_responses.POST, f'{self.base_url}/Tables', status=204)
+
+    @classmethod
+    def _entity_url(cls, partition_key: str, row_key: str) -> str:
+        return f"{cls.base_url}/pendingemails(PartitionKey=%27{partition_key}%27,RowKey=%27{row_key}%27)"
+
+    @classmethod
+    def _batch_response(cls, status: int) -> str:
+        return ('--batchresponse\r\n'
+                'Content-Type: multipart/mixed; boundary=changesetresponse\r\n\r\n'
+                '--changesetresponse\r\n'
+                'Content-Type: application/http\r\n\r\n'
+                f'HTTP/1.1 {status} Status\r\n\r\n'
+                '--changesetresponse--\r\n'
+                '--batchresponse--\r\n')
@@ -0,0 +1,33 @@
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from opwen_email_server.services.index_store import SqliteIndexStore
+from opwen_email_server.services.manifests import ContentManifests
+
+
+class ContentManifestsTests(TestCase):
+    def test_get_missing(self):
+        self.assertEqual(self._manifests.get('test.com', 'users'), {})
+
+    def test_stores_and_deletes(self):
+        self._manifests.store('test.com', 'users', {'a@test.com': '1'})
+        self._manifests.store('other.com', 'users', {'b@other.com': '2'})
+
+        self.assertEqual(self._manifests.get('test.com', 'users'), {'a@test.com': '1'})
+
+        self._manifests.delete('test.com', 'users')
+
+        self.assertEqual(self._manifests.get('test.com', 'users'), {})
+        self.assertEqual(self._manifests.delete_domain('other.com'), 1)
+        self.assertEqual(self._manifests.get('other.com', 'users'), {})
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        storage = SqliteIndexStore(path=join(self._folder, 'index.sqlite3'), table='manifests', case_sensitive=False)
+        storage.ensure_exists()
+        self._manifests = ContentManifests(storage)
+
+    def tearDown(self):
+        rmtree(self._folder)
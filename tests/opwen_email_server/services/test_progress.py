@@ -0,0 +1,111 @@
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.services.index_store import SqliteIndexStore
+from opwen_email_server.services.progress import Checkpoint
+from opwen_email_server.services.progress import CheckpointStore
+from opwen_email_server.services.progress import ProgressStore
+
+
+class ProgressStoreTests(TestCase):
+    def test_get_missing(self):
+        self.assertIsNone(self._progress.get('job'))
+        self.assertFalse(self._progress.is_active('job'))
+
+    def test_tracks_job_and_steps(self):
+        self._progress.start('job', 'user')
+        self._progress.set_state('job', 'running')
+        self._progress.set_step('job', 'users', 'done', 3)
+        self._progress.set_step('job', 'mailbox', 'running')
+
+        job = self._progress.get('job')
+
+        self.assertEqual(job['state'], 'running')
+        self.assertEqual(job['owner'], 'user')
+        self.assertEqual(job['steps']['users']['state'], 'done')
+        self.assertEqual(job['steps']['users']['deleted'], 3)
+        self.assertEqual(job['steps']['mailbox']['state'], 'running')
+        self.assertTrue(self._progress.is_active('job'))
+
+    def test_start_clears_previous_steps(self):
+        self._progress.start('job', 'user')
+        self._progress.set_step('job', 'users', 'failed')
+        self._progress.set_state('job', 'failed')
+
+        self._progress.start('job', 'user')
+
+        self.assertEqual(self._progress.get('job')['steps'], {})
+        self.assertEqual(self._progress.get('job')['state'], 'queued')
+
+    def test_finished_job_is_not_active(self):
+        self._progress.start('job', 'user')
+        self._progress.set_state('job', 'done')
+
+        self.assertFalse(self._progress.is_active('job'))
+
+    def test_stale_job_is_not_active(self):
+        with patch('opwen_email_server.services.progress.time', return_value=1000):
+            self._progress.start('job', 'user')
+
+        with patch('opwen_email_server.services.progress.time', return_value=1000 + 60):
+            self.assertFalse(self._progress.is_active('job'))
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        storage = SqliteIndexStore(path=join(self._folder, 'index.sqlite3'), table='jobs')
+        storage.ensure_exists()
+        self._progress = ProgressStore(storage, stale_after_seconds=30)
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class CheckpointTests(TestCase):
+    def test_advances_offset_over_contiguous_lines(self):
+        checkpoint = Checkpoint()
+
+        checkpoint.complete(1, 'b')
+        checkpoint.complete(3, 'd')
+
+        self.assertEqual(checkpoint.to_dict(), {'offset': 0, 'dispatched': ['b', 'd']})
+
+        checkpoint.complete(0, 'a')
+        checkpoint.complete(2)
+
+        self.assertEqual(checkpoint.to_dict(), {'offset': 4, 'dispatched': []})
+
+    def test_is_done(self):
+        checkpoint = Checkpoint(offset=2, dispatched=['c'])
+
+        self.assertTrue(checkpoint.is_done(1))
+        self.assertTrue(checkpoint.is_done(5, 'c'))
+        self.assertFalse(checkpoint.is_done(2))
+        self.assertFalse(checkpoint.is_done(2, 'd'))
+
+
+class CheckpointStoreTests(TestCase):
+    def test_roundtrip(self):
+        checkpoint = Checkpoint()
+        checkpoint.complete(0, 'a')
+        checkpoint.complete(2, 'c')
+
+        self._checkpoints.store('job', checkpoint)
+        restored = self._checkpoints.get('job')
+
+        self.assertEqual(restored.to_dict(), {'offset': 1, 'dispatched': ['c']})
+
+        self._checkpoints.delete('job')
+
+        self.assertEqual(self._checkpoints.get('job').to_dict(), {'offset': 0, 'dispatched': []})
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        storage = SqliteIndexStore(path=join(self._folder, 'index.sqlite3'), table='jobs')
+        storage.ensure_exists()
+        self._checkpoints = CheckpointStore(storage)
+
+    def tearDown(self):
+        rmtree(self._folder)
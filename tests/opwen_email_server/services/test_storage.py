@@ -1,4 +1,6 @@
 from io import BytesIO
+from os import chdir
+from os import getcwd
 from os import listdir
 from os import mkdir
 from os import remove
@@ -9,24 +11,29 @@ from shutil import rmtree
 from tarfile import TarInfo
 from tempfile import NamedTemporaryFile
 from tempfile import mkdtemp
+from threading import Thread
 from unittest import TestCase
 from unittest.mock import PropertyMock
 from unittest.mock import patch
 
+from libcloud.storage.base import Container
 from libcloud.storage.types import ContainerAlreadyExistsError
 from libcloud.storage.types import ContainerDoesNotExistError
 from libcloud.storage.types import ObjectDoesNotExistError
 from xtarfile import open as tarfile_open
 
 from opwen_email_server.services.storage import AzureFileStorage
+from opwen_email_server.services.storage import AzureMarkerStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureTextStorage
 from opwen_email_server.utils.serialization import from_jsonl_bytes
 from opwen_email_server.utils.serialization import to_jsonl_bytes
 from opwen_email_server.utils.temporary import create_tempfilename
+from opwen_email_server.utils.temporary import SpooledBytes
 from opwen_email_server.utils.temporary import removing
 from opwen_email_server.utils.unique import NewGuid
+from opwen_email_server.utils.unique import new_email_id
 from tests.opwen_email_server.helpers import throw
 
 
@@ -43,6 +50,12 @@ class AzureTextStorageTests(TestCase):
         with self.assertRaises(ObjectDoesNotExistError):
             self._storage.fetch_text(resource_id)
 
+    def test_exists(self):
+        self._storage.store_text('resource1', 'a')
+
+        self.assertTrue(self._storage.exists('resource1'))
+        self.assertFalse(self._storage.exists('resource2'))
+
     def test_list(self):
         self._storage.store_text('resource1', 'a')
         self._storage.store_text('resource2.txt.gz', 'b')
@@ -69,13 +82,15 @@ class AzureTextStorageTests(TestCase):
         self.assertTrue(isdir(join(self._folder, self._container)))
 
     def test_handles_race_condition_when_creating_container(self):
-        with patch.object(self._storage, '_driver', new_callable=PropertyMock) as driver:
-            container = {'get_was_called': False}
+        with patch.object(AzureTextStorage, '_driver', new_callable=PropertyMock) as driver_property:
+            driver = driver_property.return_value
+            container = Container(self._container, {}, driver)
+            state = {'get_was_called': False}
 
             # noinspection PyUnusedLocal
             def get_container(*args, **kwargs):
-                if not container['get_was_called']:
-                    container['get_was_called'] = True
+                if not state['get_was_called']:
+                    state['get_was_called'] = True
                     # noinspection PyTypeChecker
                     raise ContainerDoesNotExistError(None, driver, self._container)
 
@@ -87,6 +102,22 @@ class AzureTextStorageTests(TestCase):
 
             self.assertIs(self._storage._client._wrapped, container)
 
+    def test_uses_one_driver_per_thread(self):
+        drivers = []
+
+        def store(i):
+            self._storage.store_text(f'id{i}', 'content')
+            drivers.append(self._storage._client._wrapped.driver)
+
+        threads = [Thread(target=store, args=(i, )) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(map(id, drivers))), 4)
+        self.assertEqual(sorted(self._storage.iter()), [f'id{i}' for i in range(4)])
+
     def setUp(self):
         self._folder = mkdtemp()
         self._container = 'container'
@@ -122,6 +153,17 @@ class AzureTextStorageCaseInsensitiveTests(TestCase):
         self.assertEqual(sorted(self._storage.iter('one/')), sorted(['a', 'b']))
         self.assertEqual(sorted(self._storage.iter('two/')), sorted(['c', 'd', 'e']))
 
+    def test_delete_prefix(self):
+        self._storage.store_text('One/a', 'a')
+        self._storage.store_text('one/B', 'b')
+        self._storage.store_text('two/c', 'c')
+
+        num_deleted = self._storage.delete_prefix('ONE/')
+
+        self.assertEqual(num_deleted, 2)
+        self.assertEqual(list(self._storage.iter('one/')), [])
+        self.assertEqual(list(self._storage.iter('two/')), ['c'])
+
     def setUp(self):
         self._folder = mkdtemp()
         self._container = 'container'
@@ -137,6 +179,56 @@ class AzureTextStorageCaseInsensitiveTests(TestCase):
         rmtree(self._folder)
 
 
+class AzureMarkerStorageTests(TestCase):
+    def test_marks_lists_and_deletes(self):
+        self._storage.mark('domain/id1')
+        self._storage.mark('domain/id2')
+
+        self.assertTrue(self._storage.exists('domain/id1'))
+        self.assertEqual(sorted(self._storage.iter('domain/')), ['id1', 'id2'])
+        self.assertEqual(self._storage.count('domain/'), 2)
+
+        self._storage.delete('domain/id1')
+
+        self.assertFalse(self._storage.exists('domain/id1'))
+        self.assertEqual(self._storage.delete_many(['domain/id2', 'domain/missing']), 1)
+        self.assertEqual(self._storage.count(), 0)
+
+    def test_deletes_missing_folder(self):
+        self._storage.delete('nofolder/id1')
+
+        self.assertEqual(self._storage.delete_many(['nofolder/id2', 'otherfolder/id3']), 0)
+
+    def test_stores_empty_objects(self):
+        self._storage.mark('domain/id1')
+
+        self.assertEqual(listdir(join(self._folder, self._container, 'domain')), ['id1'])
+        self.assertEqual(Path(self._folder, self._container, 'domain', 'id1').stat().st_size, 0)
+
+    def test_handles_legacy_text_markers(self):
+        legacy = AzureTextStorage(account=self._folder, key='key', container=self._container, provider='LOCAL')
+        legacy.store_text('domain/id1', 'pending')
+        self._storage.mark('domain/id2')
+
+        self.assertTrue(self._storage.exists('domain/id1'))
+        self.assertEqual(sorted(self._storage.iter('domain/')), ['id1', 'id2'])
+        self.assertEqual(self._storage.delete_many(['domain/id1', 'domain/id2']), 2)
+        self.assertEqual(self._storage.count(), 0)
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        self._storage = AzureMarkerStorage(
+            account=self._folder,
+            key='key',
+            container=self._container,
+            provider='LOCAL',
+        )
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
 class AzureFileStorageTests(TestCase):
     def test_stores_fetches_and_deletes_file(self):
         resource_id, expected_content = 'id1', 'some content'
@@ -309,6 +401,103 @@ class AzureObjectStorageTests(TestCase):
 
         self.assertEqual(given, actual)
 
+    def test_store_many_and_count(self):
+        self._storage.store_many([('one/a', {'a': 1}), ('one/b', {'b': 2}), ('two/c', {'c': 3})])
+
+        self.assertEqual(self._storage.fetch_object('one/b'), {'b': 2})
+        self.assertEqual(self._storage.count('one/'), 2)
+        self.assertEqual(self._storage.count(), 3)
+
+    def test_delete_many(self):
+        self._storage.store_many([('one/a', {'a': 1}), ('one/b', {'b': 2}), ('two/c', {'c': 3})])
+
+        num_deleted = self._storage.delete_many(['one/a', 'two/c', 'two/missing'])
+
+        self.assertEqual(num_deleted, 2)
+        self.assertEqual(list(self._storage.iter()), ['one/b'])
+
+    def test_delete_many_in_missing_folder(self):
+        self._storage.store_object('one/a', {'a': 1})
+
+        num_deleted = self._storage.delete_many(['one/a', 'nofolder/x', 'nofolder/y'])
+
+        self.assertEqual(num_deleted, 1)
+        self.assertEqual(self._storage.count(), 0)
+
+    def test_delete_prefix(self):
+        self._storage.store_many([(f'one/{i}', {'i': i}) for i in range(20)] + [('two/c', {'c': 3})])
+
+        num_deleted = self._storage.delete_prefix('one/')
+
+        self.assertEqual(num_deleted, 20)
+        self.assertEqual(self._storage.count('one/'), 0)
+        self.assertEqual(self._storage.count(), 1)
+
+    def test_stores_versioned_objects(self):
+        self.assertTrue(self._storage.store_versioned_object('one/manifest', {'a': 1}, None))
+        self.assertFalse(self._storage.store_versioned_object('one/manifest', {'a': 2}, None))
+
+        obj, version = self._storage.fetch_versioned_object('one/manifest')
+        self.assertEqual(obj, {'a': 1})
+
+        self.assertTrue(self._storage.store_versioned_object('one/manifest', {'a': 3}, version))
+        self.assertFalse(self._storage.store_versioned_object('one/manifest', {'a': 4}, version))
+        self.assertEqual(self._storage.fetch_object('one/manifest'), {'a': 3})
+
+    def test_stores_versioned_objects_outside_of_storage_root(self):
+        workdir = mkdtemp()
+        cwd = getcwd()
+        chdir(workdir)
+        try:
+            self.assertTrue(self._storage.store_versioned_object('new/folder/manifest', {'a': 1}, None))
+            self.assertFalse(self._storage.store_versioned_object('new/folder/manifest', {'a': 2}, None))
+        finally:
+            chdir(cwd)
+            rmtree(workdir)
+
+        self.assertEqual(self._storage.fetch_object('new/folder/manifest'), {'a': 1})
+
+    def test_stores_object_with_content_id(self):
+        given = {'subject': 'foo', 'attachments': [{'filename': 'a.txt', 'content': b'a' * 1000}]}
+        expected_id = new_email_id(given)
+
+        stored = self._storage.store_object_with_id(given)
+        actual = self._storage.fetch_object(stored.resource_id)
+
+        self.assertEqual(stored.resource_id, expected_id)
+        self.assertGreater(stored.num_bytes, 0)
+        self.assertEqual(given['_uid'], expected_id)
+        self.assertEqual(actual, given)
+
+    def test_store_object_with_content_id_keeps_input_on_error(self):
+        given = {'subject': 'foo', '_uid': 'previous'}
+
+        with patch.object(self._storage._client, 'upload_object_via_stream', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self._storage.store_object_with_id(given)
+
+        self.assertEqual(given, {'subject': 'foo', '_uid': 'previous'})
+
+    def test_stores_object_with_content_id_ignoring_previous_id(self):
+        given = {'subject': 'foo', '_uid': 'previous'}
+
+        stored = self._storage.store_object_with_id(given)
+
+        self.assertEqual(stored.resource_id, new_email_id({'subject': 'foo'}))
+        self.assertEqual(self._storage.fetch_object(stored.resource_id)['_uid'], stored.resource_id)
+
+    def test_roundtrip_with_spooled_bytes(self):
+        spooled = SpooledBytes.spool([b'a' * 100000, b'b' * 100000])
+        self.addCleanup(spooled.remove)
+        given = {'attachments': [{'filename': 'a.txt', 'content': spooled}]}
+        resource_id = '123'
+
+        with patch.object(AzureObjectStorage, '_spool_max_bytes', 1024):
+            self._storage.store_object(resource_id, given)
+        actual = self._storage.fetch_object(resource_id)
+
+        self.assertEqual(actual, {'attachments': [{'filename': 'a.txt', 'content': b'a' * 100000 + b'b' * 100000}]})
+
     def setUp(self):
         self._folder = mkdtemp()
         self._container = 'container'
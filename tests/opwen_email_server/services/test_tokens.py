@@ -0,0 +1,70 @@
+from os import mkdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.services.storage import AzureObjectStorage
+from opwen_email_server.services.tokens import DomainTokens
+
+
+class DomainTokensTests(TestCase):
+    domain = 'test.lokole.ca'
+
+    def test_acquires_up_to_max_tokens(self):
+        leases = [self._tokens.acquire(self.domain, 'send') for _ in range(3)]
+
+        self.assertIsNotNone(leases[0])
+        self.assertIsNotNone(leases[1])
+        self.assertNotEqual(leases[0], leases[1])
+        self.assertIsNone(leases[2])
+
+    def test_release_frees_token(self):
+        lease = self._tokens.acquire(self.domain, 'send')
+        self._tokens.acquire(self.domain, 'send')
+
+        self._tokens.release(self.domain, 'send', lease)
+
+        self.assertIsNotNone(self._tokens.acquire(self.domain, 'send'))
+
+    def test_separates_domains_and_names(self):
+        self._tokens.acquire(self.domain, 'send')
+        self._tokens.acquire(self.domain, 'send')
+
+        self.assertIsNotNone(self._tokens.acquire('other.lokole.ca', 'send'))
+        self.assertIsNotNone(self._tokens.acquire(self.domain, 'written'))
+
+    def test_expires_leases(self):
+        self._tokens.acquire(self.domain, 'send')
+        self._tokens.acquire(self.domain, 'send')
+
+        with patch('opwen_email_server.services.tokens.time', return_value=10**12):
+            self.assertIsNotNone(self._tokens.acquire(self.domain, 'send'))
+
+    def test_gives_up_on_contention(self):
+        with patch.object(self._storage, 'store_versioned_object', return_value=False) as store:
+            self.assertIsNone(self._tokens.acquire(self.domain, 'send'))
+
+        self.assertEqual(store.call_count, 3)
+
+    def test_release_of_unknown_lease_is_noop(self):
+        self._tokens.release(self.domain, 'send', 'unknown')
+
+        self.assertIsNotNone(self._tokens.acquire(self.domain, 'send'))
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+            case_sensitive=False,
+        )
+        self._tokens = DomainTokens(self._storage, max_tokens=2, lease_seconds=60, max_attempts=3)
+
+    def tearDown(self):
+        rmtree(self._folder)
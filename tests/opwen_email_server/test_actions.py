@@ -1,17 +1,26 @@
 from collections import defaultdict
 from copy import deepcopy
+from threading import Lock
+from time import sleep
 from unittest import TestCase
+from unittest.mock import ANY
 from unittest.mock import MagicMock
 from unittest.mock import Mock
+from unittest.mock import call
 from unittest.mock import patch
 
 from libcloud.storage.types import ObjectDoesNotExistError
 
 from opwen_email_server import actions
 from opwen_email_server.constants import sync
+from opwen_email_server.services.counters import Counter
+from opwen_email_server.services.progress import Checkpoint
 from opwen_email_server.services.storage import AccessInfo
+from opwen_email_server.services.storage import StoredObject
+from opwen_email_server.utils.cache import TTLCache
 from opwen_email_server.utils.serialization import from_jsonl_bytes
 from opwen_email_server.utils.serialization import to_jsonl_bytes
+from opwen_email_server.utils.unique import new_content_hash
 from tests.opwen_email_server.helpers import throw
 
 
@@ -83,6 +92,7 @@ class StoreInboundEmailsTests(TestCase):
         self.raw_email_storage = Mock()
         self.email_storage = Mock()
         self.pending_storage = Mock()
+        self.domain_counters = Mock()
         self.email_parser = MagicMock()
         self.next_task = MagicMock()
 
@@ -96,8 +106,8 @@ class StoreInboundEmailsTests(TestCase):
         self.assertEqual(status, 202)
         self.raw_email_storage.fetch_text.assert_called_once_with(resource_id)
         self.assertFalse(self.raw_email_storage.delete.called)
-        self.assertFalse(self.email_storage.store_object.called)
-        self.assertFalse(self.pending_storage.store_text.called)
+        self.assertFalse(self.email_storage.store_object_with_id.called)
+        self.assertFalse(self.pending_storage.mark.called)
         self.assertFalse(self.email_parser.called)
 
     def test_200(self):
@@ -106,10 +116,9 @@ class StoreInboundEmailsTests(TestCase):
         raw_email = 'dummy-mime'
         parsed_email = {'to': [f'foo@{domain}', 'bar@test.com'], 'sent_at': '2020-02-01 21:17'}
         email_id = '03cbd3b41deca5f92a1d25cc0c50a6eae908d23770fd47ebca0d614eef96a46e'
-        stored_email = dict(parsed_email)
-        stored_email['_uid'] = email_id
 
         self.raw_email_storage.fetch_text.return_value = raw_email
+        self.email_storage.store_object_with_id.return_value = StoredObject(email_id, 123)
         self.email_parser.return_value = parsed_email
 
         _, status = self._execute_action(resource_id)
@@ -117,16 +126,18 @@ class StoreInboundEmailsTests(TestCase):
         self.assertEqual(status, 200)
         self.raw_email_storage.fetch_text.assert_called_once_with(resource_id)
         self.raw_email_storage.delete.assert_called_once_with(resource_id)
-        self.email_storage.store_object.assert_called_once_with(email_id, stored_email)
-        self.pending_storage.store_text.assert_called_once_with(f'{domain}/{email_id}', 'pending')
+        self.email_storage.store_object_with_id.assert_called_once_with(parsed_email)
+        self.pending_storage.mark.assert_called_once_with(f'{domain}/{email_id}')
+        self.domain_counters.increment.assert_called_once_with(domain, 'pending_emails')
         self.email_parser.assert_called_once_with(raw_email)
-        self.next_task.assert_called_once_with(email_id)
+        self.next_task.assert_called_once_with(email_id, domain)
 
     def _execute_action(self, *args, **kwargs):
         action = actions.StoreInboundEmails(
             raw_email_storage=self.raw_email_storage,
             email_storage=self.email_storage,
             pending_storage=self.pending_storage,
+            domain_counters=self.domain_counters,
             email_parser=self.email_parser,
             next_task=self.next_task,
         )
@@ -137,7 +148,8 @@ class StoreInboundEmailsTests(TestCase):
 class IndexReceivedEmailForMailboxTests(TestCase):
     def setUp(self):
         self.email_storage = Mock()
-        self.mailbox_storage = Mock()
+        self.mailbox_index = Mock()
+        self.search_index = Mock()
 
     def test_200(self):
         email_id = '123'
@@ -152,16 +164,22 @@ class IndexReceivedEmailForMailboxTests(TestCase):
 
         self.assertEqual(status, 200)
         self.email_storage.fetch_object.assert_called_once_with(email_id)
-        self.mailbox_storage.store_text.assert_any_call('bar.lokole.ca/1@bar.lokole.ca/received/527869980/123',
-                                                        'indexed')
-        self.mailbox_storage.store_text.assert_any_call('baz.lokole.ca/2@baz.lokole.ca/received/527869980/123',
-                                                        'indexed')
-        self.assertEqual(self.mailbox_storage.store_text.call_count, 2)
+        summary = {
+            'from': 'foo@foo', 'to': ['1@bar.lokole.ca', 'foo@gmail.com'], 'cc': ['2@baz.lokole.ca'], 'subject': None,
+            'sent_at': '2019-10-26 22:47', 'snippet': '', 'attachments': []
+        }
+        self.mailbox_index.add.assert_any_call('1@bar.lokole.ca', 'received', '527869980', '123', summary)
+        self.mailbox_index.add.assert_any_call('2@baz.lokole.ca', 'received', '527869980', '123', summary)
+        self.assertEqual(self.mailbox_index.add.call_count, 2)
+        terms = {'bar', 'baz', 'ca', 'foo', 'gmail', 'com', 'lokole'}
+        self.search_index.add.assert_any_call('1@bar.lokole.ca', '527869980', '123', summary, terms)
+        self.assertEqual(self.search_index.add.call_count, 2)
 
     def _execute_action(self, *args, **kwargs):
         action = actions.IndexReceivedEmailForMailbox(
             email_storage=self.email_storage,
-            mailbox_storage=self.mailbox_storage,
+            mailbox_index=self.mailbox_index,
+            search_index=self.search_index,
         )
 
         return action(*args, **kwargs)
@@ -170,7 +188,8 @@ class IndexReceivedEmailForMailboxTests(TestCase):
 class IndexSentEmailForMailboxTests(TestCase):
     def setUp(self):
         self.email_storage = Mock()
-        self.mailbox_storage = Mock()
+        self.mailbox_index = Mock()
+        self.search_index = Mock()
 
     def test_200(self):
         email_id = '123'
@@ -185,13 +204,72 @@ class IndexSentEmailForMailboxTests(TestCase):
 
         self.assertEqual(status, 200)
         self.email_storage.fetch_object.assert_called_once_with(email_id)
-        self.mailbox_storage.store_text.assert_called_once_with('foo.lokole.ca/foo@foo.lokole.ca/sent/527869980/123',
-                                                                'indexed')
+        self.mailbox_index.add.assert_called_once_with(
+            'foo@foo.lokole.ca', 'sent', '527869980', '123', {
+                'from': 'foo@foo.lokole.ca', 'to': ['1@bar.lokole.ca', 'foo@gmail.com'], 'cc': ['2@baz.lokole.ca'],
+                'subject': None, 'sent_at': '2019-10-26 22:47', 'snippet': '', 'attachments': []
+            })
 
     def _execute_action(self, *args, **kwargs):
         action = actions.IndexSentEmailForMailbox(
+            email_storage=self.email_storage,
+            mailbox_index=self.mailbox_index,
+            search_index=self.search_index,
+        )
+
+        return action(*args, **kwargs)
+
+
+class BackfillMailboxIndexTests(TestCase):
+    def setUp(self):
+        self.email_storage = Mock()
+        self.mailbox_storage = Mock()
+        self.mailbox_index = Mock()
+        self.search_index = Mock()
+
+    def test_200(self):
+        self.mailbox_storage.iter.return_value = [
+            'foo@bar.lokole.ca/received/527869980/123',
+            'foo@bar.lokole.ca/received/527869990/456',
+            'foo@bar.lokole.ca/received/deltas/00000001-abc.msgpack.gz',
+            'foo@bar.lokole.ca/search/manifest.msgpack.gz',
+        ]
+        email = {'to': ['foo@bar.lokole.ca'], 'from': 'baz@gmail.com', 'sent_at': '2019-10-26 22:47'}
+        self.email_storage.fetch_object.side_effect = [email, ObjectDoesNotExistError(None, None, '456')]
+
+        _, status = self._execute_action('bar.lokole.ca')
+
+        self.assertEqual(status, 200)
+        self.mailbox_storage.iter.assert_called_once_with('bar.lokole.ca/')
+        summary = {
+            'from': 'baz@gmail.com', 'to': ['foo@bar.lokole.ca'], 'cc': None, 'subject': None, 'sent_at':
+            '2019-10-26 22:47', 'snippet': '', 'attachments': []
+        }
+        self.mailbox_index.add_many.assert_called_once_with('foo@bar.lokole.ca', 'received',
+                                                            [('527869980', '123', summary)])
+        self.mailbox_index.compact.assert_called_once_with('foo@bar.lokole.ca', 'received')
+        terms = {'bar', 'baz', 'ca', 'foo', 'gmail', 'com', 'lokole'}
+        self.search_index.add_many.assert_called_once_with('foo@bar.lokole.ca', [('527869980', '123', summary, terms)])
+        self.mailbox_storage.delete_many.assert_called_once_with([
+            'bar.lokole.ca/foo@bar.lokole.ca/received/527869980/123',
+            'bar.lokole.ca/foo@bar.lokole.ca/received/527869990/456',
+        ])
+
+    def test_200_without_legacy_entries(self):
+        self.mailbox_storage.iter.return_value = []
+
+        _, status = self._execute_action('bar.lokole.ca')
+
+        self.assertEqual(status, 200)
+        self.mailbox_index.add_many.assert_not_called()
+        self.mailbox_storage.delete_many.assert_not_called()
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.BackfillMailboxIndex(
             email_storage=self.email_storage,
             mailbox_storage=self.mailbox_storage,
+            mailbox_index=self.mailbox_index,
+            search_index=self.search_index,
         )
 
         return action(*args, **kwargs)
@@ -202,7 +280,12 @@ class StoreWrittenClientEmailsTests(TestCase):
         self.client_storage = Mock()
         self.email_storage = Mock()
         self.user_storage = Mock()
+        self.user_manifests = Mock()
+        self.user_manifests.get.return_value = {}
+        self.domain_counters = Mock()
         self.next_task = MagicMock()
+        self.checkpoints = Mock()
+        self.checkpoints.get.return_value = Checkpoint()
 
     def test_200(self):
         self._test_200(
@@ -216,7 +299,14 @@ class StoreWrittenClientEmailsTests(TestCase):
             attachment_content_base64=None,
         )
 
-    def _test_200(self, attachment_content_bytes, attachment_content_base64):
+    def test_200_already_delivered(self):
+        self._test_200(
+            attachment_content_bytes=None,
+            attachment_content_base64=None,
+            num_pending=0,
+        )
+
+    def _test_200(self, attachment_content_bytes, attachment_content_base64, num_pending=1):
         resource_id = 'a2e3d5a7-cb3a-42c3-beeb-d6a2a76089dc'
         email_id = '0194bf59-fb01-479e-bd5e-a59e4b8464d0'
         user_email = 'clemens@developer1.lokole.ca'
@@ -231,24 +321,183 @@ class StoreWrittenClientEmailsTests(TestCase):
         if attachment_content_bytes:
             server_email['attachments'][0]['content'] = attachment_content_bytes
 
-        self.client_storage.fetch_objects.side_effect = [[client_email], [user]]
+        self._given_objects([client_email], [user])
+        self.user_storage.exists.return_value = False
 
         _, status = self._execute_action(resource_id)
 
         self.assertEqual(status, 200)
-        self.client_storage.fetch_objects.assert_any_call(resource_id, (sync.EMAILS_FILE, from_jsonl_bytes))
+        self.client_storage.fetch_objects.assert_any_call(resource_id, (sync.EMAILS_FILE, ANY))
         self.email_storage.store_object.assert_called_once_with(email_id, server_email)
-        self.next_task.assert_called_once_with(email_id)
+        self.next_task.assert_called_once_with(email_id, 'test.com', len(attachment_content_bytes or b''))
         self.client_storage.fetch_objects.assert_any_call(resource_id, (sync.USERS_FILE, from_jsonl_bytes))
-        self.user_storage.store_object.assert_called_once_with(f'developer1.lokole.ca/{user_email}', user)
+        self.user_storage.store_many.assert_called_once_with([(f'developer1.lokole.ca/{user_email}', user)])
+        self.user_manifests.store.assert_called_once_with('developer1.lokole.ca', 'users',
+                                                          {user_email: new_content_hash(user)})
+        self.domain_counters.increment.assert_called_once_with('developer1.lokole.ca', 'users', 1)
         self.client_storage.delete.assert_called_once_with(resource_id)
 
-    def _execute_action(self, *args, **kwargs):
+    def test_skips_unchanged_users(self):
+        unchanged = {'email': 'unchanged@developer1.lokole.ca', 'password': 'a'}
+        changed = {'email': 'Changed@developer1.lokole.ca', 'password': 'b'}
+        created = {'email': 'created@developer1.lokole.ca', 'password': 'c'}
+
+        self._given_objects([], [unchanged, changed, created])
+        self.user_manifests.get.return_value = {
+            'unchanged@developer1.lokole.ca': new_content_hash(unchanged),
+            'changed@developer1.lokole.ca': 'previous',
+        }
+        self.user_storage.exists.return_value = False
+
+        self._execute_action('resource')
+
+        self.user_storage.store_many.assert_called_once_with([
+            ('developer1.lokole.ca/Changed@developer1.lokole.ca', changed),
+            ('developer1.lokole.ca/created@developer1.lokole.ca', created),
+        ])
+        self.user_storage.exists.assert_called_once_with('developer1.lokole.ca/created@developer1.lokole.ca')
+        self.user_manifests.store.assert_called_once_with(
+            'developer1.lokole.ca', 'users', {
+                'unchanged@developer1.lokole.ca': new_content_hash(unchanged),
+                'changed@developer1.lokole.ca': new_content_hash(changed),
+                'created@developer1.lokole.ca': new_content_hash(created),
+            })
+        self.domain_counters.increment.assert_called_once_with('developer1.lokole.ca', 'users', 1)
+
+    def test_does_not_write_when_all_users_unchanged(self):
+        user = {'email': 'user@developer1.lokole.ca', 'password': 'a'}
+
+        self._given_objects([], [user])
+        self.user_manifests.get.return_value = {'user@developer1.lokole.ca': new_content_hash(user)}
+
+        self._execute_action('resource')
+
+        self.assertFalse(self.user_storage.store_many.called)
+        self.assertFalse(self.user_storage.exists.called)
+        self.assertFalse(self.user_manifests.store.called)
+        self.assertFalse(self.domain_counters.increment.called)
+
+    def test_stores_emails_concurrently(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(20)]
+        active = {'now': 0, 'max': 0}
+        lock = Lock()
+
+        def store_object(*args):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            sleep(0.01)
+            with lock:
+                active['now'] -= 1
+
+        self._given_objects(emails, [])
+        self.email_storage.store_object.side_effect = store_object
+
+        _, status = self._execute_action('resource', max_workers=4)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.email_storage.store_object.call_count, 20)
+        self.assertEqual(sorted(call[0][0] for call in self.next_task.call_args_list),
+                         sorted(str(i) for i in range(20)))
+        self.assertGreater(active['max'], 1)
+        self.assertLessEqual(active['max'], 4)
+
+    def test_raises_when_email_fails_to_store(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(5)]
+
+        self._given_objects(emails, [])
+        self.email_storage.store_object.side_effect = [None, ValueError, None, None, None]
+
+        with self.assertRaises(ValueError):
+            self._execute_action('resource', max_workers=1)
+
+        self.assertFalse(self.client_storage.delete.called)
+
+    def test_checkpoints_dispatched_emails_on_failure(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(5)]
+
+        self._given_objects(emails, [])
+        self.email_storage.store_object.side_effect = [None, ValueError, None, None, None]
+
+        with self.assertRaises(ValueError):
+            self._execute_action('resource', max_workers=1)
+
+        dispatched_ids = {call[0][0] for call in self.next_task.call_args_list}
+        job_id, checkpoint = self.checkpoints.store.call_args[0]
+        self.assertEqual(job_id, 'written_store/resource')
+        self.assertEqual(checkpoint.offset, 1)
+        self.assertEqual({'0'} | set(checkpoint.to_dict()['dispatched']), dispatched_ids)
+        self.assertNotIn('1', dispatched_ids)
+        self.assertFalse(self.checkpoints.delete.called)
+
+    def test_resumes_from_checkpoint(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(6)]
+
+        self._given_objects(emails, [])
+        self.checkpoints.get.return_value = Checkpoint(offset=2, dispatched=['4'])
+
+        _, status = self._execute_action('resource', max_workers=1)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(call[0][0] for call in self.email_storage.store_object.call_args_list), ['2', '3', '5'])
+        self.assertEqual(sorted(call[0][0] for call in self.next_task.call_args_list), ['2', '3', '5'])
+        self.checkpoints.get.assert_called_once_with('written_store/resource')
+        self.checkpoints.delete.assert_called_once_with('written_store/resource')
+
+    def test_does_not_dispatch_again_when_retrying_after_users_failure(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(10)]
+        checkpoints = {}
+
+        def store_checkpoint(job_id, checkpoint):
+            checkpoints[job_id] = checkpoint.to_dict()
+
+        def get_checkpoint(job_id):
+            stored = checkpoints.get(job_id, {'offset': 0, 'dispatched': []})
+            return Checkpoint(stored['offset'], stored['dispatched'])
+
+        self._given_objects(emails, [{'email': 'user@test.com'}])
+        self.checkpoints.get.side_effect = get_checkpoint
+        self.checkpoints.store.side_effect = store_checkpoint
+        self.user_storage.store_many.side_effect = [ValueError, None]
+
+        with self.assertRaises(ValueError):
+            self._execute_action('resource')
+        _, status = self._execute_action('resource')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(call[0][0] for call in self.next_task.call_args_list),
+                         sorted(str(i) for i in range(10)))
+        self.checkpoints.delete.assert_called_once_with('written_store/resource')
+
+    def test_checkpoints_periodically(self):
+        emails = [{'from': 'foo@test.com', '_uid': str(i)} for i in range(10)]
+
+        self._given_objects(emails, [])
+
+        self._execute_action('resource', max_workers=1, checkpoint_interval=3)
+
+        self.assertGreaterEqual(self.checkpoints.store.call_count, 2)
+        self.checkpoints.delete.assert_called_once_with('written_store/resource')
+
+    def _given_objects(self, emails, users):
+        def fetch_objects(resource_id, download):
+            name, decoder = download
+            decoded = [decoder(to_jsonl_bytes(obj)) for obj in (emails if name == sync.EMAILS_FILE else users)]
+            return [obj for obj in decoded if obj is not None]
+
+        self.client_storage.fetch_objects.side_effect = fetch_objects
+
+    def _execute_action(self, *args, max_workers=8, checkpoint_interval=50, **kwargs):
         action = actions.StoreWrittenClientEmails(
             client_storage=self.client_storage,
             email_storage=self.email_storage,
             user_storage=self.user_storage,
+            user_manifests=self.user_manifests,
+            domain_counters=self.domain_counters,
             next_task=self.next_task,
+            checkpoints=self.checkpoints,
+            max_workers=max_workers,
+            checkpoint_interval=checkpoint_interval,
         )
 
         return action(*args, **kwargs)
@@ -286,7 +535,7 @@ class ReceiveInboundEmailTests(TestCase):
         self.assertEqual(status, 200)
         self.auth.domain_for.assert_called_once_with(client_id)
         self.raw_email_storage.store_text.assert_called_once_with(email_id, email)
-        self.next_task.assert_called_once_with(email_id)
+        self.next_task.assert_called_once_with(email_id, len(email))
 
     def test_is_idempotent(self):
         client_id = '8c753257-6b75-4a26-a81b-bb9c09d38b52'
@@ -344,8 +593,23 @@ class ProcessServiceEmailTests(TestCase):
 
         _, status = self._execute_action(resource_id)
         self.assertEqual(status, 200)
-        self.email_storage.store_object.assert_called_once()
-        self.next_task.assert_called_once()
+        self.email_storage.store_object_with_id.assert_called_once_with(parsed_email)
+        self.next_task.assert_called_once_with(self.email_storage.store_object_with_id.return_value.resource_id,
+                                               'lokole.ca', 0)
+
+    def test_200_multiple_services(self):
+        resource_id = 'eb93fde9-0cc6-4339-b7d6-f6e838e78f1c'
+        parsed_email = {'to': ['service@lokole.ca', 'other@lokole.ca'], 'from': 'user@lokole.ca', 'body': 'query'}
+        self.registry['other@lokole.ca'] = lambda email: dict(email, body='formatted')
+        self.email_parser.return_value = parsed_email
+
+        _, status = self._execute_action(resource_id)
+
+        self.assertEqual(status, 200)
+        self.assertEqual([call[0][0]['body'] for call in self.email_storage.store_object_with_id.call_args_list],
+                         ['query', 'formatted'])
+        self.assertEqual(self.next_task.call_count, 2)
+        self.assertEqual(parsed_email['body'], 'query')
 
     def _execute_action(self, *args, **kwargs):
         action = actions.ProcessServiceEmail(
@@ -365,6 +629,7 @@ class DownloadClientEmailsTests(TestCase):
         self.client_storage = Mock()
         self.email_storage = Mock()
         self.pending_storage = Mock()
+        self.domain_counters = Mock()
 
     def test_400(self):
         client_id = 'af962175-8757-4ac4-a199-2387b06379fa'
@@ -399,7 +664,14 @@ class DownloadClientEmailsTests(TestCase):
             attachment_content_base64=None,
         )
 
-    def _test_200(self, attachment_content_bytes, attachment_content_base64):
+    def test_200_already_delivered(self):
+        self._test_200(
+            attachment_content_bytes=None,
+            attachment_content_base64=None,
+            num_pending=0,
+        )
+
+    def _test_200(self, attachment_content_bytes, attachment_content_base64, num_pending=1):
         client_id = 'f4e2cdc6-c79c-44ad-af35-071f8ea6e176'
         email_id = 'b69bee6b-72fb-4b7f-a2ad-9aa7e375cf18'
         resource_id = 'ffc86666-a9c6-403d-8a9c-c334465657c2'
@@ -426,6 +698,7 @@ class DownloadClientEmailsTests(TestCase):
 
         self.auth.domain_for.return_value = domain
         self.pending_storage.iter.return_value = [email_id]
+        self.pending_storage.delete_many.return_value = num_pending
         self.email_storage.fetch_object.return_value = server_email
         self.client_storage.store_objects.side_effect = store_objects_mock
         self.client_storage.compression_formats.return_value = ['gz']
@@ -435,7 +708,8 @@ class DownloadClientEmailsTests(TestCase):
         self.assertEqual(response.get('resource_id'), resource_id)
         self.auth.domain_for.assert_called_once_with(client_id)
         self.pending_storage.iter.assert_called_once_with(f'{domain}/')
-        self.pending_storage.delete.assert_called_once_with(f'{domain}/{email_id}')
+        self.pending_storage.delete_many.assert_called_once_with([f'{domain}/{email_id}'])
+        self.domain_counters.increment.assert_called_once_with(domain, 'pending_emails', -num_pending)
         self.email_storage.fetch_object.assert_called_once_with(email_id)
         self.assertEqual(_stored[sync.EMAILS_FILE], [client_email])
         self.assertEqual(_compression[sync.EMAILS_FILE], ['gz'])
@@ -447,6 +721,7 @@ class DownloadClientEmailsTests(TestCase):
             client_storage=self.client_storage,
             email_storage=self.email_storage,
             pending_storage=self.pending_storage,
+            domain_counters=self.domain_counters,
         )
 
         return action(*args, **kwargs)
@@ -481,7 +756,7 @@ class UploadClientEmailsTests(TestCase):
 
         self.assertEqual(status, 200)
         self.auth.domain_for.assert_called_once_with(client_id)
-        self.next_task.assert_called_once_with(resource_id)
+        self.next_task.assert_called_once_with(resource_id, domain)
 
     def _execute_action(self, *args, **kwargs):
         action = actions.UploadClientEmails(
@@ -675,23 +950,21 @@ class GetClientTests(TestCase):
 class DeleteClientTests(TestCase):
     def setUp(self):
         self.auth = Mock()
-        self.delete_mailbox = MagicMock()
-        self.delete_mx_records = MagicMock()
-        self.mailbox_storage = Mock()
-        self.pending_storage = Mock()
-        self.user_storage = Mock()
+        self.progress = Mock()
+        self.task = MagicMock()
 
     def test_400(self):
         domain = 'TEST.com'
-        user = 'user'
+        user = {'name': 'user'}
 
         _, status = self._execute_action(domain, user=user)
 
         self.assertEqual(status, 400)
+        self.assertFalse(self.task.called)
 
     def test_404(self):
         domain = 'test.com'
-        user = 'user'
+        user = {'name': 'user'}
 
         self.auth.client_id_for.return_value = None
 
@@ -699,10 +972,11 @@ class DeleteClientTests(TestCase):
 
         self.assertEqual(status, 404)
         self.auth.client_id_for.assert_called_once_with(domain)
+        self.assertFalse(self.task.called)
 
     def test_403(self):
         domain = 'test.com'
-        user = 'user'
+        user = {'name': 'user'}
         client_id = '187ba644-4d46-49f6-a634-017d7f58e338'
 
         self.auth.client_id_for.return_value = client_id
@@ -713,46 +987,200 @@ class DeleteClientTests(TestCase):
         self.assertEqual(status, 403)
         self.auth.client_id_for.assert_called_once_with(domain)
         self.auth.is_owner.assert_called_once_with(domain, user)
+        self.assertFalse(self.task.called)
 
-    def test_200(self):
+    def test_202(self):
         client_id = '187ba644-4d46-49f6-a634-017d7f58e338'
         domain = 'test.com'
-        user = 'user'
+        user = {'name': 'user'}
 
         self.auth.client_id_for.return_value = client_id
         self.auth.is_owner.return_value = True
-        self.mailbox_storage.iter.return_value = ['1/2/a', '1/2/b']
-        self.pending_storage.iter.return_value = ['c', 'd', 'e']
-        self.user_storage.iter.return_value = [f'{user}@{domain}']
+        self.progress.is_active.return_value = False
 
         _, status = self._execute_action(domain, user=user)
 
+        self.assertEqual(status, 202)
+        self.progress.start.assert_called_once_with(f'delete_client/{domain}', 'user')
+        self.task.assert_called_once_with(domain)
+        self.assertFalse(self.auth.delete.called)
+
+    def test_202_already_in_progress(self):
+        domain = 'test.com'
+        user = {'name': 'user'}
+
+        self.auth.client_id_for.return_value = '187ba644-4d46-49f6-a634-017d7f58e338'
+        self.auth.is_owner.return_value = True
+        self.progress.is_active.return_value = True
+
+        _, status = self._execute_action(domain, user=user)
+
+        self.assertEqual(status, 202)
+        self.assertFalse(self.progress.start.called)
+        self.assertFalse(self.task.called)
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.DeleteClient(
+            auth=self.auth,
+            progress=self.progress,
+            task=self.task,
+        )
+
+        return action(*args, **kwargs)
+
+
+class GetClientDeletionTests(TestCase):
+    def setUp(self):
+        self.auth = Mock()
+        self.progress = Mock()
+
+    def test_404(self):
+        self.progress.get.return_value = None
+
+        _, status = self._execute_action('test.com', user={'name': 'user'})
+
+        self.assertEqual(status, 404)
+
+    def test_403(self):
+        self.progress.get.return_value = {'owner': 'other', 'state': 'running', 'steps': {}}
+        self.auth.is_owner.return_value = False
+
+        _, status = self._execute_action('test.com', user={'name': 'user'})
+
+        self.assertEqual(status, 403)
+
+    def test_200(self):
+        self.progress.get.return_value = {
+            'owner': 'user',
+            'state': 'running',
+            'steps': {
+                'users': {'state': 'done', 'deleted': 3, 'updated_at': 1},
+                'mailbox': {'state': 'running', 'deleted': 0, 'updated_at': 1},
+            },
+        }
+
+        response = self._execute_action('test.com', user={'name': 'user'})
+
+        self.progress.get.assert_called_once_with('delete_client/test.com')
+        self.assertEqual(
+            response, {
+                'domain':
+                'test.com',
+                'state':
+                'running',
+                'steps': [
+                    {'name': 'mailbox', 'state': 'running', 'deleted': 0},
+                    {'name': 'users', 'state': 'done', 'deleted': 3},
+                ],
+            })
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.GetClientDeletion(
+            auth=self.auth,
+            progress=self.progress,
+        )
+
+        return action(*args, **kwargs)
+
+
+class PurgeClientTests(TestCase):
+    def setUp(self):
+        self.auth = Mock()
+        self.delete_mailbox = MagicMock()
+        self.delete_mx_records = MagicMock()
+        self.mailbox_storage = Mock()
+        self.mailbox_storage.delete_prefix.return_value = 0
+        self.mailbox_index = Mock()
+        self.mailbox_index.delete_domain.return_value = 0
+        self.pending_storage = Mock()
+        self.user_storage = Mock()
+        self.user_manifests = Mock()
+        self.domain_counters = Mock()
+        self.progress = Mock()
+
+    def test_404(self):
+        domain = 'test.com'
+
+        self.auth.client_id_for.return_value = None
+
+        _, status = self._execute_action(domain)
+
+        self.assertEqual(status, 404)
+        self.progress.set_state.assert_called_once_with(f'delete_client/{domain}', 'failed')
+        self.assertFalse(self.pending_storage.delete_prefix.called)
+
+    def test_200(self):
+        client_id = '187ba644-4d46-49f6-a634-017d7f58e338'
+        domain = 'test.com'
+
+        self.auth.client_id_for.return_value = client_id
+        self.delete_mailbox.return_value = None
+        self.delete_mx_records.return_value = None
+        self.pending_storage.delete_prefix.return_value = 3
+        self.mailbox_storage.delete_prefix.return_value = 2
+        self.user_storage.delete_prefix.return_value = 1
+        self.domain_counters.delete_domain.return_value = 2
+
+        _, status = self._execute_action(domain)
+
         self.assertEqual(status, 200)
-        self.auth.client_id_for.assert_called_once_with(domain)
-        self.auth.is_owner.assert_called_once_with(domain, user)
-        self.auth.delete.assert_called_once_with(client_id, domain)
         self.delete_mailbox.assert_called_once_with(client_id, domain)
         self.delete_mx_records.assert_called_once_with(domain)
-        self.mailbox_storage.iter.assert_called_once_with(f'{domain}/')
-        self.mailbox_storage.delete.assert_any_call(f'{domain}/1/2/a')
-        self.mailbox_storage.delete.assert_any_call(f'{domain}/1/2/b')
-        self.assertEqual(self.mailbox_storage.delete.call_count, 2)
-        self.pending_storage.iter.assert_called_once_with(f'{domain}/')
-        self.pending_storage.delete.assert_any_call(f'{domain}/c')
-        self.pending_storage.delete.assert_any_call(f'{domain}/d')
-        self.pending_storage.delete.assert_any_call(f'{domain}/e')
-        self.assertEqual(self.pending_storage.delete.call_count, 3)
-        self.user_storage.iter.assert_called_once_with(f'{domain}/')
-        self.user_storage.delete.assert_called_once_with(f'{domain}/{user}@{domain}')
+        self.pending_storage.delete_prefix.assert_called_once_with(f'{domain}/')
+        self.mailbox_storage.delete_prefix.assert_called_once_with(f'{domain}/')
+        self.user_storage.delete_prefix.assert_called_once_with(f'{domain}/')
+        self.mailbox_index.delete_domain.assert_called_once_with(domain)
+        self.domain_counters.delete_domain.assert_called_once_with(domain)
+        self.user_manifests.delete_domain.assert_called_once_with(domain)
+        self.auth.delete.assert_called_once_with(client_id, domain)
+        self.progress.set_step.assert_any_call(f'delete_client/{domain}', 'pending_emails', 'done', 3)
+        self.progress.set_step.assert_any_call(f'delete_client/{domain}', 'mailbox_emails', 'done', 2)
+        self.progress.set_step.assert_any_call(f'delete_client/{domain}', 'mx_records', 'done', 0)
+        self.progress.set_state.assert_called_with(f'delete_client/{domain}', 'done')
+
+    def test_deletes_mailbox_index_after_mailbox_emails(self):
+        client_id = '187ba644-4d46-49f6-a634-017d7f58e338'
+        domain = 'test.com'
+        calls = Mock()
+
+        self.auth.client_id_for.return_value = client_id
+        self.mailbox_storage.delete_prefix.return_value = 2
+        self.mailbox_index.delete_domain.return_value = 1
+        calls.attach_mock(self.mailbox_storage.delete_prefix, 'delete_prefix')
+        calls.attach_mock(self.mailbox_index.delete_domain, 'delete_domain')
+
+        _, status = self._execute_action(domain)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(calls.mock_calls, [call.delete_prefix(f'{domain}/'), call.delete_domain(domain)])
+        self.progress.set_step.assert_any_call(f'delete_client/{domain}', 'mailbox_emails', 'done', 3)
+
+    def test_failed_step(self):
+        client_id = '187ba644-4d46-49f6-a634-017d7f58e338'
+        domain = 'test.com'
+
+        self.auth.client_id_for.return_value = client_id
+        self.user_storage.delete_prefix.side_effect = ValueError
+
+        with self.assertRaises(ValueError):
+            self._execute_action(domain)
+
+        self.assertFalse(self.auth.delete.called)
+        self.progress.set_step.assert_any_call(f'delete_client/{domain}', 'users', 'failed')
+        self.progress.set_state.assert_called_with(f'delete_client/{domain}', 'failed')
 
     def _execute_action(self, *args, **kwargs):
-        action = actions.DeleteClient(
+        action = actions.PurgeClient(
             auth=self.auth,
             delete_mailbox=self.delete_mailbox,
             delete_mx_records=self.delete_mx_records,
             mailbox_storage=self.mailbox_storage,
+            mailbox_index=self.mailbox_index,
             pending_storage=self.pending_storage,
             user_storage=self.user_storage,
+            user_manifests=self.user_manifests,
+            domain_counters=self.domain_counters,
+            progress=self.progress,
         )
 
         return action(*args, **kwargs)
@@ -762,6 +1190,8 @@ class CalculateNumberOfUsersMetricTests(TestCase):
     def setUp(self):
         self.auth = Mock()
         self.user_storage = Mock()
+        self.domain_counters = Mock()
+        self.reconcile = MagicMock()
 
     def test_403(self):
         domain = 'test.com'
@@ -772,29 +1202,59 @@ class CalculateNumberOfUsersMetricTests(TestCase):
         _, status = self._execute_action(domain, user=user)
 
         self.assertEqual(status, 403)
+        self.assertFalse(self.domain_counters.get.called)
 
-    def test_200(self):
+    def test_200_without_counter(self):
         domain = 'test.com'
         user = 'user'
-        users = [
-            'test.com/user1',
-            'test.com/user2',
-            'test.com/user3',
-        ]
 
         self.auth.is_owner.return_value = True
-        self.user_storage.iter.return_value = users
+        self.user_storage.count.return_value = 3
+        self.domain_counters.get.return_value = None
+        self.domain_counters.reconcile.side_effect = lambda domain, name, value: value
 
         response = self._execute_action(domain, user=user)
 
-        self.assertEqual(response['users'], len(users))
+        self.assertEqual(response['users'], 3)
         self.auth.is_owner.assert_called_once_with(domain, user)
-        self.user_storage.iter.assert_called_once_with(f'{domain}/')
+        self.user_storage.count.assert_called_once_with(f'{domain}/')
+        self.assertFalse(self.reconcile.called)
+
+    def test_200_with_counter(self):
+        domain = 'test.com'
+        user = 'user'
+
+        self.auth.is_owner.return_value = True
+        self.domain_counters.get.return_value = Counter(5, 0)
+        self.domain_counters.is_stale.return_value = False
+
+        response = self._execute_action(domain, user=user)
+
+        self.assertEqual(response['users'], 5)
+        self.domain_counters.get.assert_called_once_with(domain, 'users')
+        self.assertFalse(self.user_storage.iter.called)
+        self.assertFalse(self.reconcile.called)
+
+    def test_200_with_stale_counter(self):
+        domain = 'test.com'
+        user = 'user'
+
+        self.auth.is_owner.return_value = True
+        self.domain_counters.get.return_value = Counter(5, 0)
+        self.domain_counters.is_stale.return_value = True
+
+        response = self._execute_action(domain, user=user)
+
+        self.assertEqual(response['users'], 5)
+        self.assertFalse(self.user_storage.iter.called)
+        self.reconcile.assert_called_once_with(domain)
 
     def _execute_action(self, *args, **kwargs):
         action = actions.CalculateNumberOfUsersMetric(
             auth=self.auth,
-            user_storage=self.user_storage,
+            storage=self.user_storage,
+            domain_counters=self.domain_counters,
+            reconcile=self.reconcile,
         )
 
         return action(*args, **kwargs)
@@ -804,6 +1264,8 @@ class CalculatePendingEmailsMetricTests(TestCase):
     def setUp(self):
         self.auth = Mock()
         self.pending_storage = Mock()
+        self.domain_counters = Mock()
+        self.reconcile = MagicMock()
 
     def test_403(self):
         domain = 'test.com'
@@ -818,25 +1280,108 @@ class CalculatePendingEmailsMetricTests(TestCase):
     def test_200(self):
         domain = 'test.com'
         user = 'user'
-        pending_email_ids = [
-            '1de2ceb6-4f82-4cad-86ac-815bcbcb801c',
-            '9eb3f071-0f95-4317-befa-060c05ba3632',
-            '1e79ad99-1778-47b0-a2db-3c3be404640d',
-        ]
 
         self.auth.is_owner.return_value = True
-        self.pending_storage.iter.return_value = pending_email_ids
+        self.domain_counters.get.return_value = Counter(3, 0)
+        self.domain_counters.is_stale.return_value = False
 
         response = self._execute_action(domain, user=user)
 
-        self.assertEqual(response['pending_emails'], len(pending_email_ids))
+        self.assertEqual(response['pending_emails'], 3)
         self.auth.is_owner.assert_called_once_with(domain, user)
-        self.pending_storage.iter.assert_called_once_with(f'{domain}/')
+        self.domain_counters.get.assert_called_once_with(domain, 'pending_emails')
+        self.assertFalse(self.pending_storage.iter.called)
 
     def _execute_action(self, *args, **kwargs):
         action = actions.CalculatePendingEmailsMetric(
             auth=self.auth,
+            storage=self.pending_storage,
+            domain_counters=self.domain_counters,
+            reconcile=self.reconcile,
+        )
+
+        return action(*args, **kwargs)
+
+
+class ReconcileDomainMetricsTests(TestCase):
+    def setUp(self):
+        self.pending_storage = Mock()
+        self.user_storage = Mock()
+        self.domain_counters = Mock()
+
+    def test_200(self):
+        domain = 'test.com'
+        self.pending_storage.count.return_value = 2
+        self.user_storage.count.return_value = 1
+
+        _, status = self._execute_action(domain)
+
+        self.assertEqual(status, 200)
+        self.domain_counters.reconcile.assert_any_call(domain, 'pending_emails', 2)
+        self.domain_counters.reconcile.assert_any_call(domain, 'users', 1)
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.ReconcileDomainMetrics(
             pending_storage=self.pending_storage,
+            user_storage=self.user_storage,
+            domain_counters=self.domain_counters,
+        )
+
+        return action(*args, **kwargs)
+
+
+class CalculateClientsMetricsTests(TestCase):
+    def setUp(self):
+        self.auth = Mock()
+        self.pending_metric = Mock()
+        self.pending_metric.metric = 'pending_emails'
+        self.users_metric = Mock()
+        self.users_metric.metric = 'users'
+        self.cache = TTLCache(ttl_seconds=60)
+
+    def test_200(self):
+        user = {'name': 'user'}
+
+        self.auth.domains.return_value = ['b.lokole.ca', 'a.lokole.ca', 'c.lokole.ca']
+        self.auth.is_owner.side_effect = lambda domain, user: domain != 'c.lokole.ca'
+        self.pending_metric.value_for.side_effect = lambda domain: len(domain)
+        self.users_metric.value_for.return_value = 2
+
+        response = self._execute_action(user=user)
+
+        self.assertEqual(response['clients'], [
+            {'domain': 'a.lokole.ca', 'pending_emails': 11, 'users': 2},
+            {'domain': 'b.lokole.ca', 'pending_emails': 11, 'users': 2},
+        ])
+        self.assertEqual(self.pending_metric.value_for.call_count, 2)
+
+    def test_200_cached(self):
+        user = {'name': 'user'}
+
+        self.auth.domains.return_value = ['a.lokole.ca']
+        self.auth.is_owner.return_value = True
+        self.pending_metric.value_for.return_value = 1
+        self.users_metric.value_for.return_value = 2
+
+        first = self._execute_action(user=user)
+        second = self._execute_action(user=user)
+
+        self.assertEqual(first, second)
+        self.auth.domains.assert_called_once_with()
+        self.pending_metric.value_for.assert_called_once_with('a.lokole.ca')
+
+    def test_200_without_clients(self):
+        self.auth.domains.return_value = []
+
+        response = self._execute_action(user={'name': 'user'})
+
+        self.assertEqual(response['clients'], [])
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.CalculateClientsMetrics(
+            auth=self.auth,
+            domain_metrics=[self.pending_metric, self.users_metric],
+            cache=self.cache,
         )
 
         return action(*args, **kwargs)
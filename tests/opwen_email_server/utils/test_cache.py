@@ -0,0 +1,271 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import listdir
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import sleep
+from unittest import TestCase
+
+from opwen_email_server.utils.cache import ContentCache
+from opwen_email_server.utils.cache import FileCache
+from opwen_email_server.utils.cache import SingleFlight
+from opwen_email_server.utils.cache import TTLCache
+from opwen_email_server.utils.temporary import SpooledBytes
+
+
+class ContentCacheTests(TestCase):
+    def test_returns_none_for_missing_key(self):
+        cache = ContentCache(max_bytes=10)
+
+        self.assertIsNone(cache.get('missing'))
+
+    def test_stores_and_fetches_content(self):
+        cache = ContentCache(max_bytes=10)
+
+        cache.put('a', b'123')
+
+        self.assertEqual(cache.get('a'), b'123')
+        self.assertEqual(cache.num_bytes, 3)
+
+    def test_stores_identical_content_once(self):
+        cache = ContentCache(max_bytes=10)
+
+        cache.put('a', b'123')
+        cache.put('b', b'123')
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.num_bytes, 3)
+
+    def test_evicts_least_recently_used_content(self):
+        cache = ContentCache(max_bytes=6)
+
+        cache.put('a', b'123')
+        cache.put('b', b'456')
+        cache.get('a')
+        cache.put('c', b'789')
+
+        self.assertEqual(cache.get('a'), b'123')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'789')
+        self.assertEqual(cache.num_bytes, 6)
+
+    def test_keeps_shared_content_until_last_reference_is_evicted(self):
+        cache = ContentCache(max_bytes=6)
+
+        cache.put('a', b'123')
+        cache.put('b', b'123')
+        cache.put('c', b'456')
+        cache.put('d', b'789')
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.num_bytes, 6)
+
+    def test_replaces_content_for_existing_key(self):
+        cache = ContentCache(max_bytes=10)
+
+        cache.put('a', b'123')
+        cache.put('a', b'4567')
+
+        self.assertEqual(cache.get('a'), b'4567')
+        self.assertEqual(cache.num_bytes, 4)
+
+    def test_skips_content_larger_than_item_limit(self):
+        cache = ContentCache(max_bytes=10, max_item_bytes=2)
+
+        cache.put('a', b'123')
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.num_bytes, 0)
+
+    def test_clear(self):
+        cache = ContentCache(max_bytes=10)
+        cache.put('a', b'123')
+
+        cache.clear()
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.num_bytes, 0)
+
+
+class FileCacheTests(TestCase):
+    def setUp(self):
+        self.root = TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def test_returns_none_for_missing_key(self):
+        cache = FileCache(self.root.name, max_bytes=10)
+
+        self.assertIsNone(cache.get('missing'))
+
+    def test_stores_and_fetches_content(self):
+        cache = FileCache(self.root.name, max_bytes=10)
+
+        cache.put('key', self._spool(b'abc'))
+        content = self._get(cache, 'key')
+
+        self.assertEqual(content.read(), b'abc')
+        self.assertEqual(cache.num_bytes, 3)
+
+    def test_fetched_content_can_be_removed(self):
+        cache = FileCache(self.root.name, max_bytes=10)
+        cache.put('key', self._spool(b'abc'))
+
+        self._get(cache, 'key').remove()
+
+        self.assertEqual(self._get(cache, 'key').read(), b'abc')
+
+    def test_evicts_least_recently_used_content(self):
+        cache = FileCache(self.root.name, max_bytes=6)
+
+        cache.put('a', self._spool(b'aaa'))
+        cache.put('b', self._spool(b'bbb'))
+        self._get(cache, 'a')
+        cache.put('c', self._spool(b'ccc'))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(self._get(cache, 'a').read(), b'aaa')
+        self.assertEqual(self._get(cache, 'c').read(), b'ccc')
+        self.assertEqual(len(listdir(self.root.name)), 2)
+
+    def test_replaces_content_for_existing_key(self):
+        cache = FileCache(self.root.name, max_bytes=10)
+
+        cache.put('key', self._spool(b'abc'))
+        cache.put('key', self._spool(b'de'))
+
+        self.assertEqual(self._get(cache, 'key').read(), b'de')
+        self.assertEqual(cache.num_bytes, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_skips_content_larger_than_item_limit(self):
+        cache = FileCache(self.root.name, max_bytes=10, max_item_bytes=2)
+
+        cache.put('key', self._spool(b'abc'))
+
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.num_bytes, 0)
+
+    def test_picks_up_content_stored_by_other_processes(self):
+        FileCache(self.root.name, max_bytes=10).put('key', self._spool(b'abc'))
+        cache = FileCache(self.root.name, max_bytes=10)
+
+        self.assertEqual(self._get(cache, 'key').read(), b'abc')
+        self.assertEqual(cache.num_bytes, 3)
+
+    def test_evicts_content_left_over_from_earlier_processes(self):
+        previous = FileCache(self.root.name, max_bytes=10)
+        previous.put('a', self._spool(b'aaa'))
+        previous.put('b', self._spool(b'bbb'))
+
+        cache = FileCache(self.root.name, max_bytes=3)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(self._get(cache, 'b').read(), b'bbb')
+        self.assertEqual(cache.num_bytes, 3)
+
+    def test_enforces_limit_across_processes(self):
+        first = FileCache(self.root.name, max_bytes=6)
+        second = FileCache(self.root.name, max_bytes=6)
+
+        first.put('a', self._spool(b'aaa'))
+        second.put('b', self._spool(b'bbb'))
+        self._get(second, 'a')
+        first.put('c', self._spool(b'ccc'))
+
+        self.assertIsNone(first.get('b'))
+        self.assertEqual(len(listdir(self.root.name)), 2)
+        self.assertEqual(second.num_bytes, 6)
+
+    def _spool(self, content: bytes) -> SpooledBytes:
+        spooled = SpooledBytes.spool([content])
+        self.addCleanup(spooled.remove)
+        return spooled
+
+    def _get(self, cache: FileCache, key: str) -> SpooledBytes:
+        content = cache.get(key)
+        self.addCleanup(content.remove)
+        return content
+
+
+class TTLCacheTests(TestCase):
+    def test_returns_default_for_missing_key(self):
+        cache = TTLCache(ttl_seconds=10)
+
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+
+    def test_stores_and_expires_values(self):
+        now = [100.0]
+        cache = TTLCache(ttl_seconds=10, clock=lambda: now[0])
+
+        cache.put('a', None)
+        cache.put('b', 2, ttl_seconds=20)
+        now[0] += 15
+
+        self.assertEqual(cache.get('a', 'expired'), 'expired')
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_oldest_items(self):
+        cache = TTLCache(ttl_seconds=10, max_items=2)
+
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('c', 3)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_delete_and_clear(self):
+        cache = TTLCache(ttl_seconds=10)
+        cache.put('a', 1)
+        cache.put('b', 2)
+
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTests(TestCase):
+    def test_returns_result(self):
+        single_flight = SingleFlight()
+
+        self.assertEqual(single_flight('a', lambda: 1), 1)
+        self.assertEqual(single_flight('a', lambda: 2), 2)
+
+    def test_raises_error(self):
+        single_flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            single_flight('a', fail)
+
+        self.assertEqual(single_flight('a', lambda: 1), 1)
+
+    def test_coalesces_concurrent_calls(self):
+        single_flight = SingleFlight()
+        started = Event()
+        release = Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            first = executor.submit(single_flight, 'a', slow)
+            started.wait()
+            others = [executor.submit(single_flight, 'a', slow) for _ in range(2)]
+            sleep(0.1)
+            release.set()
+            results = [future.result() for future in [first] + others]
+
+        self.assertEqual(results, ['result'] * 3)
+        self.assertEqual(len(calls), 1)
@@ -2,6 +2,7 @@ from enum import Enum
 from enum import unique
 from os.path import abspath
 from os.path import dirname
+from os.path import isfile
 from os.path import join
 from unittest import TestCase
 from unittest.mock import patch
@@ -9,6 +10,10 @@ from unittest.mock import patch
 from responses import mock as mock_responses
 
 from opwen_email_server.utils import email_parser
+from opwen_email_server.utils import image
+from opwen_email_server.utils.cache import ContentCache
+from opwen_email_server.utils.process import ProcessPool
+from opwen_email_server.utils.temporary import SpooledBytes
 from tests.opwen_email_server.helpers import throw
 
 TEST_DATA_DIRECTORY = abspath(
@@ -89,6 +94,53 @@ class MimeEmailParserTests(ParseMimeEmailTests):
     _parse = email_parser.MimeEmailParser()
 
 
+class SpoolingParseMimeEmailTests(TestCase):
+    def test_spools_large_attachments_to_disk(self):
+        mime_email = self._given_mime_email('email-attachment.mime')
+        expected = email_parser.parse_mime_email(mime_email)['attachments'][0]['content']
+
+        email = email_parser.parse_mime_email(mime_email, spool_bytes=1024)
+        content = email['attachments'][0]['content']
+
+        self.assertIsInstance(content, SpooledBytes)
+        self.assertEqual(content.read(), expected)
+
+        email_parser.remove_spooled_attachments(email)
+        self.assertFalse(isfile(content.path))
+
+    def test_keeps_small_attachments_in_memory(self):
+        mime_email = self._given_mime_email('email-attachment.mime')
+
+        email = email_parser.parse_mime_email(mime_email, spool_bytes=10 * 1024 * 1024)
+
+        self.assertIsInstance(email['attachments'][0]['content'], bytes)
+
+    def test_shrinks_spooled_images(self):
+        mime_email = self._given_mime_email('email-attachment.mime')
+        email = email_parser.parse_mime_email(mime_email, spool_bytes=1024)
+        spooled = email['attachments'][0]['content']
+
+        with patch.object(email_parser, '_shrink_image') as mock_shrink_image:
+            mock_shrink_image.shrink_attachment.return_value = ('small.png', b'small')
+            formatted = email_parser.format_attachments(email)
+
+        self.assertEqual(formatted['attachments'][0]['content'], b'small')
+        self.assertFalse(isfile(spooled.path))
+
+    _given_mime_email = ParseMimeEmailTests._given_mime_email
+
+
+class MimeEmailParserWithProcessPoolTests(ParseMimeEmailTests):
+    @classmethod
+    def setUpClass(cls):
+        cls._pool = ProcessPool(processes=1, timeout_seconds=30)
+        cls._parse = email_parser.MimeEmailParser(process_pool=cls._pool)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._pool.close()
+
+
 class GetDomainsTests(TestCase):
     def test_gets_domains(self):
         email = {'to': ['foo@bar.com', 'baz@bar.com', 'foo@com']}
@@ -105,6 +157,16 @@ class GetDomainsTests(TestCase):
         self.assertSetEqual(set(domains), {'bar.com', 'com'})
 
 
+class GetEmailSizeTests(TestCase):
+    def test_counts_body_and_attachments(self):
+        email = {'body': 'hello', 'attachments': [{'content': b'1234'}, {'content': b''}, {}]}
+
+        self.assertEqual(email_parser.get_email_size(email), 9)
+
+    def test_empty_email(self):
+        self.assertEqual(email_parser.get_email_size({'body': None}), 0)
+
+
 class GetReceipientsTests(TestCase):
     def test_get_recipients(self):
         email = {'to': ['foo@bar.com'], 'cc': ['baz@bar.com', 'foo@com']}
@@ -120,12 +182,12 @@ class ResizeImageTests(TestCase):
 
     def test_change_image_size(self):
         input_bytes = _given_test_image(size=ImageSize.large)
-        output_bytes = email_parser._change_image_size(input_bytes)
+        output_bytes = email_parser._shrink_image(input_bytes)[0]
         self.assertNotEqual(input_bytes, output_bytes, self.error_message)
 
     def test_change_image_size_when_already_small(self):
         input_bytes = _given_test_image(size=ImageSize.small)
-        output_bytes = email_parser._change_image_size(input_bytes)
+        output_bytes = email_parser._shrink_image(input_bytes)[0]
         self.assertEqual(input_bytes, output_bytes, self.error_message)
 
 
@@ -150,7 +212,7 @@ class ConvertImgUrlToBase64Tests(TestCase):
         self.assertStartsWith(output_email['body'], '<div><h3>test image</h3><img src="data:image/png;')
 
     @mock_responses.activate
-    @patch.object(email_parser, 'Image')
+    @patch.object(image, 'Image')
     def test_handles_exceptions_when_processing_image(self, mock_pil):
         mock_pil.open.side_effect = throw(IOError())
         handled_errors = []
@@ -214,6 +276,48 @@ class ConvertImgUrlToBase64Tests(TestCase):
 
         self.assertStartsWith(output_email['body'], '<div><img src="data:image/png;')
 
+    @mock_responses.activate
+    def test_format_inline_images_fetches_each_url_once(self):
+        self.givenTestImage(url='http://test-url-1.png')
+        self.givenTestImage(url='http://test-url-2.png')
+        input_email = {
+            'body':
+            '<div><img src="http://test-url-1.png"/><img src="http://test-url-2.png"/>'
+            '<img src="http://test-url-1.png"/></div>'
+        }
+        fetch_images = email_parser.InlineImageFetcher(max_workers=2)
+
+        output_email = email_parser.format_inline_images(input_email, self.fail_if_called, fetch_images)
+
+        self.assertHasCount(output_email['body'], 'src="data:', 3)
+        self.assertEqual(len(mock_responses.calls), 2)
+
+    @mock_responses.activate
+    def test_format_inline_images_with_cache(self):
+        self.givenTestImage()
+        input_email = {'body': '<div><img src="http://test-url.png"/></div>'}
+        cache = ContentCache(max_bytes=1024 * 1024)
+        fetch_images = email_parser.InlineImageFetcher(cache=cache)
+
+        first_email = email_parser.format_inline_images(input_email, self.fail_if_called, fetch_images)
+        second_email = email_parser.format_inline_images(input_email, self.fail_if_called, fetch_images)
+
+        self.assertEqual(first_email, second_email)
+        self.assertEqual(len(mock_responses.calls), 1)
+        self.assertEqual(len(cache), 1)
+
+    @mock_responses.activate
+    def test_format_inline_images_does_not_cache_failures(self):
+        self.givenTestImage(status=404)
+        input_email = {'body': '<div><img src="http://test-url.png"/></div>'}
+        cache = ContentCache(max_bytes=1024 * 1024)
+        fetch_images = email_parser.InlineImageFetcher(cache=cache)
+
+        output_email = email_parser.format_inline_images(input_email, self.fail_if_called, fetch_images)
+
+        self.assertEqual(output_email, input_email)
+        self.assertEqual(len(cache), 0)
+
     def assertStartsWith(self, data, prefix):
         self.assertEqual(data[:len(prefix)], prefix)
 
@@ -348,3 +452,52 @@ class DescendingTimestampTests(TestCase):
 
         timestamp_ordering = sorted([january_22h09m_timestamp, january_22h11m_timestamp])
         self.assertEqual(timestamp_ordering, [january_22h11m_timestamp, january_22h09m_timestamp])
+
+
+class SummarizeEmailTests(TestCase):
+    def test_summarize_email(self):
+        email = {
+            '_uid': '123',
+            'from': 'foo@bar.com',
+            'to': ['baz@bar.com'],
+            'subject': 'hello',
+            'sent_at': '2020-02-01 21:09',
+            'body': '<p>Hello <b>world</b></p>\n<p>again</p>',
+            'attachments': [{'filename': 'a.txt', 'content': b'12345'}],
+        }
+
+        summary = email_parser.summarize_email(email)
+
+        self.assertEqual(
+            summary, {
+                'from': 'foo@bar.com',
+                'to': ['baz@bar.com'],
+                'cc': None,
+                'subject': 'hello',
+                'sent_at': '2020-02-01 21:09',
+                'snippet': 'Hello world again',
+                'attachments': [{'filename': 'a.txt', 'size': 5}],
+            })
+
+    def test_get_snippet_truncates(self):
+        snippet = email_parser.get_snippet('word ' * 100, max_length=12)
+
+        self.assertEqual(snippet, 'word word wo...')
+
+    def test_get_snippet_without_body(self):
+        self.assertEqual(email_parser.get_snippet(None), '')
+
+
+class GetSearchTermsTests(TestCase):
+    def test_get_search_terms(self):
+        email = {
+            'from': 'foo@bar.com',
+            'to': ['baz@bar.com'],
+            'subject': 'Weekly report',
+            'body': '<p>See <b>attached</b></p>',
+            'attachments': [{'filename': 'numbers.xls'}],
+        }
+
+        terms = email_parser.get_search_terms(email)
+
+        self.assertEqual(terms, {'foo', 'bar', 'com', 'baz', 'weekly', 'report', 'see', 'attached', 'numbers', 'xls'})
@@ -0,0 +1,142 @@
+from io import BytesIO
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from unittest import TestCase
+
+from PIL import Image
+
+from opwen_email_server.utils import image
+
+TEST_DATA_DIRECTORY = abspath(
+    join(dirname(__file__), '..', '..', 'files', 'opwen_email_server', 'utils', 'test_email_parser'))
+
+
+def _given_image(image_format: str, size=(800, 600), mode='RGB') -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert(mode).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def _given_test_image(name: str) -> bytes:
+    with open(join(TEST_DATA_DIRECTORY, name), 'rb') as fobj:
+        return fobj.read()
+
+
+def _size_of(content: bytes):
+    return Image.open(BytesIO(content)).size
+
+
+def _format_of(content: bytes):
+    return Image.open(BytesIO(content)).format
+
+
+class ImageShrinkerTests(TestCase):
+    def test_shrinks_large_jpeg(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+        content = _given_image('JPEG')
+
+        small_content, image_format = shrink(content)
+
+        self.assertEqual(image_format, 'JPEG')
+        self.assertEqual(_size_of(small_content), (200, 150))
+        self.assertLess(len(small_content), len(content))
+
+    def test_shrinks_large_png(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+        content = _given_image('PNG')
+
+        small_content, image_format = shrink(content)
+
+        self.assertEqual(image_format, 'PNG')
+        self.assertEqual(_size_of(small_content), (200, 150))
+
+    def test_keeps_small_image(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+        content = _given_image('JPEG', size=(100, 100))
+
+        small_content, image_format = shrink(content)
+
+        self.assertIs(small_content, content)
+        self.assertEqual(image_format, 'JPEG')
+
+    def test_converts_to_output_format(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200, output_format='webp')
+        content = _given_image('PNG')
+
+        small_content, image_format = shrink(content)
+
+        self.assertEqual(image_format, 'WEBP')
+        self.assertEqual(_format_of(small_content), 'WEBP')
+        self.assertEqual(_size_of(small_content), (200, 150))
+
+    def test_skips_conversion_that_does_not_save_bytes(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200, output_format='png')
+        content = _given_image('JPEG', size=(100, 100))
+
+        small_content, image_format = shrink(content)
+
+        self.assertIs(small_content, content)
+        self.assertEqual(image_format, 'JPEG')
+
+    def test_reduces_quality_to_meet_byte_budget(self):
+        content = _given_image('JPEG')
+        unbounded_content, _ = image.ImageShrinker(max_width=400, max_height=400)(content)
+        max_bytes = len(unbounded_content) // 2
+        shrink = image.ImageShrinker(max_width=400, max_height=400, max_bytes=max_bytes)
+
+        small_content, _ = shrink(content)
+
+        self.assertLessEqual(len(small_content), max_bytes)
+
+    def test_reencodes_small_image_above_byte_budget(self):
+        content = _given_image('JPEG', size=(150, 150))
+        shrink = image.ImageShrinker(max_width=200, max_height=200, max_bytes=len(content) // 2)
+
+        small_content, image_format = shrink(content)
+
+        self.assertEqual(image_format, 'JPEG')
+        self.assertLess(len(small_content), len(content))
+        self.assertEqual(_size_of(small_content), (150, 150))
+
+    def test_converts_modes_unsupported_by_jpeg(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200, output_format='jpeg')
+        content = _given_image('PNG', mode='RGBA')
+
+        small_content, image_format = shrink(content)
+
+        self.assertEqual(image_format, 'JPEG')
+        self.assertEqual(_format_of(small_content), 'JPEG')
+
+    def test_shrinks_test_image(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+        content = _given_test_image('large.png')
+
+        small_content, _ = shrink(content)
+
+        self.assertNotEqual(small_content, content)
+
+
+class ShrinkAttachmentTests(TestCase):
+    def test_ignores_non_image_attachment(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+
+        filename, content = shrink.shrink_attachment('notes.txt', b'not an image')
+
+        self.assertEqual(filename, 'notes.txt')
+        self.assertEqual(content, b'not an image')
+
+    def test_keeps_filename_when_format_is_unchanged(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200)
+
+        filename, _ = shrink.shrink_attachment('photo.jpeg', _given_image('JPEG'))
+
+        self.assertEqual(filename, 'photo.jpeg')
+
+    def test_renames_attachment_when_format_changes(self):
+        shrink = image.ImageShrinker(max_width=200, max_height=200, output_format='webp')
+
+        filename, content = shrink.shrink_attachment('photo.final.png', _given_image('PNG'))
+
+        self.assertEqual(filename, 'photo.final.webp')
+        self.assertEqual(_format_of(content), 'WEBP')
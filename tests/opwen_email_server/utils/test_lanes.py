@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from opwen_email_server.utils.lanes import lane_for
+from opwen_email_server.utils.lanes import lane_queue
+
+
+class LaneForTests(TestCase):
+    def test_is_stable_and_case_insensitive(self):
+        self.assertEqual(lane_for('school.lokole.ca', 8), lane_for('School.Lokole.CA', 8))
+
+    def test_is_within_bounds(self):
+        lanes = {lane_for(f'client{i}.lokole.ca', 4) for i in range(100)}
+
+        self.assertEqual(lanes, {0, 1, 2, 3})
+
+    def test_single_lane(self):
+        self.assertEqual(lane_for('school.lokole.ca', 1), 0)
+        self.assertEqual(lane_for('school.lokole.ca', 0), 0)
+
+
+class LaneQueueTests(TestCase):
+    def test_picks_queue_for_domain(self):
+        queues = ('send', 'send1', 'send2')
+
+        queue = lane_queue(queues, 'school.lokole.ca')
+
+        self.assertEqual(queue, queues[lane_for('school.lokole.ca', 3)])
+
+    def test_single_queue(self):
+        self.assertEqual(lane_queue(('send', ), 'school.lokole.ca'), 'send')
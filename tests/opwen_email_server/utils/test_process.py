@@ -0,0 +1,90 @@
+from os import getpid
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+
+from opwen_email_server.utils.process import PoolTimeoutError
+from opwen_email_server.utils.process import ProcessPool
+
+
+def _square(value):
+    return value * value
+
+
+def _sleep(seconds):
+    sleep(seconds)
+
+
+def _sleep_and_square(seconds, value):
+    sleep(seconds)
+    return value * value
+
+
+def _pid():
+    return getpid()
+
+
+def _allocate(num_bytes):
+    return len(bytearray(num_bytes))
+
+
+class ProcessPoolTests(TestCase):
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def test_runs_function_in_pool(self):
+        self.pool = ProcessPool(processes=1, timeout_seconds=10)
+
+        self.assertEqual(self.pool(_square, 3), 9)
+
+    def test_restarts_pool_after_timeout(self):
+        self.pool = ProcessPool(processes=1, timeout_seconds=0.5)
+
+        with self.assertRaises(PoolTimeoutError):
+            self.pool(_sleep, 5)
+
+        self.assertEqual(self.pool(_square, 4), 16)
+
+    def test_limits_memory_of_workers(self):
+        self.pool = ProcessPool(processes=1, timeout_seconds=10, max_memory_bytes=512 * 1024 * 1024)
+
+        with self.assertRaises(MemoryError):
+            self.pool(_allocate, 1024 * 1024 * 1024)
+
+        self.assertEqual(self.pool(_allocate, 1024), 1024)
+
+    def test_timeout_does_not_interrupt_other_callers(self):
+        self.pool = ProcessPool(processes=2, timeout_seconds=2)
+        errors = []
+
+        def run_slow_task():
+            try:
+                self.pool(_sleep, 10)
+            except PoolTimeoutError as ex:
+                errors.append(ex)
+
+        slow_task = Thread(target=run_slow_task)
+        slow_task.start()
+        sleep(1)
+
+        self.assertEqual(self.pool(_sleep_and_square, 1.5, 5), 25)
+        slow_task.join()
+        self.assertEqual(len(errors), 1)
+
+    def test_reraises_errors_and_reuses_worker(self):
+        self.pool = ProcessPool(processes=1, timeout_seconds=10)
+        pid = self.pool(_pid)
+
+        with self.assertRaises(TypeError):
+            self.pool(_square, None)
+
+        self.assertEqual(self.pool(_pid), pid)
+
+    def test_recycles_worker_after_max_tasks(self):
+        self.pool = ProcessPool(processes=1, timeout_seconds=10, max_tasks_per_child=1)
+
+        self.assertNotEqual(self.pool(_pid), self.pool(_pid))
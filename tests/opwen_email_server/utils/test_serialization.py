@@ -1,6 +1,7 @@
 from unittest import TestCase
 
 from opwen_email_server.utils import serialization
+from opwen_email_server.utils.temporary import SpooledBytes
 
 
 class JsonTests(TestCase):
@@ -33,6 +34,35 @@ class MsgpackTests(TestCase):
 
         self.assertEqual(original, deserialized)
 
+    def test_roundtrip_payload_ending_with_newline_byte(self):
+        original = {'updated_at': 10}
+        serialized = serialization.to_msgpack_bytes(original)
+        deserialized = serialization.from_msgpack_bytes(serialized)
+
+        self.assertEqual(serialized[-2:], b'\n\n')
+        self.assertEqual(original, deserialized)
+
+
+class WriteMsgpackTests(TestCase):
+    def test_matches_msgpack_bytes(self):
+        obj = {'a': [1, 'b', None, b'c' * 300], 'd': {'e': b'f' * 70000}, 'g': (True, 1.5)}
+        written = []
+
+        serialization.write_msgpack(obj, written.append)
+
+        self.assertEqual(b''.join(written), serialization.to_msgpack_bytes(obj))
+
+    def test_streams_spooled_bytes(self):
+        spooled = SpooledBytes.spool([b'a' * 40000, b'b' * 40000])
+        self.addCleanup(spooled.remove)
+        written = []
+
+        serialization.write_msgpack({'content': spooled}, written.append)
+        deserialized = serialization.from_msgpack_bytes(b''.join(written))
+
+        self.assertEqual(deserialized, {'content': b'a' * 40000 + b'b' * 40000})
+        self.assertEqual(b''.join(written), serialization.to_msgpack_bytes({'content': spooled}))
+
 
 class JsonlTests(TestCase):
     def test_roundtrip(self):
@@ -1,6 +1,7 @@
 from unittest import TestCase
 
 from opwen_email_server.utils.string import is_lowercase
+from opwen_email_server.utils.string import tokenize
 from opwen_email_server.utils.string import urlsafe
 
 
@@ -15,3 +16,11 @@ class IsLowercaseTests(TestCase):
 class UrlsafeTests(TestCase):
     def test_url_characters(self):
         self.assertEqual(urlsafe('foo/bar=baz'), 'foo%2Fbar%3Dbaz')
+
+
+class TokenizeTests(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Hello, foo@Bar.com! a'), {'hello', 'foo', 'bar', 'com'})
+
+    def test_tokenize_empty(self):
+        self.assertEqual(tokenize(None), set())
@@ -68,3 +68,28 @@ class RemovingTests(TestCase):
     def assertFileDoesNotExist(self, filename):
         if isfile(filename):
             self.fail(f'file {filename} does exists')
+
+
+class SpooledBytesTests(TestCase):
+    def test_spools_chunks_to_file(self):
+        spooled = temporary.SpooledBytes.spool([b'foo', b'bar'], 'file.txt')
+        self.addCleanup(spooled.remove)
+
+        self.assertEqual(len(spooled), 6)
+        self.assertTrue(spooled.path.endswith('.txt'))
+        self.assertEqual(spooled.read(), b'foobar')
+
+    def test_iterates_chunks(self):
+        spooled = temporary.SpooledBytes.spool([b'a' * 10])
+        self.addCleanup(spooled.remove)
+        spooled.chunk_size = 4
+
+        self.assertEqual(list(spooled.iter_chunks()), [b'aaaa', b'aaaa', b'aa'])
+
+    def test_removes_file(self):
+        spooled = temporary.SpooledBytes.spool([b'foo'])
+
+        spooled.remove()
+        spooled.remove()
+
+        self.assertFalse(isfile(spooled.path))
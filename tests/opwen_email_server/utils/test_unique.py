@@ -14,6 +14,16 @@ class NewEmailIdTests(TestCase):
         self.assertEqual(id1, id3)
 
 
+class NewContentHashTests(TestCase):
+    def test_ignores_key_order(self):
+        hash1 = unique.new_content_hash({'email': 'foo', 'password': 'bar'})
+        hash2 = unique.new_content_hash({'password': 'bar', 'email': 'foo'})
+        hash3 = unique.new_content_hash({'email': 'foo', 'password': 'baz'})
+
+        self.assertEqual(hash1, hash2)
+        self.assertNotEqual(hash1, hash3)
+
+
 class NewGuidTests(TestCase):
     def test_is_unique(self):
         new_client_id = unique.NewGuid()